@@ -6,11 +6,11 @@ from database import Base, engine, SessionLocal
 from models import Person
 from embeddings import add_embedding
 from recognition import recognize_face
+from person_directory import directory
+from startup import startup
 from flask_cors import CORS
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
-import tensorflow as tf
-tf.get_logger().setLevel("ERROR")
 
 UPLOAD_FOLDER = "dataset"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -20,6 +20,10 @@ app.config["JSON_AS_ASCII"] = False
 CORS(app)
 
 Base.metadata.create_all(bind=engine)
+# Warm up the model, index and person directory in the background;
+# /health/ready answers 503 until it is done (see startup.py)
+startup.start()
+
 @app.route("/")
 def index():
     return render_template("test.html")
@@ -46,6 +50,18 @@ def health_check():
             "error": str(e)
         }), 500
 
+@app.route("/health/live")
+def health_live():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({"status": "alive", "startup": startup.status()})
+
+@app.route("/health/ready")
+def health_ready():
+    """Readiness: 200 once the model, detectors and index are warm, 503 before"""
+    status = startup.status()
+    return jsonify({"status": "ready" if startup.ready else status['state'], "startup": status}), \
+        200 if startup.ready else 503
+
 @app.route("/face-register", methods=["POST"])
 def register():
     name = request.form.get("name")
@@ -78,6 +94,7 @@ def register():
             content_type="application/json; charset=utf-8",
             status=500
         )
+    directory.add_sample(person.id, person.name, filename)
 
     response = {
         "message": "Đăng ký thành công",
@@ -121,4 +138,5 @@ def recognize():
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # No auto-reloader: its parent process would run the warm-up (and load the model) too
+    app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
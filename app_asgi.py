@@ -0,0 +1,450 @@
+"""
+Async (ASGI) face recognition service: the /api/face/* endpoints of
+app_realtime.py on FastAPI, in a single process.
+
+    uvicorn app_asgi:app --host 0.0.0.0 --port 5000
+
+Uploads are read asynchronously and the endpoint logic (face_service.py)
+runs on a bounded thread pool, so slow camera clients only hold a coroutine,
+not a thread or a model copy. All model work still goes through the one
+inference worker, which batches crops from concurrent requests.
+Backpressure: requests that need the model are admitted while fewer than
+ASGI_MAX_INFLIGHT are running and the inference queue holds at most
+ASGI_MAX_QUEUE_DEPTH jobs; otherwise they get 503 with Retry-After instead
+of queueing without bound. Until startup warm-up (startup.py) is done they
+get 503 as well; /health/live and /health/ready are the container probes.
+Cameras can keep one WebSocket open (/api/face/stream/<camera_id>/ws) to
+send frames and receive results instead of one POST per frame.
+"""
+
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from fastapi import FastAPI, Request, UploadFile, File, Form, WebSocket
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, FileResponse, RedirectResponse, StreamingResponse, Response
+
+from config import (UPLOAD_FOLDER, ASGI_EXECUTOR_THREADS, ASGI_MAX_INFLIGHT, ASGI_MAX_QUEUE_DEPTH,
+                    ASGI_QUEUE_POLL_SECONDS, STREAM_HEARTBEAT_SECONDS)
+from database import Base, engine
+from face_pipeline import get_worker
+from recognition import recognize_face
+from startup import startup
+from streaming import StreamRegistry, StreamLimitReached
+from tracking import trackers
+import face_service
+import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+executor = ThreadPoolExecutor(max_workers=ASGI_EXECUTOR_THREADS, thread_name_prefix='asgi')
+streams = StreamRegistry(face_service.process_stream_frame)
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Starting(Exception):
+    pass
+
+
+class Admission:
+    """
+    Counts model requests in flight (event loop thread only, no lock needed).
+    The inference queue depth is polled in the background (poll_queue_depth):
+    with serve.py reading it is a socket round trip, which must not block
+    the event loop on every request.
+    """
+
+    def __init__(self, max_inflight=ASGI_MAX_INFLIGHT, max_queue_depth=ASGI_MAX_QUEUE_DEPTH):
+        self.max_inflight = max_inflight
+        self.max_queue_depth = max_queue_depth
+        self.inflight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.queue_depth = 0
+
+    async def poll_queue_depth(self, interval=ASGI_QUEUE_POLL_SECONDS):
+        while True:
+            try:
+                self.queue_depth = await run_blocking(get_worker().queue_depth)
+            except Exception as e:
+                print(f"⚠️ Inference queue depth unavailable: {e}")
+            await asyncio.sleep(interval)
+
+    def acquire(self):
+        if not startup.accepting():
+            raise Starting()
+        if self.inflight >= self.max_inflight or self.queue_depth > self.max_queue_depth:
+            self.rejected += 1
+            raise Overloaded()
+        self.inflight += 1
+        self.admitted += 1
+
+    def release(self):
+        self.inflight -= 1
+
+    def stats(self):
+        return {
+            'inflight': self.inflight,
+            'max_inflight': self.max_inflight,
+            'inference_queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+        }
+
+
+admission = Admission()
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run blocking work (DB, FAISS, files) on the executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(fn, *args, **kwargs))
+
+
+async def run_model(fn, *args, **kwargs):
+    """Run work that needs the model, subject to admission control."""
+    admission.acquire()
+    try:
+        return await run_blocking(fn, *args, **kwargs)
+    finally:
+        admission.release()
+
+
+def respond(result):
+    body, status = result
+    return JSONResponse(body, status_code=status)
+
+
+def host_of(request):
+    url = request.base_url
+    if url.scheme in ('ws', 'wss'):  # WebSocket: photo links are still HTTP(S)
+        url = url.replace(scheme='https' if url.scheme == 'wss' else 'http')
+    return str(url).rstrip('/')
+
+
+@asynccontextmanager
+async def lifespan(app):
+    Base.metadata.create_all(bind=engine)
+    # Warm up the model, index and person directory in the background, so the
+    # probes answer while it runs (/health/ready turns 200 when it is done)
+    startup.start()
+    poller = asyncio.create_task(admission.poll_queue_depth())
+    yield
+    poller.cancel()
+    executor.shutdown(wait=False)
+
+
+app = FastAPI(title="Face Recognition", lifespan=lifespan)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request, exc):
+    return JSONResponse({"status": "error", "message": "Server busy, retry later"},
+                        status_code=503, headers={"Retry-After": "1"})
+
+
+@app.exception_handler(Starting)
+async def starting_handler(request, exc):
+    return JSONResponse({"status": "error", "message": "Service starting, retry later"},
+                        status_code=503, headers={"Retry-After": "1"})
+
+
+@app.exception_handler(StreamLimitReached)
+async def stream_limit_handler(request, exc):
+    return JSONResponse({"status": "error", "message": str(exc)}, status_code=503, headers={"Retry-After": "5"})
+
+
+@app.exception_handler(Exception)
+async def error_handler(request, exc):
+    import traceback
+    print(f"❌ {request.url.path} error:", traceback.format_exc())
+    return JSONResponse({"status": "error", "message": str(exc)}, status_code=500)
+
+
+# -- Pages ------------------------------------------------------------------
+
+@app.get('/')
+async def home():
+    return RedirectResponse('/smart-camera')
+
+
+@app.get('/realtime')
+async def realtime():
+    return FileResponse(os.path.join(BASE_DIR, 'realtime_face_recognition.html'))
+
+
+@app.get('/smart-camera')
+async def smart_camera():
+    return FileResponse(os.path.join(BASE_DIR, 'smart_camera.html'))
+
+
+@app.get('/dataset/{filename}')
+async def serve_dataset_file(filename: str):
+    """Serve files from dataset folder (registered photos)."""
+    path = os.path.join(UPLOAD_FOLDER, os.path.basename(filename))
+    if not os.path.isfile(path):
+        return JSONResponse({"status": "error", "message": "Not found"}, status_code=404)
+    return FileResponse(path)
+
+
+@app.get('/health')
+async def health():
+    return {
+        "status": "healthy",
+        "service": "face-recognition",
+        "message": "Face recognition service is running",
+        "ready": startup.ready,
+        "startup": startup.status(),
+        "admission": admission.stats()
+    }
+
+
+@app.get('/health/live')
+async def health_live():
+    return {"status": "alive", "startup": startup.status()}
+
+
+@app.get('/health/ready')
+async def health_ready():
+    status = startup.status()
+    return JSONResponse({"status": "ready" if startup.ready else status['state'], "startup": status},
+                        status_code=200 if startup.ready else 503)
+
+
+# -- /api/face ----------------------------------------------------------------
+
+@app.post('/api/face/register')
+async def register_face(request: Request, image: UploadFile = File(None), name: str = Form(None)):
+    if image is None:
+        return JSONResponse({"status": "error", "message": "No image provided"}, status_code=400)
+    if not name:
+        return JSONResponse({"status": "error", "message": "No name provided"}, status_code=400)
+    img_bytes = await image.read()
+    if not img_bytes:
+        return JSONResponse({"status": "error", "message": "No image selected"}, status_code=400)
+    return respond(await run_model(face_service.register_person, name, img_bytes, host_of(request)))
+
+
+@app.post('/api/face/recognize')
+async def recognize_face_api(request: Request, image: UploadFile = File(None), camera_id: str = Form(None),
+                             fast: str = Form(None), k: int = 1):
+    if image is None:
+        return JSONResponse({"status": "error", "message": "No image provided"})
+    img_bytes = await image.read()
+    if not img_bytes:
+        return JSONResponse({"status": "error", "message": "No image selected"})
+    camera_id = request.query_params.get('camera_id') or camera_id
+    fast = face_service.parse_flag(request.query_params.get('fast', fast))
+    return respond(await run_model(face_service.recognize_image, img_bytes, host_of(request),
+                                   k=k, camera_id=camera_id, fast=fast))
+
+
+@app.post('/api/face/compare')
+async def compare_face(image: UploadFile = File(None), k: int = 5):
+    if image is None:
+        return JSONResponse({'status': 'error', 'message': 'No image provided'}, status_code=400)
+    img_bytes = await image.read()
+    if not img_bytes:
+        return JSONResponse({'status': 'error', 'message': 'Empty filename'}, status_code=400)
+    return respond(await run_model(face_service.compare_image, img_bytes, k=k))
+
+
+@app.get('/api/face/persons')
+async def get_persons(request: Request):
+    return respond(await run_blocking(face_service.list_persons, host_of(request)))
+
+
+@app.delete('/api/face/persons/{person_id}')
+async def delete_person(person_id: int):
+    return respond(await run_blocking(face_service.delete_person, person_id))
+
+
+@app.put('/api/face/persons/{person_id}/photo')
+async def replace_person_photo(request: Request, person_id: int, image: UploadFile = File(None)):
+    img_bytes = await image.read() if image is not None else b''
+    if not img_bytes:
+        return JSONResponse({"status": "error", "message": "No image provided"}, status_code=400)
+    return respond(await run_model(face_service.replace_photo, person_id, img_bytes, host_of(request)))
+
+
+@app.get('/api/face/debug')
+async def debug_status():
+    body, status = await run_blocking(face_service.debug_info)
+    body['admission'] = admission.stats()
+    return JSONResponse(body, status_code=status)
+
+
+@app.get('/metrics')
+async def prometheus_metrics():
+    text = await run_blocking(metrics.registry.render)
+    return Response(text, headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+@app.get('/api/face/metrics')
+async def metrics_summary():
+    return respond(await run_blocking(face_service.metrics_summary))
+
+
+@app.post('/api/face/rebuild')
+async def rebuild_index(workers: int = None, force: str = None, wait: str = None):
+    return respond(await run_blocking(face_service.rebuild, workers=workers, use_cache=force != '1',
+                                      wait=wait == '1'))
+
+
+@app.get('/api/face/rebuild/status')
+async def rebuild_status():
+    return respond(face_service.rebuild_status())
+
+
+@app.post('/api/face/rebuild/cancel')
+async def rebuild_cancel():
+    return respond(face_service.rebuild_cancel())
+
+
+# -- Legacy endpoints of app.py (kept for existing integrations) -----------------
+
+@app.post('/face-register')
+async def legacy_register(request: Request, file: UploadFile = File(None), name: str = Form(None)):
+    img_bytes = await file.read() if file is not None else b''
+    if not name or not img_bytes:
+        return JSONResponse({"error": "Thiếu tên hoặc ảnh"}, status_code=400)
+    body, status = await run_model(face_service.register_person, name, img_bytes, host_of(request))
+    if status != 200:
+        return JSONResponse({"error": "Không thêm được embedding"}, status_code=500)
+    return {
+        "message": "Đăng ký thành công",
+        "person_id": body["person_id"],
+        "name": body["name"],
+        "file": body["photo"].rsplit('/', 1)[-1]
+    }
+
+
+@app.post('/face-recognition')
+async def legacy_recognize(file: UploadFile = File(None)):
+    img_bytes = await file.read() if file is not None else b''
+    if not img_bytes:
+        return JSONResponse({"error": "Thiếu ảnh"}, status_code=400)
+    name, distance = await run_model(recognize_face, img_bytes)
+    return {"status": "success", "name": name, "distance": distance, "file": None}
+
+
+# -- Streaming (see app_realtime.py / streaming.py) -----------------------------
+
+@app.post('/api/face/stream/{camera_id}/frame')
+async def stream_frame(camera_id: str, request: Request, k: int = 1):
+    if not face_service.valid_camera_id(camera_id):
+        return JSONResponse({'status': 'error', 'message': 'Invalid camera id'}, status_code=400)
+    if request.headers.get('content-type', '').startswith('multipart/'):
+        form = await request.form()
+        image = form.get('image')
+        frame = await image.read() if image is not None else b''
+    else:
+        frame = await request.body()
+    if not frame:
+        return JSONResponse({'status': 'error', 'message': 'No image provided'}, status_code=400)
+
+    # Pushing only replaces the camera's pending frame, so it never blocks
+    context = {'host': host_of(request), 'k': max(1, k), 'camera_id': camera_id,
+               'fast': face_service.parse_flag(request.query_params.get('fast'))}
+    stream, seq = streams.push(camera_id, frame, context)
+    return JSONResponse({'status': 'accepted', 'camera_id': camera_id, 'seq': seq, 'dropped': stream.dropped},
+                        status_code=202)
+
+
+@app.get('/api/face/stream/{camera_id}/events')
+async def stream_events(camera_id: str, request: Request):
+    if not face_service.valid_camera_id(camera_id):
+        return JSONResponse({'status': 'error', 'message': 'Invalid camera id'}, status_code=400)
+
+    loop = asyncio.get_running_loop()
+    results = asyncio.Queue(maxsize=2)
+
+    def offer(result):
+        if results.full():
+            results.get_nowait()
+        results.put_nowait(result)
+
+    stream, handle = streams.subscribe(camera_id, lambda result: loop.call_soon_threadsafe(offer, result))
+
+    async def generate():
+        try:
+            yield 'retry: 2000\n\n'
+            while not await request.is_disconnected():
+                try:
+                    result = await asyncio.wait_for(results.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: result\ndata: {json.dumps(result)}\n\n"
+        finally:
+            stream.unsubscribe(handle)
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.websocket('/api/face/stream/{camera_id}/ws')
+async def stream_socket(websocket: WebSocket, camera_id: str, k: int = 1):
+    """
+    Persistent camera connection: each binary message is a frame (JPEG/PNG),
+    each result goes back as a JSON text message. A text message
+    {"k": ..., "fast": ...} changes the settings of the following frames.
+    """
+    if not face_service.valid_camera_id(camera_id):
+        await websocket.close(code=1008, reason='Invalid camera id')
+        return
+    loop = asyncio.get_running_loop()
+    results = asyncio.Queue(maxsize=2)
+
+    def offer(result):
+        if results.full():
+            results.get_nowait()
+        results.put_nowait(result)
+
+    try:
+        stream, handle = streams.subscribe(camera_id, lambda result: loop.call_soon_threadsafe(offer, result))
+    except StreamLimitReached as e:
+        await websocket.close(code=1013, reason=str(e))  # 1013: try again later
+        return
+    await websocket.accept()
+    context = {'host': host_of(websocket), 'k': max(1, k), 'camera_id': camera_id,
+               'fast': face_service.parse_flag(websocket.query_params.get('fast'))}
+
+    async def send_results():
+        while True:
+            await websocket.send_text(json.dumps(await results.get()))
+
+    sender = asyncio.create_task(send_results())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message.get('bytes'):
+                streams.push(camera_id, message['bytes'], dict(context))
+            elif message.get('text'):
+                try:
+                    settings = json.loads(message['text'])
+                    if 'k' in settings:
+                        context['k'] = max(1, int(settings['k']))
+                    if 'fast' in settings:
+                        context['fast'] = face_service.parse_flag(settings['fast'])
+                except (ValueError, TypeError, AttributeError):
+                    offer({'status': 'error', 'message': 'Invalid settings message'})
+    finally:
+        sender.cancel()
+        stream.unsubscribe(handle)
+
+
+@app.get('/api/face/stream/status')
+async def stream_status():
+    return {'status': 'success', 'streams': streams.stats(), 'trackers': trackers.stats()}
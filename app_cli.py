@@ -1,19 +1,71 @@
+"""
+Command-line entry point for the Go service.
+
+    echo '{"action": "recognize", "image": "a.jpg"}' | python app_cli.py
+
+One-shot mode reads one JSON request from stdin and prints one JSON
+response. Daemon mode keeps the model, index and person directory warm and
+answers newline-delimited JSON requests, one JSON line per response:
+
+    python app_cli.py --daemon                 # requests on stdin, responses on stdout
+    python app_cli.py --socket /tmp/face.sock  # same protocol, per Unix socket connection
+
+Daemon requests carry an "id" that is echoed in the response; requests run
+concurrently (CLI_DAEMON_THREADS), so responses may arrive out of order.
+Actions: register {name, image}, recognize {image, fast}, register_batch
+{items: [{name, image}, ...]}, recognize_batch {images: [...], fast} and
+ping (reports startup phase timings). recognize_batch runs one detector pass
+per image, then one embedding batch and one index search for all of them.
+In daemon mode log output goes to stderr; stdout carries only responses.
+"""
+
 import os
 import sys
 import json
 import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from database import Base, engine, SessionLocal
 from models import Person
-from embeddings import add_embedding
-from recognition import recognize_face
+from embeddings import add_embedding, index_info
+from recognition import recognize_face, recognize_batch, best_match
+from person_directory import directory
+from config import CLI_DAEMON_THREADS
+from startup import startup
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
-import tensorflow as tf
-tf.get_logger().setLevel("ERROR")
 
 UPLOAD_FOLDER = "dataset"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Registrations look up / create the person by name: one at a time
+_register_lock = threading.Lock()
+
+
+def handle_request(request):
+    """Run one request dict and return the response dict."""
+    if not isinstance(request, dict):
+        return {"status": "error", "message": "Request must be a JSON object"}
+    action = request.get("action")
+    name = request.get("name", "")
+    image_path = request.get("image", "")
+
+    if action == "register":
+        return register_face(name, image_path)
+    if action == "recognize":
+        return recognize_face_cli(image_path, fast=bool(request.get("fast")))
+    if action == "register_batch":
+        items = request.get("items") or []
+        return {"status": "success", "results": [register_face(item.get("name", ""), item.get("image", ""))
+                                                 for item in items if isinstance(item, dict)]}
+    if action == "recognize_batch":
+        return {"status": "success", "results": recognize_batch_cli(request.get("images") or [],
+                                                                    fast=bool(request.get("fast")))}
+    if action == "ping":
+        return {"status": "success", "message": "pong", "startup": startup.status()}
+    return {"status": "error", "message": "Invalid action"}
+
+
 def main():
     # Đọc JSON input từ stdin
     try:
@@ -23,27 +75,103 @@ def main():
             return
 
         request = json.loads(input_data)
-
-        action = request.get("action")
-        name = request.get("name", "")
-        image_path = request.get("image", "")
-
-        if action == "register":
-            result = register_face(name, image_path)
-            print(json.dumps(result))
-
-        elif action == "recognize":
-            result = recognize_face_cli(image_path)
-            print(json.dumps(result))
-
-        else:
-            print(json.dumps({"status": "error", "message": "Invalid action"}))
+        print(json.dumps(handle_request(request)))
 
     except json.JSONDecodeError:
         print(json.dumps({"status": "error", "message": "Invalid JSON input"}))
     except Exception as e:
         print(json.dumps({"status": "error", "message": str(e)}))
 
+
+def _answer(line):
+    """Response dict for one request line (errors included), with the request id echoed."""
+    request_id = None
+    try:
+        request = json.loads(line)
+        request_id = request.get("id") if isinstance(request, dict) else None
+        response = handle_request(request)
+    except json.JSONDecodeError:
+        response = {"status": "error", "message": "Invalid JSON input"}
+    except Exception as e:
+        import traceback
+        print(f"❌ Request error: {e}", file=sys.stderr)
+        print(traceback.format_exc(), file=sys.stderr)
+        response = {"status": "error", "message": str(e)}
+    return dict(response, id=request_id)
+
+
+def serve_lines(lines, write, executor):
+    """
+    Answer each JSON line from `lines` on `executor`, calling write(text)
+    with one response line as each finishes. Returns after the input ends
+    and every pending response is written.
+    """
+    lock = threading.Lock()
+    pending = []
+
+    def respond(line):
+        text = json.dumps(_answer(line)) + "\n"
+        with lock:
+            write(text)
+
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", errors="replace")
+        if line.strip():
+            pending.append(executor.submit(respond, line))
+        pending = [f for f in pending if not f.done()]
+    for future in pending:
+        future.result()
+
+
+def warm_up():
+    """Load the model, person directory and index once, before the first request."""
+    startup.run()
+    info = index_info()
+    print(f"📁 Index ready: {info['entries'] if info else 0} entries")
+
+
+def run_daemon(socket_path=None):
+    """Serve JSON-line requests on stdin/stdout, or on a Unix socket if socket_path is given."""
+    out = sys.stdout
+    sys.stdout = sys.stderr  # prints from the pipeline must not corrupt the response stream
+    warm_up()
+    executor = ThreadPoolExecutor(max_workers=CLI_DAEMON_THREADS, thread_name_prefix='cli')
+
+    if socket_path is None:
+        def write(text):
+            out.write(text)
+            out.flush()
+        print("✅ Daemon ready on stdin")
+        serve_lines(sys.stdin, write, executor)
+        executor.shutdown(wait=True)
+        return
+
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            def write(text):
+                self.wfile.write(text.encode("utf-8"))
+                self.wfile.flush()
+            try:
+                serve_lines(self.rfile, write, executor)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # stale socket from a previous run
+    server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    server.daemon_threads = True
+    print(f"✅ Daemon listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+        executor.shutdown(wait=False)
+
+
 def register_face(name, image_path):
     """Register face từ CLI"""
     if not name or not image_path:
@@ -52,45 +180,71 @@ def register_face(name, image_path):
     if not os.path.exists(image_path):
         return {"status": "error", "message": "Image file not found"}
 
+    with _register_lock:
+        return _register_face(name, image_path)
+
+
+def _register_face(name, image_path):
     session = SessionLocal()
-    person = session.query(Person).filter_by(name=name).first()
-    if not person:
-        person = Person(name=name)
-        session.add(person)
-        session.commit()
+    try:
+        person = session.query(Person).filter_by(name=name).first()
+        if not person:
+            person = Person(name=name)
+            session.add(person)
+            session.commit()
 
-    filename = f"{person.id}_{uuid.uuid4().hex}.jpg"
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
+        filename = f"{person.id}_{uuid.uuid4().hex}.jpg"
+        filepath = os.path.join(UPLOAD_FOLDER, filename)
 
-    # Copy file to dataset
-    import shutil
-    shutil.copy2(image_path, filepath)
+        # Copy file to dataset
+        import shutil
+        shutil.copy2(image_path, filepath)
 
-    if not add_embedding(filepath, person.id):
-        return {"status": "error", "message": "Failed to add embedding"}
+        if not add_embedding(filepath, person.id):
+            return {"status": "error", "message": "Failed to add embedding"}
+        directory.add_sample(person.id, person.name, filename)
 
-    session.close()
-    return {
-        "status": "success",
-        "message": "Face registered successfully",
-        "person_id": person.id,
-        "name": person.name
-    }
+        return {
+            "status": "success",
+            "message": "Face registered successfully",
+            "person_id": person.id,
+            "name": person.name
+        }
+    finally:
+        # Daemon mode runs many requests: never leak a session
+        session.close()
 
-def recognize_face_cli(image_path):
+def recognize_face_cli(image_path, fast=False):
     """Recognize face từ CLI"""
     if not image_path or not os.path.exists(image_path):
         return {"status": "error", "message": "Image path required"}
 
-    filename = f"temp_{uuid.uuid4().hex}.jpg"
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    # Read in place: no temp copy in the dataset folder
+    name, distance = recognize_face(image_path, fast=fast)
+    return _recognition_response(name, distance)
+
 
-    # Copy file to dataset
-    import shutil
-    shutil.copy2(image_path, filepath)
+def recognize_batch_cli(image_paths, fast=False):
+    """recognize_face_cli for many images: one embedding batch and one index search for all of them"""
+    results = [{"status": "error", "message": "Image path required"} for _ in image_paths]
+    found = [n for n, path in enumerate(image_paths) if isinstance(path, str) and path and os.path.exists(path)]
+    if not found:
+        return results
+    try:
+        batch = recognize_batch([image_paths[n] for n in found], max_faces=1, fast=fast)
+    except Exception as e:
+        import traceback
+        print(f"❌ Recognition error: {e}")
+        print("📋 Traceback:", traceback.format_exc())
+        for n in found:
+            results[n] = _recognition_response("Error", None)
+        return results
+    for n, (status, faces) in zip(found, batch):
+        results[n] = _recognition_response(*best_match(status, faces))
+    return results
 
-    name, distance = recognize_face(filepath)
 
+def _recognition_response(name, distance):
     return {
         "status": "success",
         "message": "Face recognition completed",
@@ -100,4 +254,9 @@ def recognize_face_cli(image_path):
 
 if __name__ == "__main__":
     Base.metadata.create_all(bind=engine)
-    main()
+    if "--socket" in sys.argv:
+        run_daemon(sys.argv[sys.argv.index("--socket") + 1])
+    elif "--daemon" in sys.argv:
+        run_daemon()
+    else:
+        main()
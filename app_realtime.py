@@ -1,30 +1,27 @@
-from flask import Flask, request, jsonify, send_from_directory
+from startup import startup
+from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
 import os
-import cv2
-import numpy as np
-from PIL import Image
-import io
-import base64
 import json
-from recognition import recognize_face
-from embeddings import add_embedding, load_index
-from config import SIM_THRESHOLD, UPLOAD_FOLDER as CONFIG_UPLOAD_FOLDER, TEMP_FILE_TTL_SECONDS
-from database import SessionLocal
-from models import Person
-import uuid
+import queue
+from config import UPLOAD_FOLDER as CONFIG_UPLOAD_FOLDER, TEMP_FILE_TTL_SECONDS, STREAM_HEARTBEAT_SECONDS
+from streaming import StreamRegistry, StreamLimitReached
+from tracking import trackers
+import face_service
+import metrics
 import warnings
 import threading
 warnings.filterwarnings("ignore", category=UserWarning)
-import tensorflow as tf
-tf.get_logger().setLevel("ERROR")
 import sys
+try:
+    from flask_sock import Sock
+except ImportError:  # optional: without it cameras send one POST per frame
+    Sock = None
 
 # On Windows consoles the default encoding may not support emoji/unicode used
 # in some log prints. Reconfigure stdout/stderr to UTF-8 where possible and
 # enable PYTHONUTF8 to reduce chance of UnicodeEncodeError crashing the app.
 try:
-    import os
     os.environ.setdefault('PYTHONUTF8', '1')
 except Exception:
     pass
@@ -38,31 +35,14 @@ except Exception:
     # will be sanitized where necessary.
     pass
 
-# Reduce TF logs and preload model to avoid per-request heavy initialization
-try:
-    import os
-    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
-except Exception:
-    pass
+# TensorFlow is imported on the first model call (face_pipeline); the model,
+# detectors, index and person directory are warmed up in the background by
+# startup.py, which also drives /health/ready.
 
-READY_MODEL = False
-try:
-    # Preload DeepFace model to warm TF and reduce per-request initialization cost
-    from deepface import DeepFace
-    from config import FACE_MODEL
-    print('Loading face model:', FACE_MODEL)
-    _ = DeepFace.build_model(FACE_MODEL)
-    READY_MODEL = True
-    print('Model preloaded')
-except Exception as e:
-    print('Model preload failed:', str(e))
-
-# Global lock to serialize TensorFlow / DeepFace calls. TensorFlow and some
-# DeepFace backends are not always safe to call concurrently; when multiple
-# requests invoke DeepFace.represent() at the same time the process can hit
-# internal errors ("Retval[0] has already been set"). Use a lock to ensure
-# only one thread accesses the model at a time.
-TF_LOCK = threading.Lock()
+# TensorFlow and some DeepFace backends are not safe to call concurrently
+# ("Retval[0] has already been set"). Instead of a global lock, every model
+# call goes through the inference worker thread (see inference.py), which also
+# batches face crops from concurrent requests into one forward pass.
 
 app = Flask(__name__)
 CORS(app)
@@ -71,7 +51,9 @@ UPLOAD_FOLDER = CONFIG_UPLOAD_FOLDER if CONFIG_UPLOAD_FOLDER else "dataset"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # Background cleaner thread: removes temporary files (temp_*, tmp_recog_crop_*, tmp_compare_*)
-# older than TEMP_FILE_TTL_SECONDS. Runs every 60 seconds.
+# older than TEMP_FILE_TTL_SECONDS. Runs every 60 seconds. The request paths
+# here work on in-memory arrays and no longer write temp files; this only
+# sweeps leftovers from older versions and from app.py.
 def temp_file_cleaner(ttl_seconds=TEMP_FILE_TTL_SECONDS, interval=60):
     import time
     patterns = ('temp_', 'tmp_recog_crop_', 'tmp_compare_')
@@ -101,6 +83,18 @@ def temp_file_cleaner(ttl_seconds=TEMP_FILE_TTL_SECONDS, interval=60):
 cleaner_thread = threading.Thread(target=temp_file_cleaner, args=(), daemon=True)
 cleaner_thread.start()
 
+# Warm up the model, index and person directory (names, photos) in the
+# background; register keeps the directory current afterwards
+startup.start()
+
+
+@app.before_request
+def reject_until_ready():
+    """Model requests (writes under /api/face) get 503 while warm-up is still running."""
+    if request.method in ('POST', 'PUT') and request.path.startswith('/api/face/') and not startup.accepting():
+        return jsonify({"status": "error", "message": "Service starting, retry later"}), 503, \
+            {"Retry-After": "1"}
+
 # Store for real-time recognition results
 recognition_cache = {}
 
@@ -232,7 +226,7 @@ def webcam():
                         });
                         const result = await response.json();
 
-                        const confidence = Math.round(result.distance * 100);
+                        const confidence = Math.round((result.confidence || 0) * 100);
                         document.getElementById('result').textContent =
                             'Recognition: ' + (result.name || 'Unknown') + ' (' + confidence + '% confidence)';
                         document.getElementById('status').textContent =
@@ -252,6 +246,9 @@ def webcam():
     </html>
     '''
 
+# The endpoint logic lives in face_service.py (shared with the ASGI app, app_asgi.py);
+# the handlers here only read the Flask request and serialize the result.
+
 @app.route('/api/face/register', methods=['POST'])
 def register_face():
     """Register face from uploaded image"""
@@ -263,78 +260,18 @@ def register_face():
             return jsonify({"status": "error", "message": "No name provided"}), 400
 
         file = request.files['image']
-        name = request.form['name']
-
         if file.filename == '':
             return jsonify({"status": "error", "message": "No image selected"}), 400
 
-        # Read image bytes and convert
-        img_bytes = file.read()
-        try:
-            img = Image.open(io.BytesIO(img_bytes)).convert('RGB')
-        except Exception as e:
-            import traceback
-            print("❌ Failed to open uploaded image:", e)
-            print(traceback.format_exc())
-            return jsonify({"status": "error", "message": "Invalid image uploaded"}), 400
-
-        session = SessionLocal()
-        try:
-            # Get or create person so we can name the file with person id
-            person = session.query(Person).filter_by(name=name).first()
-            if not person:
-                person = Person(name=name)
-                session.add(person)
-                session.commit()
-                session.refresh(person)
-
-            # Save to file with person id prefix for easy lookup
-            filename = f"{person.id}_{uuid.uuid4().hex}.jpg"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            try:
-                img.save(filepath)
-            except Exception as e:
-                import traceback
-                print("❌ Failed to save uploaded image:", e)
-                print(traceback.format_exc())
-                return jsonify({"status": "error", "message": "Failed to save image"}), 500
-
-            # Add embedding (may raise) and return meaningful errors
-            try:
-                # add_embedding may compute embeddings and update FAISS; serialize to avoid TF concurrency issues
-                with TF_LOCK:
-                    success = add_embedding(filepath, person.id)
-            except Exception as e:
-                import traceback
-                print(f"❌ Error adding embedding for person {person.id}: {e}")
-                print(traceback.format_exc())
-                return jsonify({"status": "error", "message": "Failed to add embedding"}), 500
-
-            if success:
-                # build absolute photo URL for convenience
-                host = request.host_url.rstrip('/')
-                photo_url = f"{host}/dataset/{filename}"
-                return jsonify({
-                    "status": "success",
-                    "message": "Face registered successfully",
-                    "person_id": person.id,
-                    "name": person.name,
-                    "photo": photo_url
-                })
-            else:
-                return jsonify({"status": "error", "message": "Failed to add embedding"}), 500
-        finally:
-            try:
-                session.close()
-            except Exception:
-                pass
+        body, status = face_service.register_person(request.form['name'], file.read(), request.host_url.rstrip('/'))
+        return jsonify(body), status
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
 @app.route('/api/face/recognize', methods=['POST'])
 def recognize_face_api():
-    """Recognize face from uploaded image"""
+    """Recognize every face in the uploaded image"""
     try:
         print("🔍 Received recognition request")
 
@@ -349,165 +286,19 @@ def recognize_face_api():
             return jsonify({"status": "error", "message": "No image selected"})
 
         print(f"📁 Processing image: {file.filename}")
-
-        # Read image
         img_bytes = file.read()
         print(f"📊 Image size: {len(img_bytes)} bytes")
 
-        img = Image.open(io.BytesIO(img_bytes))
-
-        # Save to temporary file
-        filename = f"temp_{uuid.uuid4().hex}.jpg"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        img.save(filepath)
-        print(f"💾 Saved to: {filepath}")
-
-        # Recognize face: compute embedding and query index for top-1 match
-        print("🤖 Starting face recognition...")
-        try:
-            from deepface import DeepFace
-            with TF_LOCK:
-                reps = DeepFace.represent(img_path=filepath, model_name='ArcFace', detector_backend='mtcnn', enforce_detection=False)
-        except Exception as e:
-            print('Recognition deepface error:', e)
-            try:
-                os.remove(filepath)
-            except Exception:
-                pass
-            return jsonify({'status': 'error', 'message': 'Failed to compute embedding'}), 500
-
-        if not reps:
-            try:
-                os.remove(filepath)
-            except Exception:
-                pass
-            return jsonify({'status': 'error', 'message': 'No face detected'}), 200
-
-        # Try to crop for better embedding if facial_area provided
-        embedding = None
-        facial_area = reps[0].get('facial_area') if isinstance(reps[0], dict) else None
-        if facial_area:
-            try:
-                orig = Image.open(filepath).convert('RGB')
-                if isinstance(facial_area, (list, tuple)) and len(facial_area) == 4:
-                    x, y, w, h = facial_area
-                elif isinstance(facial_area, dict) and {'x','y','w','h'}.issubset(facial_area.keys()):
-                    x = facial_area['x']; y = facial_area['y']; w = facial_area['w']; h = facial_area['h']
-                else:
-                    x = y = w = h = None
-
-                if x is not None:
-                    left = int(max(0, x)); top = int(max(0, y))
-                    right = int(min(orig.width, x + w)); bottom = int(min(orig.height, y + h))
-                    pad_w = int((right - left) * 0.15); pad_h = int((bottom - top) * 0.15)
-                    left = max(0, left - pad_w); top = max(0, top - pad_h)
-                    right = min(orig.width, right + pad_w); bottom = min(orig.height, bottom + pad_h)
-                    crop = orig.crop((left, top, right, bottom))
-                    tmp_crop = os.path.join(UPLOAD_FOLDER, f"tmp_recog_crop_{uuid.uuid4().hex}.jpg")
-                    crop.save(tmp_crop)
-                    try:
-                        reps_crop = DeepFace.represent(img_path=tmp_crop, model_name='ArcFace', detector_backend='mtcnn', enforce_detection=False)
-                        if reps_crop and isinstance(reps_crop, list) and 'embedding' in reps_crop[0]:
-                            embedding = np.array(reps_crop[0]['embedding'], dtype='float32')
-                    finally:
-                        try: os.remove(tmp_crop)
-                        except: pass
-            except Exception:
-                embedding = None
-
-        if embedding is None:
-            try:
-                embedding = np.array(reps[0]['embedding'], dtype='float32')
-            except Exception:
-                try:
-                    os.remove(filepath)
-                except Exception:
-                    pass
-                return jsonify({'status': 'error', 'message': 'Failed to extract embedding'}), 500
-
-        # Normalize
-        try:
-            qnorm = np.linalg.norm(embedding)
-            if qnorm == 0: qnorm = 1.0
-            qvec = (embedding / qnorm).astype('float32')
-        except Exception:
-            qvec = embedding.astype('float32')
-
-        # Query FAISS
-        index, labels = load_index()
-        if index is None or labels is None:
-            try:
-                os.remove(filepath)
-            except Exception:
-                pass
-            return jsonify({'status': 'error', 'message': 'Index or labels missing'}), 500
-
-        D, I = index.search(np.array([qvec]), 1)
-        best_idx = int(I[0][0])
-        raw_dist = float(D[0][0])
-
-        # Try to reconstruct vector for accurate L2 and cosine
-        vec = None
-        try:
-            vec = np.zeros((index.d,), dtype='float32')
-            index.reconstruct(best_idx, vec)
-        except Exception:
-            vec = None
-
-        l2 = raw_dist if vec is None else float(np.linalg.norm(qvec - vec))
-        cosine = None
-        if vec is not None:
-            try:
-                cosine = float(np.dot(qvec, vec) / (np.linalg.norm(qvec) * (np.linalg.norm(vec) or 1.0)))
-            except Exception:
-                cosine = None
-
-        person_id = int(labels[best_idx]) if labels is not None and len(labels) > best_idx else None
-        name = None
-        photo = None
-        try:
-            session = SessionLocal()
-            p = session.query(Person).filter_by(id=person_id).first()
-            if p:
-                name = p.name
-                # find photo
-                for fname in os.listdir(UPLOAD_FOLDER):
-                    if fname.startswith(f"{person_id}_"):
-                        host = request.host_url.rstrip('/')
-                        photo = f"{host}/dataset/{fname}"
-                        break
-            session.close()
-        except Exception:
-            name = None
-
-        # Clean up temp file
-        try:
-            os.remove(filepath)
-        except:
-            pass
-
-        # Build confidence from cosine if available, else from l2
-        if cosine is not None:
-            # map [-1,1] -> [0,1]
-            confidence = max(0.0, min(1.0, (cosine + 1.0) / 2.0))
-        else:
-            confidence = 1.0 / (1.0 + max(0.0, l2 or 1e9))
-
-        # Apply similarity threshold for recognition decision
-        if confidence < SIM_THRESHOLD:
-            person_id = None
-            name = 'Unknown'
-
-        return jsonify({
-            'status': 'success',
-            'person_id': person_id,
-            'name': name or 'Unknown',
-            'l2': l2,
-            'cosine': cosine,
-            'distance': l2,
-            'confidence': confidence,
-            'photo': photo
-        })
+        # One detector pass, one batched embedding pass, one batched index
+        # search and one DB query for names, for every face in the frame
+        body, status = face_service.recognize_image(
+            img_bytes,
+            request.host_url.rstrip('/'),
+            k=request.args.get('k', 1, type=int),
+            camera_id=request.args.get('camera_id') or request.form.get('camera_id'),
+            fast=face_service.parse_flag(request.args.get('fast', request.form.get('fast')))
+        )
+        return jsonify(body), status
 
     except Exception as e:
         print(f"❌ Recognition error: {str(e)}")
@@ -519,84 +310,93 @@ def recognize_face_api():
 def get_persons():
     """Get all registered persons"""
     try:
-        session = SessionLocal()
-        persons = session.query(Person).all()
-
-        result = []
-        for person in persons:
-            # try to find an image file with prefix {person.id}_ in dataset
-            photo_url = None
-            try:
-                for fname in os.listdir(UPLOAD_FOLDER):
-                    if fname.startswith(f"{person.id}_"):
-                        # make absolute URL
-                        host = request.host_url.rstrip('/')
-                        photo_url = f"{host}/dataset/{fname}"
-                        break
-            except Exception:
-                photo_url = None
-
-            result.append({
-                "id": person.id,
-                "name": person.name,
-                "photo": photo_url
-            })
+        body, status = face_service.list_persons(request.host_url.rstrip('/'))
+        return jsonify(body), status
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
 
-        session.close()
-        return jsonify({"status": "success", "persons": result})
+@app.route('/api/face/persons/<int:person_id>', methods=['DELETE'])
+def delete_person(person_id):
+    """Delete a person and their samples (no index rebuild)"""
+    try:
+        body, status = face_service.delete_person(person_id)
+        return jsonify(body), status
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/face/persons/<int:person_id>/photo', methods=['PUT'])
+def replace_person_photo(person_id):
+    """Replace a person's photos and samples with the uploaded image"""
+    try:
+        file = request.files.get('image')
+        if file is None or file.filename == '':
+            return jsonify({"status": "error", "message": "No image provided"}), 400
+        body, status = face_service.replace_photo(person_id, file.read(), request.host_url.rstrip('/'))
+        return jsonify(body), status
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)})
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/face/debug')
 def debug_status():
     """Debug endpoint to check system status"""
     try:
-        # Check FAISS index
-        index_exists = os.path.exists(os.path.join("embeddings", "face_index.faiss"))
-        labels_exists = os.path.exists(os.path.join("embeddings", "labels.npy"))
-
-        # Check database
-        session = SessionLocal()
-        persons = session.query(Person).all()
-        session.close()
-
-        # Check dataset
-        dataset_files = os.listdir(UPLOAD_FOLDER) if os.path.exists(UPLOAD_FOLDER) else []
-
-        return jsonify({
-            "status": "debug",
-            "faiss_index": "exists" if index_exists else "missing",
-            "labels": "exists" if labels_exists else "missing",
-            "registered_persons": len(persons),
-            "dataset_files": len(dataset_files),
-            "persons": [{"id": p.id, "name": p.name} for p in persons],
-            "recent_dataset": dataset_files[-5:] if dataset_files else []
-        })
-
+        body, status = face_service.debug_info()
+        return jsonify(body), status
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
         })
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint: stage latencies, queue depth, index size, cache hits"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/face/metrics')
+def metrics_summary():
+    """Same metrics as JSON, with p50/p95/p99 latencies in ms"""
+    body, status = face_service.metrics_summary()
+    return jsonify(body), status
+
 
 @app.route('/api/face/rebuild', methods=['POST'])
 def rebuild_index():
-    """Trigger a rebuild of the FAISS index from dataset files."""
+    """
+    Start a background rebuild of the FAISS index from dataset files.
+    Returns immediately with the job status; pass ?wait=1 to block until done.
+    Unchanged images reuse cached embeddings; pass ?force=1 to re-embed everything.
+    """
     try:
-        from embeddings import rebuild_index_from_dataset
-        count = rebuild_index_from_dataset(UPLOAD_FOLDER)
-        return jsonify({"status": "success", "message": "Rebuilt index", "entries": count})
+        body, status = face_service.rebuild(
+            workers=request.args.get('workers', type=int),
+            use_cache=request.args.get('force') != '1',
+            wait=request.args.get('wait') == '1'
+        )
+        return jsonify(body), status
     except Exception as e:
         import traceback
         print("❌ Rebuild error:", traceback.format_exc())
         return jsonify({"status": "error", "message": str(e)})
 
 
+@app.route('/api/face/rebuild/status', methods=['GET'])
+def rebuild_status():
+    """Progress, ETA and result of the current/last rebuild job."""
+    body, status = face_service.rebuild_status()
+    return jsonify(body), status
+
+
+@app.route('/api/face/rebuild/cancel', methods=['POST'])
+def rebuild_cancel():
+    """Cancel the running rebuild; the current index is left unchanged."""
+    body, status = face_service.rebuild_cancel()
+    return jsonify(body), status
+
+
 @app.route('/api/face/compare', methods=['POST'])
 def compare_face():
-    """Return embedding and top-K matches (label, L2, cosine) for debugging/tuning."""
+    """Return top-K matches (label, cosine, distance, L2, confidence) for debugging/tuning."""
     try:
         if 'image' not in request.files:
             return jsonify({'status': 'error', 'message': 'No image provided'}), 400
@@ -605,151 +405,156 @@ def compare_face():
         if file.filename == '':
             return jsonify({'status': 'error', 'message': 'Empty filename'}), 400
 
-        # Save temp
-        img_bytes = file.read()
-        import os, uuid
-        tmp_path = os.path.join(UPLOAD_FOLDER, f"tmp_compare_{uuid.uuid4().hex}.jpg")
-        try:
-            img = Image.open(io.BytesIO(img_bytes)).convert('RGB')
-            img.save(tmp_path)
-        except Exception as e:
-            return jsonify({'status': 'error', 'message': 'Invalid image'}), 400
+        body, status = face_service.compare_image(file.read(), k=request.args.get('k', 5, type=int))
+        return jsonify(body), status
 
-        # Compute embedding similarly to registration/recognition
-        try:
-            from deepface import DeepFace
-            with TF_LOCK:
-                reps = DeepFace.represent(img_path=tmp_path, model_name='ArcFace', detector_backend='mtcnn', enforce_detection=False)
-        except Exception as e:
-            os.remove(tmp_path)
-            return jsonify({'status': 'error', 'message': f'DeepFace error: {str(e)}'}), 500
-
-        if not reps:
-            os.remove(tmp_path)
-            return jsonify({'status': 'error', 'message': 'No face detected'}), 200
-
-        # Try to use facial_area to crop and recompute embedding for accuracy
-        embedding = None
-        facial_area = reps[0].get('facial_area') if isinstance(reps[0], dict) else None
-        if facial_area:
-            try:
-                orig = Image.open(tmp_path).convert('RGB')
-                if isinstance(facial_area, (list, tuple)) and len(facial_area) == 4:
-                    x, y, w, h = facial_area
-                elif isinstance(facial_area, dict) and {'x','y','w','h'}.issubset(facial_area.keys()):
-                    x = facial_area['x']; y = facial_area['y']; w = facial_area['w']; h = facial_area['h']
-                else:
-                    x = y = w = h = None
-
-                if x is not None:
-                    left = int(max(0, x)); top = int(max(0, y))
-                    right = int(min(orig.width, x + w)); bottom = int(min(orig.height, y + h))
-                    pad_w = int((right - left) * 0.15); pad_h = int((bottom - top) * 0.15)
-                    left = max(0, left - pad_w); top = max(0, top - pad_h)
-                    right = min(orig.width, right + pad_w); bottom = min(orig.height, bottom + pad_h)
-                    crop = orig.crop((left, top, right, bottom))
-                    tmp_crop = os.path.join(UPLOAD_FOLDER, f"tmp_compare_crop_{uuid.uuid4().hex}.jpg")
-                    crop.save(tmp_crop)
-                    try:
-                        reps_crop = DeepFace.represent(img_path=tmp_crop, model_name='ArcFace', detector_backend='mtcnn', enforce_detection=False)
-                        if reps_crop and isinstance(reps_crop, list) and 'embedding' in reps_crop[0]:
-                            embedding = np.array(reps_crop[0]['embedding'], dtype='float32')
-                    finally:
-                        try: os.remove(tmp_crop)
-                        except: pass
-            except Exception:
-                embedding = None
-
-        if embedding is None:
-            try:
-                embedding = np.array(reps[0]['embedding'], dtype='float32')
-            except Exception:
-                os.remove(tmp_path)
-                return jsonify({'status': 'error', 'message': 'Failed to extract embedding'}), 500
-
-        # Normalize query
+    except Exception as e:
+        import traceback
+        print('Compare error:', traceback.format_exc())
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# -- Streaming recognition ---------------------------------------------------
+# A camera POSTs frames (raw JPEG/PNG body or multipart 'image') to
+# /api/face/stream/<camera_id>/frame and reads results from the server-sent
+# events stream /api/face/stream/<camera_id>/events, or keeps one WebSocket
+# open on /api/face/stream/<camera_id>/ws for both (needs flask-sock). Only
+# the newest pending frame per camera is processed; older ones are dropped
+# (see streaming.py).
+
+streams = StreamRegistry(face_service.process_stream_frame)
+
+
+@app.errorhandler(StreamLimitReached)
+def stream_limit(e):
+    return jsonify({'status': 'error', 'message': str(e)}), 503, {'Retry-After': '5'}
+
+
+@app.route('/api/face/stream/<camera_id>/frame', methods=['POST'])
+def stream_frame(camera_id):
+    """Queue a frame for a camera; replaces any frame not yet processed."""
+    if not face_service.valid_camera_id(camera_id):
+        return jsonify({'status': 'error', 'message': 'Invalid camera id'}), 400
+    file = request.files.get('image')
+    frame = file.read() if file is not None else request.get_data()
+    if not frame:
+        return jsonify({'status': 'error', 'message': 'No image provided'}), 400
+
+    context = {'host': request.host_url.rstrip('/'), 'k': max(1, request.args.get('k', 1, type=int)), 'camera_id': camera_id,
+               'fast': face_service.parse_flag(request.args.get('fast'))}
+    stream, seq = streams.push(camera_id, frame, context)
+    return jsonify({'status': 'accepted', 'camera_id': camera_id, 'seq': seq, 'dropped': stream.dropped}), 202
+
+
+@app.route('/api/face/stream/<camera_id>/events', methods=['GET'])
+def stream_events(camera_id):
+    """Server-sent events: one `result` event per processed frame."""
+    if not face_service.valid_camera_id(camera_id):
+        return jsonify({'status': 'error', 'message': 'Invalid camera id'}), 400
+    stream, results = streams.subscribe(camera_id)
+
+    def generate():
         try:
-            qnorm = np.linalg.norm(embedding)
-            if qnorm == 0: qnorm = 1.0
-            qvec = (embedding / qnorm).astype('float32')
-        except Exception:
-            qvec = embedding.astype('float32')
-
-        # Load index
-        index, labels = load_index()
-        if index is None or labels is None:
-            os.remove(tmp_path)
-            return jsonify({'status': 'error', 'message': 'Index or labels missing'}), 500
-
-        k = int(request.args.get('k', 5))
-        # Cap k to the number of entries in the index to avoid -1/NaN results
-        k = max(1, min(k, int(index.ntotal)))
-        D, I = index.search(np.array([qvec]), k)
-
-        results = []
-        for dist_list, idx_list in zip(D, I):
-            for dist, idx in zip(dist_list, idx_list):
-                if int(idx) < 0:
-                    # invalid index returned by FAISS when k > ntotal
+            yield 'retry: 2000\n\n'
+            while True:
+                try:
+                    result = results.get(timeout=STREAM_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
                     continue
+                yield f"event: result\ndata: {json.dumps(result)}\n\n"
+        finally:
+            stream.unsubscribe(results)
 
-                try:
-                    vec = np.zeros((index.d, ), dtype='float32')
-                    index.reconstruct(int(idx), vec)
-                except Exception:
-                    # if reconstruct not supported, treat vec as None
-                    vec = None
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-                # compute l2 and cosine safely
-                try:
-                    l2 = float(dist) if vec is None else float(np.linalg.norm(qvec - vec))
-                except Exception:
-                    l2 = None
 
-                cos = None
-                if vec is not None:
-                    try:
-                        cos = float(np.dot(qvec, vec) / (np.linalg.norm(qvec) * (np.linalg.norm(vec) or 1.0)))
-                    except Exception:
-                        cos = None
+if Sock is not None:
+    sock = Sock(app)
 
-                person_id = int(labels[int(idx)]) if labels is not None and len(labels) > int(idx) else None
-                # lookup name
-                name = None
+    @sock.route('/api/face/stream/<camera_id>/ws')
+    def stream_socket(ws, camera_id):
+        """
+        Persistent camera connection: each binary message is a frame, each
+        result goes back as a JSON text message; a text message
+        {"k": ..., "fast": ...} changes the settings of the following frames.
+        """
+        if not face_service.valid_camera_id(camera_id):
+            ws.close(1008, 'Invalid camera id')
+            return
+        try:
+            stream, results = streams.subscribe(camera_id)
+        except StreamLimitReached as e:
+            ws.close(1013, str(e))  # 1013: try again later
+            return
+        context = {'host': request.host_url.rstrip('/'), 'k': max(1, request.args.get('k', 1, type=int)),
+                   'camera_id': camera_id, 'fast': face_service.parse_flag(request.args.get('fast'))}
+        done = threading.Event()
+        send_lock = threading.Lock()
+
+        def send(payload):
+            with send_lock:
+                ws.send(json.dumps(payload))
+
+        def send_results():
+            while not done.is_set():
+                try:
+                    result = results.get(timeout=1)
+                except queue.Empty:
+                    continue
                 try:
-                    session = SessionLocal()
-                    p = session.query(Person).filter_by(id=person_id).first()
-                    if p:
-                        name = p.name
-                    session.close()
+                    send(result)
                 except Exception:
-                    name = None
+                    break
 
-                results.append({
-                    'label_index': int(idx),
-                    'person_id': person_id,
-                    'name': name,
-                    'l2': l2,
-                    'cosine': cos
-                })
+        threading.Thread(target=send_results, name=f'ws-{camera_id}', daemon=True).start()
+        try:
+            while True:
+                message = ws.receive()
+                if isinstance(message, bytes):
+                    if message:
+                        streams.push(camera_id, message, dict(context))
+                elif message:
+                    try:
+                        settings = json.loads(message)
+                        if 'k' in settings:
+                            context['k'] = max(1, int(settings['k']))
+                        if 'fast' in settings:
+                            context['fast'] = face_service.parse_flag(settings['fast'])
+                    except (ValueError, TypeError, AttributeError):
+                        send({'status': 'error', 'message': 'Invalid settings message'})
+        finally:
+            done.set()
+            stream.unsubscribe(results)
 
-        os.remove(tmp_path)
-        return jsonify({'status': 'success', 'results': results, 'query_norm': float(np.linalg.norm(qvec))})
 
-    except Exception as e:
-        import traceback
-        print('Compare error:', traceback.format_exc())
-        return jsonify({'status': 'error', 'message': str(e)}), 500
+@app.route('/api/face/stream/status', methods=['GET'])
+def stream_status():
+    return jsonify({'status': 'success', 'streams': streams.stats(), 'trackers': trackers.stats()})
 
 @app.route('/health')
 def health():
-    """Health check endpoint"""
+    """Health check endpoint (liveness; `ready` tells whether warm-up finished)"""
     return jsonify({
         "status": "healthy",
         "service": "face-recognition",
-        "message": "Face recognition service is running"
+        "message": "Face recognition service is running",
+        "ready": startup.ready,
+        "startup": startup.status()
     })
 
+@app.route('/health/live')
+def health_live():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({"status": "alive", "startup": startup.status()})
+
+@app.route('/health/ready')
+def health_ready():
+    """Readiness: 200 once the model, detectors and index are warm, 503 before"""
+    status = startup.status()
+    return jsonify({"status": "ready" if startup.ready else status['state'], "startup": status}), \
+        200 if startup.ready else 503
+
 if __name__ == '__main__':
     print("🚀 Starting Face Recognition Flask Server...")
     print("📡 Available endpoints:")
@@ -758,19 +563,30 @@ if __name__ == '__main__':
     print("   GET  /smart-camera       - Smart camera with overlay (NEW)")
     print("   GET  /webcam             - Webcam interface")
     print("   GET  /health             - Health check")
+    print("   GET  /health/live        - Liveness probe")
+    print("   GET  /health/ready       - Readiness probe (503 until warm-up is done)")
     print("   POST /api/face/register  - Register face")
     print("   POST /api/face/recognize - Recognize face")
     print("   GET  /api/face/persons   - Get all persons")
+    print("   DELETE /api/face/persons/<id> - Delete a person (no index rebuild)")
+    print("   PUT  /api/face/persons/<id>/photo - Replace a person's photo")
     print("   GET  /api/face/debug     - Debug system status")
+    print("   GET  /metrics            - Prometheus metrics (stage latencies, queue depth, index size)")
+    print("   GET  /api/face/metrics   - Metrics as JSON with p50/p95/p99")
+    print("   POST /api/face/rebuild   - Start background index rebuild")
+    print("   GET  /api/face/rebuild/status - Rebuild progress / ETA")
+    print("   POST /api/face/rebuild/cancel - Cancel running rebuild")
+    print("   POST /api/face/stream/<camera_id>/frame - Push a frame (newest-only processing)")
+    print("   GET  /api/face/stream/<camera_id>/events - Recognition results (server-sent events)")
+    if Sock is not None:
+        print("   WS   /api/face/stream/<camera_id>/ws - Persistent camera stream (frames in, results out)")
     print("   GET  /api/face/realtime/status - Real-time status")
     print("")
     print("🌐 Server running on http://localhost:5000")
     print("🎥 Open http://localhost:5000/smart-camera for smart camera interface")
     print("📹 Open http://localhost:5000/realtime for real-time recognition")
 
-    # Run single-threaded (threaded=False) and without the auto-reloader to
-    # avoid concurrent DeepFace/TensorFlow calls which can crash the process
-    # with low-level TensorFlow errors (e.g. "Retval[0] has already been set").
-    # For production use a WSGI server (gunicorn/uwsgi) with a single worker
-    # or an external job queue to serialize model calls.
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False, threaded=False)
+    # Request threads only parse input and wait on the inference worker, which
+    # is the single owner of the DeepFace/TensorFlow model, so the server can
+    # run multithreaded. Keep the auto-reloader off so the model loads once.
+    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False, threaded=True)
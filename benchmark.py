@@ -0,0 +1,439 @@
+"""
+Offline benchmark of the recognition pipeline; results are written as JSON
+so runs can be compared across releases.
+
+    python benchmark.py                         # everything, default sizes
+    python benchmark.py --only index,gallery    # no model needed
+    python benchmark.py --url http://localhost:5000 --clients 1,8,32
+    python benchmark.py --baseline old.json     # print changes vs a previous run
+    python benchmark.py --only served --k 10    # index types on the served gallery
+
+Sections:
+  index      search latency (mean/p95) and recall@k vs gallery size for
+             each index type, on synthetic embeddings
+  gallery    two-stage search (centroids + exemplar rerank) as served
+  embedding  single-image extraction (detect + align + embed) and batched
+             embedding throughput on samples/a.jpg
+  recognize  /api/face/recognize requests per second at N concurrent
+             clients: in-process through face_service (default) or over
+             HTTP against a running server with --url
+  rebuild    dataset rebuild throughput (images/s) on jittered copies of
+             the sample image
+  served     recall@k and latency of each index type on the exemplars of
+             the served gallery (read only), vs the index it uses now
+
+Synthetic data is seeded (--seed), so runs are reproducible. Everything runs
+against a scratch gallery and dataset in a temporary directory; the served
+gallery, dataset and embedding cache are never written (served only reads
+the gallery). Sections that need
+the model record an "error" instead of failing the run when it cannot load.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+import config
+import embeddings
+from embeddings import IndexCache, INDEX_TYPES, gallery_arrays, index_recall_report
+from gallery import GalleryState, normalize
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_IMAGE = os.path.join(BASE_DIR, 'samples', 'a.jpg')
+SECTIONS = ('index', 'gallery', 'embedding', 'recognize', 'rebuild', 'served')
+# Person id of the sample image in the scratch gallery (clear of real ids)
+SAMPLE_PERSON_ID = 10 ** 9
+EMBEDDING_DIM = 512  # ArcFace; replaced by the real dimension once the model has run
+
+
+def _percentiles(latencies_ms):
+    arr = np.asarray(latencies_ms, dtype='float64')
+    if not len(arr):
+        return {}
+    return {
+        'mean_ms': round(float(arr.mean()), 3),
+        'p50_ms': round(float(np.percentile(arr, 50)), 3),
+        'p95_ms': round(float(np.percentile(arr, 95)), 3),
+        'p99_ms': round(float(np.percentile(arr, 99)), 3),
+    }
+
+
+def synthetic_gallery(persons, per_person, dim, seed=0, noise=0.5):
+    """(vectors, labels, centers): unit-length samples clustered around one center per person."""
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.normal(size=(persons, dim)))
+    offsets = normalize(rng.normal(size=(persons * per_person, dim))) * noise
+    vectors = normalize(np.repeat(centers, per_person, axis=0) + offsets)
+    labels = np.repeat(np.arange(persons, dtype=np.int64), per_person)
+    return vectors, labels, centers
+
+
+@contextmanager
+def scratch_gallery(workdir):
+    """Serve the gallery from `workdir` while the benchmark runs (search_index, rebuilds, ...)."""
+    cache = IndexCache(os.path.join(workdir, 'gallery.snapshot'), os.path.join(workdir, 'embeddings.journal'),
+                       os.path.join(workdir, 'none.faiss'), os.path.join(workdir, 'none.npy'), mmap=False)
+    served = embeddings._index_cache
+    embeddings._index_cache = cache
+    try:
+        yield cache
+    finally:
+        embeddings._index_cache = served
+
+
+def bench_index(sizes, types, dim, queries, k, seed):
+    """Search latency and recall@k of each index type at each gallery size."""
+    results = []
+    for size in sizes:
+        vectors, _, _ = synthetic_gallery(size, 1, dim, seed=seed)
+        print(f"📊 Index search: {size} vectors, types {','.join(types)}")
+        for entry in index_recall_report(vectors, k=k, index_types=types, n_queries=queries):
+            results.append(dict(entry, gallery_size=size))
+    return results
+
+
+def bench_served(types, queries, k):
+    """index_recall_report on the served gallery's exemplars, with the parameters it is served with."""
+    info = embeddings.index_info()
+    vectors, _ = embeddings.load_vectors()
+    if info is None or vectors is None:
+        raise RuntimeError("No served gallery")
+    print(f"📊 Served gallery: {len(vectors)} vectors, types {','.join(types)}")
+    return {'current': info['params'], 'report': index_recall_report(vectors, k=k, index_types=types,
+                                                                     n_queries=queries)}
+
+
+def bench_gallery(cache, centers, queries, batch, seed):
+    """Two-stage search latency on the scratch gallery, one query at a time and batched."""
+    rng = np.random.default_rng(seed + 1)
+    pick = rng.choice(len(centers), min(queries, len(centers)), replace=False)
+    probes = normalize(centers[pick] + rng.normal(0, 0.3, (len(pick), centers.shape[1])))
+    cache.search(probes[:1], 1)  # load outside the timed loop
+
+    latencies, correct = [], 0
+    for person, q in zip(pick, probes):
+        t0 = time.perf_counter()
+        S, I, labels = cache.search(q[np.newaxis, :], 1)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        correct += int(I[0, 0] >= 0 and labels[I[0, 0]] == person)
+
+    t0 = time.perf_counter()
+    for start in range(0, len(probes), batch):
+        cache.search(probes[start:start + batch], 1)
+    batched_s = time.perf_counter() - t0
+
+    info = cache.info()
+    return {
+        'persons': info['persons'],
+        'exemplars': info['entries'],
+        'params': info['params'],
+        'top1_accuracy': round(correct / float(len(pick)), 4),
+        'single': _percentiles(latencies),
+        'batch_size': batch,
+        'batched_queries_per_second': round(len(probes) / batched_s, 1) if batched_s else None,
+    }
+
+
+def bench_embedding(img, repeats, batch_sizes):
+    """Single-image extraction latency and batched embedding throughput."""
+    from face_pipeline import extract_embeddings, find_faces, align_face, embed_faces
+
+    extract_embeddings(img)  # model load / warm-up
+    latencies = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        faces = extract_embeddings(img)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+    if not faces:
+        raise RuntimeError(f"no face found in {SAMPLE_IMAGE}")
+    single = _percentiles(latencies)
+    single['images_per_second'] = round(1000.0 * len(latencies) / sum(latencies), 2)
+
+    crop = align_face(img, find_faces(img)[0])
+    batched = []
+    for size in batch_sizes:
+        embed_faces([crop] * size)
+        rounds = max(1, repeats // size)
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            embed_faces([crop] * size)
+        elapsed = time.perf_counter() - t0
+        batched.append({'batch_size': size, 'faces_per_second': round(size * rounds / elapsed, 2),
+                        'ms_per_batch': round(elapsed * 1000.0 / rounds, 3)})
+    return {'single_image': single, 'batched': batched}, faces[0]['embedding']
+
+
+def _run_clients(fn, clients, requests_per_client):
+    """Call fn() from `clients` threads; returns (latencies ms, errors, wall seconds)."""
+    latencies, errors, lock = [], [], threading.Lock()
+
+    def client():
+        for _ in range(requests_per_client):
+            t0 = time.perf_counter()
+            try:
+                fn()
+                elapsed = (time.perf_counter() - t0) * 1000.0
+                with lock:
+                    latencies.append(elapsed)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors, time.perf_counter() - t0
+
+
+def _post_image(url, img_bytes):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="a.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode() + img_bytes + f'\r\n--{boundary}--\r\n'.encode()
+    req = urllib.request.Request(url, data=body, method='POST',
+                                 headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    with urllib.request.urlopen(req, timeout=60) as resp:
+        payload = json.loads(resp.read().decode('utf-8'))
+    if payload.get('status') != 'success':
+        raise RuntimeError(payload.get('message', 'recognition failed'))
+    return payload
+
+
+def bench_recognize(img_bytes, clients_list, requests_per_client, url=None):
+    """Recognize requests per second at each client concurrency."""
+    if url:
+        endpoint = url.rstrip('/') + '/api/face/recognize'
+        call = lambda: _post_image(endpoint, img_bytes)
+    else:
+        import face_service
+        import metrics
+
+        def call():
+            body, status = face_service.recognize_image(img_bytes, 'http://benchmark')
+            if body.get('status') != 'success':
+                raise RuntimeError(body.get('message', 'recognition failed'))
+    call()  # warm-up
+    if not url:
+        metrics.stage_seconds.reset()
+
+    results = []
+    for clients in clients_list:
+        latencies, errors, wall = _run_clients(call, clients, requests_per_client)
+        print(f"📊 Recognize x{clients} clients: {len(latencies) / wall:.1f} req/s, {len(errors)} error(s)")
+        results.append(dict(_percentiles(latencies), clients=clients, requests=len(latencies) + len(errors),
+                            errors=len(errors), first_error=errors[0] if errors else None,
+                            requests_per_second=round(len(latencies) / wall, 2) if wall else None))
+    summary = {'mode': 'http' if url else 'in-process', 'target': url, 'results': results}
+    if not url:
+        # Where the time goes: per-stage latency over all the requests above
+        summary['stages'] = metrics.stage_seconds.summary(scale=1000.0)
+    return summary
+
+
+def _jittered_dataset(img, dataset_dir, images, persons, seed):
+    """Write `images` brightness/flip variants of img as {person}_{i}.jpg (distinct embeddings)."""
+    import cv2
+    rng = np.random.default_rng(seed)
+    for i in range(images):
+        variant = cv2.convertScaleAbs(img, alpha=float(rng.uniform(0.8, 1.2)), beta=float(rng.uniform(-20, 20)))
+        if rng.random() < 0.5:
+            variant = cv2.flip(variant, 1)
+        cv2.imwrite(os.path.join(dataset_dir, f"{i % persons + 1}_{i:06d}.jpg"), variant)
+
+
+def bench_rebuild(img, workdir, images, persons, workers, seed):
+    """Full rebuild (embed every image, no embedding cache) of a scratch dataset."""
+    dataset_dir = os.path.join(workdir, 'dataset')
+    os.makedirs(dataset_dir, exist_ok=True)
+    _jittered_dataset(img, dataset_dir, images, persons, seed)
+    t0 = time.perf_counter()
+    built = embeddings.rebuild_index_from_dataset(dataset_dir, workers=workers, use_cache=False)
+    elapsed = time.perf_counter() - t0
+    return {'images': images, 'persons': built, 'workers': workers, 'seconds': round(elapsed, 3),
+            'images_per_second': round(images / elapsed, 2) if elapsed else None}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=BASE_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def environment(args):
+    import faiss
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'faiss': getattr(faiss, '__version__', None),
+        'config': {
+            'FACE_MODEL': config.FACE_MODEL, 'FACE_DETECTOR': config.FACE_DETECTOR,
+            'RECOGNITION_DETECTOR': config.RECOGNITION_DETECTOR,
+            'CASCADE_FIRST_STAGE': config.CASCADE_FIRST_STAGE,
+            'INDEX_TYPE': config.INDEX_TYPE, 'INDEX_METRIC': config.INDEX_METRIC,
+            'GALLERY_EXEMPLARS': config.GALLERY_EXEMPLARS, 'GALLERY_AGGREGATION': config.GALLERY_AGGREGATION,
+            'INFERENCE_MAX_BATCH_SIZE': config.INFERENCE_MAX_BATCH_SIZE,
+            'INFERENCE_MAX_WAIT_MS': config.INFERENCE_MAX_WAIT_MS,
+            'INFERENCE_ADDRESS': config.INFERENCE_ADDRESS or None,
+        },
+        'args': vars(args),
+    }
+
+
+def _flatten(value, prefix=''):
+    """Numeric leaves as {dotted.path: number}; list items are keyed by their identifying fields."""
+    out = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            out.update(_flatten(item, f"{prefix}{key}."))
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            ident = i
+            if isinstance(item, dict):
+                keys = [f"{k}={item[k]}" for k in ('type', 'gallery_size', 'batch_size', 'clients') if k in item]
+                ident = ','.join(keys) or i
+            out.update(_flatten(item, f"{prefix}[{ident}]."))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix.rstrip('.')] = value
+    return out
+
+
+def compare(results, baseline):
+    """Print latency/throughput changes against a previous results file."""
+    old, new = _flatten(baseline), _flatten(results)
+    print(f"\n📈 Compared with {baseline.get('environment', {}).get('revision')}:")
+    for key in sorted(set(old) & set(new)):
+        if not key.endswith(('_ms', '_per_second', 'recall_at_k', 'top1_accuracy')) or not old[key]:
+            continue
+        change = (new[key] - old[key]) / abs(old[key]) * 100.0
+        worse = change > 0 if key.endswith('_ms') else change < 0
+        flag = '⚠️' if worse and abs(change) >= 10 else '  '
+        print(f"{flag} {key}: {old[key]} -> {new[key]} ({change:+.1f}%)")
+
+
+def _ints(text):
+    return [int(v) for v in text.split(',') if v.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the face recognition pipeline (JSON results).")
+    parser.add_argument('--out', default=None, help="results file (default benchmark_<timestamp>.json)")
+    parser.add_argument('--only', default=','.join(SECTIONS), help="comma-separated sections to run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--image', default=SAMPLE_IMAGE)
+    parser.add_argument('--sizes', type=_ints, default=[1000, 10000, 100000], help="index: gallery sizes")
+    parser.add_argument('--types', default=','.join(INDEX_TYPES), help="index/served: index types")
+    parser.add_argument('--queries', type=int, default=200, help="index/gallery/served: queries per measurement")
+    parser.add_argument('--k', type=int, default=10, help="index/served: recall@k")
+    parser.add_argument('--persons', type=int, default=1000, help="gallery/recognize: scratch gallery persons")
+    parser.add_argument('--samples', type=int, default=5, help="gallery/recognize: samples per person")
+    parser.add_argument('--repeats', type=int, default=20, help="embedding: timed runs")
+    parser.add_argument('--batch-sizes', type=_ints, default=[1, 8, 32], help="embedding: batch sizes")
+    parser.add_argument('--clients', type=_ints, default=[1, 4, 16], help="recognize: concurrent clients")
+    parser.add_argument('--requests', type=int, default=20, help="recognize: requests per client")
+    parser.add_argument('--url', default=None, help="recognize: benchmark a running server instead")
+    parser.add_argument('--rebuild-images', type=int, default=100)
+    parser.add_argument('--rebuild-workers', type=int, default=1)
+    parser.add_argument('--baseline', default=None, help="previous results file to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sections = [s for s in args.only.split(',') if s in SECTIONS]
+    out = args.out or f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    results = {'environment': environment(args)}
+    workdir = tempfile.mkdtemp(prefix='face-bench-')
+
+    def run(name, fn, *fn_args):
+        if name not in sections:
+            return None
+        print(f"⏱️ Running {name} benchmark")
+        t0 = time.perf_counter()
+        try:
+            value = fn(*fn_args)
+        except Exception as e:
+            import traceback
+            print(f"❌ {name} benchmark failed: {e}")
+            print(traceback.format_exc())
+            results[name] = {'error': str(e)}
+            return None
+        results[name] = value[0] if isinstance(value, tuple) else value
+        print(f"✅ {name} done in {time.perf_counter() - t0:.1f}s")
+        return value
+
+    try:
+        with open(args.image, 'rb') as f:
+            img_bytes = f.read()
+        from imaging import load_image
+        img = load_image(img_bytes)
+
+        dim = EMBEDDING_DIM
+        sample_embedding = None
+        embedded = run('embedding', bench_embedding, img, args.repeats, args.batch_sizes)
+        if embedded is not None:
+            sample_embedding = embedded[1]
+        elif 'recognize' in sections and not args.url:
+            try:
+                from face_pipeline import extract_embeddings
+                faces = extract_embeddings(img)
+                sample_embedding = faces[0]['embedding'] if faces else None
+            except Exception as e:
+                print(f"⚠️ Sample image not enrolled: {e}")
+        if sample_embedding is not None:
+            dim = len(sample_embedding)
+
+        run('index', bench_index, args.sizes, args.types.split(','), dim, args.queries, args.k, args.seed)
+        run('served', bench_served, args.types.split(','), args.queries, args.k)
+
+        with scratch_gallery(workdir) as cache:
+            vectors, labels, centers = synthetic_gallery(args.persons, args.samples, dim, seed=args.seed)
+            if sample_embedding is not None:
+                # Enrol the sample image so recognize requests find a match
+                vectors = np.vstack([vectors, sample_embedding[np.newaxis, :]])
+                labels = np.append(labels, SAMPLE_PERSON_ID)
+            if 'gallery' in sections or 'recognize' in sections:
+                cache.replace(gallery_arrays(GalleryState(vectors, labels)))
+            if sample_embedding is not None:
+                # After replace(): the directory reloads whenever the gallery changes
+                from person_directory import directory
+                directory.load()
+                directory.add_sample(SAMPLE_PERSON_ID, 'benchmark', None)
+            run('gallery', bench_gallery, cache, centers, args.queries, 32, args.seed)
+            run('recognize', bench_recognize, img_bytes, args.clients, args.requests, args.url)
+            run('rebuild', bench_rebuild, img, workdir, args.rebuild_images, max(1, args.rebuild_images // 5),
+                args.rebuild_workers, args.seed)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"💾 Benchmark results written to {out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    return results
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -4,19 +4,127 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # DeepFace config
 FACE_MODEL = "ArcFace"
-FACE_DETECTOR = "mtcnn"  # Changed from retinaface to mtcnn
+# Detector for registration, rebuild and compare (enrollment-quality boxes and eyes)
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "mtcnn")  # Changed from retinaface to mtcnn
+# Padding added around the detected box before embedding (fraction of box size)
+FACE_CROP_PADDING = float(os.getenv("FACE_CROP_PADDING", 0.15))
+# Rotate crops so the eyes are horizontal before embedding
+FACE_ALIGN = os.getenv("FACE_ALIGN", "1") == "1"
+# Maximum faces recognized per frame (largest first)
+MAX_FACES_PER_FRAME = int(os.getenv("MAX_FACES_PER_FRAME", 10))
+# Fast recognition mode (?fast=1, or per camera below): a cheaper detector run
+# on a copy downscaled to FAST_DETECT_WIDTH px (boxes mapped back to the full
+# frame), at most FAST_MAX_FACES faces, and a top-1 search that reranks only
+# FAST_RERANK_PERSONS candidate persons.
+FAST_DETECTOR = os.getenv("FAST_DETECTOR", "opencv")
+FAST_DETECT_WIDTH = int(os.getenv("FAST_DETECT_WIDTH", 320))
+FAST_MAX_FACES = int(os.getenv("FAST_MAX_FACES", 1))
+FAST_RERANK_PERSONS = int(os.getenv("FAST_RERANK_PERSONS", 1))
+# Detector for recognition requests in accurate mode (see detectors.py). Any
+# DeepFace backend, "haar", "yunet", or "cascade": a cheap OpenCV first stage
+# (CASCADE_FIRST_STAGE: "yunet", "haar", or "auto" = YuNet if YUNET_MODEL
+# exists, else Haar) screens the frame at CASCADE_SCREEN_WIDTH px, so frames
+# without a proposal are rejected without the heavy detector. Proposals with
+# eye landmarks and score >= CASCADE_ACCEPT_SCORE are used as-is; the rest
+# are confirmed by CASCADE_HEAVY_DETECTOR on the proposal grown by
+# CASCADE_ROI_PADDING (fraction of its size per side).
+RECOGNITION_DETECTOR = os.getenv("RECOGNITION_DETECTOR", "cascade")
+CASCADE_FIRST_STAGE = os.getenv("CASCADE_FIRST_STAGE", "auto")
+CASCADE_HEAVY_DETECTOR = os.getenv("CASCADE_HEAVY_DETECTOR", FACE_DETECTOR)
+CASCADE_SCREEN_WIDTH = int(os.getenv("CASCADE_SCREEN_WIDTH", 480))
+CASCADE_ACCEPT_SCORE = float(os.getenv("CASCADE_ACCEPT_SCORE", 0.9))
+CASCADE_ROI_PADDING = float(os.getenv("CASCADE_ROI_PADDING", 0.5))
+# OpenCV YuNet weights (face_detection_yunet_2023mar.onnx from the OpenCV model zoo)
+YUNET_MODEL = os.getenv("YUNET_MODEL", os.path.join(BASE_DIR, "weights", "face_detection_yunet_2023mar.onnx"))
+# Recognition mode ("accurate" or "fast") of requests that do not pass fast=,
+# and per camera id modes that override the request, e.g.
+# CAMERA_MODES="gate1=fast,lobby=accurate"
+RECOGNITION_MODE = os.getenv("RECOGNITION_MODE", "accurate")
+CAMERA_MODES = dict(item.strip().split('=', 1) for item in os.getenv("CAMERA_MODES", "").split(',') if '=' in item)
 
 # FAISS + labels
 EMBEDDINGS_DIR = os.path.join(BASE_DIR, "embeddings")
 INDEX_PATH = os.path.join(EMBEDDINGS_DIR, "face_index.faiss")
 LABELS_PATH = os.path.join(EMBEDDINGS_DIR, "labels.npy")
+# Gallery snapshot (index, vectors, labels and metadata in one versioned,
+# atomically replaced file, see snapshot.py) and the append-only journal of
+# registrations made since the snapshot. INDEX_PATH and LABELS_PATH are only
+# read to migrate a gallery written by older versions.
+SNAPSHOT_PATH = os.path.join(EMBEDDINGS_DIR, "gallery.snapshot")
+JOURNAL_PATH = os.path.join(EMBEDDINGS_DIR, "embeddings.journal")
+# Fold the journal into a new snapshot after this many appended records
+JOURNAL_COMPACT_RECORDS = int(os.getenv("JOURNAL_COMPACT_RECORDS", 1000))
+# ... or once more than this fraction of the snapshot's persons are deleted
+INDEX_DELETED_COMPACT_RATIO = float(os.getenv("INDEX_DELETED_COMPACT_RATIO", 0.1))
+# FAISS index type: "flat", "ivf" (IVF-Flat), "hnsw", "ivfpq" or "auto".
+# "auto" uses flat below INDEX_AUTO_IVF_MIN vectors, IVF-Flat up to
+# INDEX_AUTO_IVFPQ_MIN and IVF-PQ above; the type is switched at compaction.
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto")
+INDEX_AUTO_IVF_MIN = int(os.getenv("INDEX_AUTO_IVF_MIN", 20000))
+INDEX_AUTO_IVFPQ_MIN = int(os.getenv("INDEX_AUTO_IVFPQ_MIN", 1000000))
+# Index metric: "ip" (inner product = cosine similarity on the unit-length
+# embeddings) or "l2". Existing L2 galleries are migrated at the next compaction
+# or rebuild; scores are converted to cosine similarity either way.
+INDEX_METRIC = os.getenv("INDEX_METRIC", "ip")
+# Multi-process serving: memory-map the snapshot's index read-only in every
+# process instead of loading a private copy (see embeddings.IndexCache).
+INDEX_MMAP = os.getenv("INDEX_MMAP", "0") == "1"
+# Multi-template gallery (see gallery.py): exemplar templates kept per person
+# next to the centroid, persons reranked after the centroid search, and how a
+# person's exemplar similarities are combined: "max" or "mean" (of the top M)
+GALLERY_EXEMPLARS = int(os.getenv("GALLERY_EXEMPLARS", 10))
+GALLERY_RERANK_PERSONS = int(os.getenv("GALLERY_RERANK_PERSONS", 10))
+GALLERY_AGGREGATION = os.getenv("GALLERY_AGGREGATION", "max")
+GALLERY_TOP_M = int(os.getenv("GALLERY_TOP_M", 3))
+# Query-time search parameters. 0 (default): tuned whenever the index is
+# built, to the smallest nprobe / efSearch reaching INDEX_TARGET_RECALL
+# (recall@GALLERY_RERANK_PERSONS against an exact search) and stored with the
+# snapshot; any other value overrides the tuned one
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", 0))
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", 0))
+INDEX_TARGET_RECALL = float(os.getenv("INDEX_TARGET_RECALL", 0.95))
+# HNSW build parameters
+INDEX_HNSW_M = int(os.getenv("INDEX_HNSW_M", 32))
+INDEX_EF_CONSTRUCTION = int(os.getenv("INDEX_EF_CONSTRUCTION", 80))
+# Per-image embedding cache (content hash + model/detector) used by rebuilds
+EMBEDDING_CACHE_PATH = os.path.join(EMBEDDINGS_DIR, "embedding_cache.sqlite3")
 
 # DB config - Support both SQLite and PostgreSQL
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{os.path.join(BASE_DIR, 'face_recognition.db')}")
 SQLALCHEMY_DATABASE_URL = DATABASE_URL
 
-# Threshold cho Unknown
-SIM_THRESHOLD = 0.5
+# Inference worker: face crops from concurrent requests are embedded together
+# in batches of up to INFERENCE_MAX_BATCH_SIZE, waiting at most
+# INFERENCE_MAX_WAIT_MS for a batch to fill.
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", 16))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", 5))
+# Central inference process (inference_server.py). When INFERENCE_ADDRESS is
+# set, model work is sent there over this socket instead of loading the model
+# in every process (multi-process serving, see serve.py). The address is a
+# Unix socket path, a Windows named pipe or "host:port". serve.py generates a
+# fresh INFERENCE_AUTHKEY per launch; the built-in default is only accepted on
+# local sockets (Unix socket, named pipe, loopback host).
+INFERENCE_ADDRESS = os.getenv("INFERENCE_ADDRESS", "")
+DEFAULT_INFERENCE_AUTHKEY = "face-recognition"
+INFERENCE_AUTHKEY = os.getenv("INFERENCE_AUTHKEY", DEFAULT_INFERENCE_AUTHKEY)
+INFERENCE_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_TIMEOUT_SECONDS", 60))
+# serve.py: HTTP worker processes sharing the inference process and the mmap'd index
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", 4))
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("SERVE_PORT", 5000))
+
+# Dataset rebuild: number of worker processes (each loads its own model copy).
+# 1 runs the rebuild in-process.
+REBUILD_WORKERS = int(os.getenv("REBUILD_WORKERS", min(4, os.cpu_count() or 1)))
+# While a rebuild runs, journal compaction is paused (in every process) so the
+# registrations made meanwhile can be replayed onto the rebuilt gallery. The
+# pause expires this many seconds after the rebuild's last sign of life
+# (e.g. after a crash).
+REBUILD_MARKER_TTL_SECONDS = float(os.getenv("REBUILD_MARKER_TTL_SECONDS", 900))
+
+# Threshold cho Unknown: minimum cosine similarity for a match, used by every
+# endpoint. Default follows DeepFace's ArcFace cosine threshold (distance 0.68).
+SIM_THRESHOLD = float(os.getenv("SIM_THRESHOLD", 0.32))
 
 # Upload folder
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "dataset")
@@ -24,3 +132,43 @@ UPLOAD_FOLDER = os.path.join(BASE_DIR, "dataset")
 # Temporary file cleanup (seconds). Files older than this will be removed by
 # the background cleaner thread. Default: 15 minutes.
 TEMP_FILE_TTL_SECONDS = int(os.getenv('TEMP_FILE_TTL_SECONDS', 15 * 60))
+
+# Streaming recognition (/api/face/stream/<camera_id>): a camera's worker stops
+# after this many idle seconds; event streams send a keep-alive this often.
+STREAM_IDLE_SECONDS = float(os.getenv("STREAM_IDLE_SECONDS", 30))
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", 15))
+# At most this many cameras stream at once (one worker thread each); frames or
+# connections for another camera id are refused until one goes idle
+STREAM_MAX_CAMERAS = int(os.getenv("STREAM_MAX_CAMERAS", 32))
+
+# Face tracking per camera session: reuse a tracked face's identity instead of
+# re-embedding it. A detection joins a track at IoU >= TRACK_IOU_MIN; the model
+# re-verifies a track every TRACK_REVERIFY_SECONDS, or on every frame while its
+# cosine is below SIM_THRESHOLD + TRACK_VERIFY_MARGIN.
+TRACK_IOU_MIN = float(os.getenv("TRACK_IOU_MIN", 0.3))
+TRACK_REVERIFY_SECONDS = float(os.getenv("TRACK_REVERIFY_SECONDS", 2.0))
+TRACK_VERIFY_MARGIN = float(os.getenv("TRACK_VERIFY_MARGIN", 0.05))
+TRACK_MAX_AGE_SECONDS = float(os.getenv("TRACK_MAX_AGE_SECONDS", 1.5))
+TRACK_SESSION_TTL_SECONDS = float(os.getenv("TRACK_SESSION_TTL_SECONDS", 300))
+
+# ASGI service (app_asgi.py): threads for blocking work, and backpressure.
+# Requests that need the model are rejected with 503 when ASGI_MAX_INFLIGHT are
+# already running or the inference queue holds more than ASGI_MAX_QUEUE_DEPTH jobs.
+ASGI_EXECUTOR_THREADS = int(os.getenv("ASGI_EXECUTOR_THREADS", 32))
+ASGI_MAX_INFLIGHT = int(os.getenv("ASGI_MAX_INFLIGHT", 64))
+ASGI_MAX_QUEUE_DEPTH = int(os.getenv("ASGI_MAX_QUEUE_DEPTH", 256))
+# How often the inference queue depth is refreshed for that check (seconds)
+ASGI_QUEUE_POLL_SECONDS = float(os.getenv("ASGI_QUEUE_POLL_SECONDS", 0.05))
+
+# Metrics (/metrics, /api/face/metrics): p50/p95/p99 are computed over the
+# last METRICS_WINDOW samples of each latency histogram.
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", 1024))
+
+# app_cli.py daemon mode (--daemon / --socket): requests handled concurrently
+CLI_DAEMON_THREADS = int(os.getenv("CLI_DAEMON_THREADS", 4))
+
+# Startup (startup.py): warm-up runs the detectors and the model on this image
+# (a synthetic frame if it is missing). Until warm-up is done, requests that need
+# the model get 503 + Retry-After when STARTUP_REJECT_UNTIL_READY is on.
+STARTUP_WARMUP_IMAGE = os.getenv("STARTUP_WARMUP_IMAGE", os.path.join(BASE_DIR, "samples", "a.jpg"))
+STARTUP_REJECT_UNTIL_READY = os.getenv("STARTUP_REJECT_UNTIL_READY", "1") == "1"
@@ -0,0 +1,197 @@
+"""
+Face detectors that run in the calling thread, and the detector cascade.
+  haar     OpenCV Haar cascade (shipped with opencv-python): boxes only
+  yunet    OpenCV YuNet (cv2.FaceDetectorYN, weights in YUNET_MODEL):
+           boxes, eye landmarks and a 0..1 score
+  cascade  a first stage (CASCADE_FIRST_STAGE) screens a downscaled frame;
+           no proposal means no face, found in a few milliseconds without
+           touching the inference worker. Proposals with eye landmarks and
+           score >= CASCADE_ACCEPT_SCORE are used as-is, every other one is
+           confirmed by the heavy detector on a padded region around it.
+Every other detector name is a DeepFace backend (mtcnn, retinaface, opencv,
+...) run on the inference worker; see face_pipeline.find_faces.
+Detections use the face_pipeline format: {box: (x, y, w, h), left_eye,
+right_eye, confidence}, left_eye being the person's left eye (image right).
+More detectors can be added with register_detector().
+"""
+
+import os
+import threading
+
+import cv2
+
+from config import (CASCADE_FIRST_STAGE, CASCADE_SCREEN_WIDTH, CASCADE_ACCEPT_SCORE, CASCADE_ROI_PADDING,
+                    YUNET_MODEL)
+from metrics import cascade_frames, cascade_proposals
+from tracking import box_iou
+
+# Proposal thresholds: low, so the first stage misses few faces (the heavy
+# detector weeds out false positives)
+YUNET_MIN_SCORE = 0.5
+HAAR_MIN_NEIGHBORS = 3
+# Overlapping results of neighbouring proposals are the same face
+DUPLICATE_IOU = 0.5
+
+_haar_data = getattr(getattr(cv2, 'data', None), 'haarcascades', None)
+HAAR_MODEL = os.path.join(_haar_data, 'haarcascade_frontalface_default.xml') if _haar_data else None
+
+# OpenCV detector objects are not shared between threads
+_local = threading.local()
+_warned = set()
+
+
+def _detection(box, confidence, left_eye=None, right_eye=None):
+    return {'box': tuple(int(round(v)) for v in box), 'left_eye': left_eye, 'right_eye': right_eye,
+            'confidence': float(confidence)}
+
+
+def haar_available():
+    return hasattr(cv2, 'CascadeClassifier') and HAAR_MODEL is not None and os.path.isfile(HAAR_MODEL)
+
+
+def detect_haar(img):
+    """Haar cascade on a BGR image. Confidence is the stage weight squashed to 0..1."""
+    detector = getattr(_local, 'haar', None)
+    if detector is None:
+        detector = _local.haar = cv2.CascadeClassifier(HAAR_MODEL)
+    gray = cv2.equalizeHist(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+    min_side = max(20, min(gray.shape[:2]) // 20)
+    boxes, _, weights = detector.detectMultiScale3(gray, scaleFactor=1.1, minNeighbors=HAAR_MIN_NEIGHBORS,
+                                                   minSize=(min_side, min_side), outputRejectLevels=True)
+    return [_detection(box, max(0.0, float(w)) / (1.0 + max(0.0, float(w))))
+            for box, w in zip(boxes, list(weights))]
+
+
+def yunet_available():
+    return hasattr(cv2, 'FaceDetectorYN') and bool(YUNET_MODEL) and os.path.isfile(YUNET_MODEL)
+
+
+def detect_yunet(img):
+    """YuNet on a BGR image; rows are x, y, w, h, right eye, left eye, nose, mouth corners, score."""
+    h, w = img.shape[:2]
+    detector = getattr(_local, 'yunet', None)
+    if detector is None:
+        detector = _local.yunet = cv2.FaceDetectorYN.create(YUNET_MODEL, "", (w, h), YUNET_MIN_SCORE)
+    detector.setInputSize((w, h))
+    _, faces = detector.detect(img)
+    detections = []
+    for row in faces if faces is not None else []:
+        x, y, bw, bh = (float(v) for v in row[:4])
+        # YuNet boxes can start outside the frame
+        x0, y0 = max(0.0, x), max(0.0, y)
+        box = (x0, y0, min(w, x + bw) - x0, min(h, y + bh) - y0)
+        if box[2] <= 0 or box[3] <= 0:
+            continue
+        detections.append(_detection(box, row[14], left_eye=(float(row[6]), float(row[7])),
+                                     right_eye=(float(row[4]), float(row[5]))))
+    return detections
+
+
+# name -> (detect(img) -> detections, available() -> bool)
+DETECTORS = {
+    'haar': (detect_haar, haar_available),
+    'yunet': (detect_yunet, yunet_available),
+}
+
+
+def register_detector(name, detect, available=lambda: True):
+    """Add an in-process detector usable as FACE_DETECTOR, FAST_DETECTOR or cascade first stage."""
+    DETECTORS[name] = (detect, available)
+
+
+def is_local(name):
+    """True if `name` is one of the in-process detectors above (not a DeepFace backend)."""
+    return name in DETECTORS
+
+
+def detect(name, img):
+    fn, available = DETECTORS[name]
+    if not available():
+        raise RuntimeError(f"Detector '{name}' is not available (OpenCV build or weights missing)")
+    return fn(img)
+
+
+def first_stage(name=CASCADE_FIRST_STAGE):
+    """The usable first-stage detector for `name` ("auto": YuNet, else Haar), or None."""
+    candidates = ('yunet', 'haar') if name == 'auto' else (name,)
+    for candidate in candidates:
+        entry = DETECTORS.get(candidate)
+        if entry is not None and entry[1]():
+            return candidate
+    if name not in _warned:
+        _warned.add(name)
+        print(f"⚠️ Cascade first stage '{name}' unavailable, using the heavy detector on full frames")
+    return None
+
+
+def _downscale(img, width):
+    """(image at most `width` px wide, x scale, y scale back to `img`)."""
+    h, w = img.shape[:2]
+    if not width or w <= width:
+        return img, 1.0, 1.0
+    small_h = max(1, int(round(h * width / float(w))))
+    small = cv2.resize(img, (int(width), small_h), interpolation=cv2.INTER_AREA)
+    return small, w / float(width), h / float(small_h)
+
+
+def _transform(det, sx=1.0, sy=1.0, dx=0, dy=0):
+    """Map a detection by scale (sx, sy) and then offset (dx, dy)."""
+    def point(p):
+        return None if p is None else (float(p[0]) * sx + dx, float(p[1]) * sy + dy)
+    x, y, w, h = det['box']
+    return dict(det, box=(int(x * sx) + dx, int(y * sy) + dy, int(w * sx), int(h * sy)),
+                left_eye=point(det.get('left_eye')), right_eye=point(det.get('right_eye')))
+
+
+def _region(box, padding, shape):
+    """`box` grown by `padding` of its size on every side, clipped to the image."""
+    x, y, w, h = box
+    img_h, img_w = shape[:2]
+    left, top = max(0, int(x - w * padding)), max(0, int(y - h * padding))
+    right, bottom = min(img_w, int(x + w * (1 + padding))), min(img_h, int(y + h * (1 + padding)))
+    return left, top, right - left, bottom - top
+
+
+def _area(det):
+    return det['box'][2] * det['box'][3]
+
+
+def cascade(img, confirm, first=CASCADE_FIRST_STAGE, screen_width=CASCADE_SCREEN_WIDTH,
+            accept_score=CASCADE_ACCEPT_SCORE, padding=CASCADE_ROI_PADDING):
+    """
+    Two-stage detection on `img` (BGR). `confirm(crops)` runs the heavy
+    detector on a list of image crops and returns one detection list per crop
+    (crop coordinates). Returns detections in `img` coordinates, largest
+    first, or None if no first-stage detector is available.
+    """
+    name = first_stage(first)
+    if name is None:
+        return None
+    small, sx, sy = _downscale(img, screen_width)
+    proposals = [_transform(det, sx, sy) for det in detect(name, small)]
+    if not proposals:
+        cascade_frames.inc(outcome='empty')
+        return []
+    cascade_frames.inc(outcome='faces')
+
+    accepted, ambiguous = [], []
+    for det in proposals:
+        landmarks = det['left_eye'] is not None and det['right_eye'] is not None
+        (accepted if landmarks and det['confidence'] >= accept_score else ambiguous).append(det)
+    cascade_proposals.inc(len(accepted), outcome='accepted')
+
+    if ambiguous:
+        regions = [_region(det['box'], padding, img.shape) for det in ambiguous]
+        crops = [img[y:y + h, x:x + w] for x, y, w, h in regions]
+        for (x, y, _, _), found in zip(regions, confirm(crops)):
+            if not found:
+                cascade_proposals.inc(outcome='rejected')
+                continue
+            cascade_proposals.inc(outcome='confirmed')
+            accepted.append(_transform(max(found, key=_area), dx=x, dy=y))
+
+    detections = []
+    for det in sorted(accepted, key=_area, reverse=True):
+        if all(box_iou(det['box'], kept['box']) < DUPLICATE_IOU for kept in detections):
+            detections.append(det)
+    return detections
@@ -0,0 +1,119 @@
+"""
+Persistent per-image embedding cache used by dataset rebuilds.
+Embeddings are keyed by the SHA-256 of the image bytes plus the pipeline
+fingerprint (FACE_MODEL, FACE_DETECTOR, crop padding, alignment), so a
+rebuild only embeds new or modified files, and changing the model or
+detector config invalidates every entry automatically. "No face" results
+are cached too so unusable images are not retried on every rebuild.
+File hashes are memoized by (path, size, mtime) to avoid re-reading
+unchanged files.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from config import EMBEDDING_CACHE_PATH
+from face_pipeline import pipeline_fingerprint
+from metrics import cache_requests
+
+
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDING_CACHE_PATH, fingerprint=None):
+        self.path = path
+        self.fingerprint = fingerprint or pipeline_fingerprint()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " sha256 TEXT, fingerprint TEXT, embedding BLOB, error TEXT, created REAL,"
+            " PRIMARY KEY (sha256, fingerprint))"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def file_hash(self, path):
+        """SHA-256 of the file contents, reusing the stored hash if size/mtime are unchanged."""
+        st = os.stat(path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size, mtime_ns, sha256 FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        sha = digest.hexdigest()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                (path, st.st_size, st.st_mtime_ns, sha)
+            )
+        return sha
+
+    def get(self, sha):
+        """Return (found, embedding or None, error or None) for the current fingerprint."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT embedding, error FROM embeddings WHERE sha256 = ? AND fingerprint = ?",
+                (sha, self.fingerprint)
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            cache_requests.inc(cache='embedding', result='miss')
+            return False, None, None
+        self.hits += 1
+        cache_requests.inc(cache='embedding', result='hit')
+        embedding = np.frombuffer(row[0], dtype='<f4').copy() if row[0] is not None else None
+        return True, embedding, row[1]
+
+    def put(self, sha, embedding, error=None):
+        blob = None if embedding is None else np.asarray(embedding, dtype='<f4').tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (sha256, fingerprint, embedding, error, created)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (sha, self.fingerprint, blob, error, time.time())
+            )
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def prune(self, live_paths=None):
+        """
+        Drop entries computed with another model/detector config and, if
+        live_paths is given, file records for images that no longer exist and
+        the embeddings no remaining file record refers to.
+        """
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM embeddings WHERE fingerprint != ?", (self.fingerprint,)
+            ).rowcount
+            if live_paths is not None:
+                live = set(live_paths)
+                stale = [(p,) for (p,) in self._conn.execute("SELECT path FROM files") if p not in live]
+                self._conn.executemany("DELETE FROM files WHERE path = ?", stale)
+                removed += self._conn.execute(
+                    "DELETE FROM embeddings WHERE sha256 NOT IN (SELECT sha256 FROM files)"
+                ).rowcount
+            self._conn.commit()
+        return removed
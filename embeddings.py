@@ -1,298 +1,1013 @@
 import os
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
 import faiss
-from deepface import DeepFace
-from config import FACE_MODEL, FACE_DETECTOR, INDEX_PATH, LABELS_PATH, EMBEDDINGS_DIR
+from config import (INDEX_PATH, LABELS_PATH, EMBEDDINGS_DIR, SNAPSHOT_PATH, JOURNAL_PATH,
+                    JOURNAL_COMPACT_RECORDS, REBUILD_WORKERS, INDEX_TYPE, INDEX_AUTO_IVF_MIN,
+                    INDEX_AUTO_IVFPQ_MIN, INDEX_NPROBE, INDEX_HNSW_M, INDEX_EF_SEARCH, INDEX_TARGET_RECALL,
+                    INDEX_EF_CONSTRUCTION, INDEX_METRIC, INDEX_MMAP, GALLERY_EXEMPLARS,
+                    GALLERY_RERANK_PERSONS, GALLERY_AGGREGATION, GALLERY_TOP_M,
+                    INDEX_DELETED_COMPACT_RATIO, REBUILD_MARKER_TTL_SECONDS)
+from journal import EmbeddingJournal
+from face_pipeline import extract_embeddings, pipeline_fingerprint
+from embedding_cache import EmbeddingCache
+from scoring import similarity_from_search
+from snapshot import read_snapshot, write_snapshot
+from gallery import GalleryState, aggregate, normalize, select_exemplars
 
 os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
 
-def add_embedding(img_path, person_id):
+
+def _file_stamp(path):
     try:
-        # First attempt to detect and get facial_area
-        reps = DeepFace.represent(
-            img_path=img_path,
-            model_name=FACE_MODEL,
-            detector_backend=FACE_DETECTOR,
-            enforce_detection=False
-        )
-    except Exception as e:
-        print(f"⚠️ DeepFace.represent error during add_embedding: {e}")
-        reps = None
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
 
-    if not reps:
-        print("Warning: no face found in image (initial detect)")
-        return False
 
-    # If facial_area info exists, crop original image and compute embedding on the crop
-    embedding = None
-    facial_area = reps[0].get('facial_area') if isinstance(reps[0], dict) else None
-    if facial_area:
-        try:
-            from PIL import Image
-            import uuid
-            orig = Image.open(img_path).convert('RGB')
-            # facial_area may be tuple (x,y,w,h) or dict
-            if isinstance(facial_area, (list, tuple)) and len(facial_area) == 4:
-                x, y, w, h = facial_area
-            elif isinstance(facial_area, dict) and {'x','y','w','h'}.issubset(facial_area.keys()):
-                x = facial_area['x']; y = facial_area['y']; w = facial_area['w']; h = facial_area['h']
-            else:
-                x = y = w = h = None
-
-            if x is not None:
-                left = int(max(0, x))
-                top = int(max(0, y))
-                right = int(min(orig.width, x + w))
-                bottom = int(min(orig.height, y + h))
-                pad_w = int((right - left) * 0.15)
-                pad_h = int((bottom - top) * 0.15)
-                left = max(0, left - pad_w)
-                top = max(0, top - pad_h)
-                right = min(orig.width, right + pad_w)
-                bottom = min(orig.height, bottom + pad_h)
-
-                crop = orig.crop((left, top, right, bottom))
-                tmp_crop = os.path.join(os.path.dirname(img_path), f"tmp_regcrop_{uuid.uuid4().hex}.jpg")
-                crop.save(tmp_crop)
-                reps_crop = DeepFace.represent(
-                    img_path=tmp_crop,
-                    model_name=FACE_MODEL,
-                    detector_backend=FACE_DETECTOR,
-                    enforce_detection=False
-                )
-                if reps_crop and isinstance(reps_crop, list) and 'embedding' in reps_crop[0]:
-                    embedding = np.array([reps_crop[0]['embedding']]).astype('float32')
-                try:
-                    if os.path.exists(tmp_crop):
-                        os.remove(tmp_crop)
-                except Exception:
-                    pass
-        except Exception as e:
-            print(f"Warning: failed to crop and compute embedding on crop during register: {e}")
+# -- Index factory ------------------------------------------------------------
+#
+# flat  : exact brute-force scan (IndexFlatL2)
+# ivf   : inverted lists over k-means cells, exact vectors (IndexIVFFlat)
+# hnsw  : graph search, no training (IndexHNSWFlat)
+# ivfpq : inverted lists + product-quantized codes, smallest memory (IndexIVFPQ)
+# INDEX_TYPE="auto" picks flat / ivf / ivfpq from the gallery size.
 
-    # Fallback to using embedding from initial represent if crop-based embedding isn't available
-    if embedding is None:
-        try:
-            embedding = np.array([reps[0]["embedding"]]).astype("float32")
-        except Exception:
-            print("⚠️ No embedding available to add")
-            return False
-
-    # Load FAISS index
-    if os.path.exists(INDEX_PATH):
-        index = faiss.read_index(INDEX_PATH)
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'ivfpq')
+INDEX_METRICS = {'ip': faiss.METRIC_INNER_PRODUCT, 'l2': faiss.METRIC_L2}
+
+
+def choose_index_type(n, index_type=INDEX_TYPE):
+    """Return the index type to use for a gallery of n vectors."""
+    if index_type != 'auto':
+        return index_type
+    if n >= INDEX_AUTO_IVFPQ_MIN:
+        return 'ivfpq'
+    if n >= INDEX_AUTO_IVF_MIN:
+        return 'ivf'
+    return 'flat'
+
+
+def metric_of(index):
+    """'ip' for inner-product (cosine on unit vectors) indexes, else 'l2'."""
+    return 'ip' if index.metric_type == faiss.METRIC_INNER_PRODUCT else 'l2'
+
+
+def _extract_ivf(index):
+    ivf = faiss.try_extract_index_ivf(index)
+    return faiss.downcast_index(ivf) if ivf is not None else None
+
+
+def index_type_of(index):
+    """Inspect a FAISS index and return its type name."""
+    if isinstance(index, faiss.IndexHNSW):
+        return 'hnsw'
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        return 'ivfpq' if isinstance(ivf, faiss.IndexIVFPQ) else 'ivf'
+    return 'flat'
+
+
+def _ivf_nlist(n):
+    # ~4*sqrt(n) cells, keeping at least 39 training points per cell
+    return int(max(1, min(4 * np.sqrt(n), n // 39)))
+
+
+def _pq_subquantizers(d):
+    # Up to 64 sub-quantizers with at least 4 dimensions each
+    for m in (64, 32, 16, 8, 4, 2, 1):
+        if d % m == 0 and d // m >= 4:
+            return m
+    return 1
+
+
+# Upper bound for the tuned HNSW efSearch
+_MAX_EF_SEARCH = 1024
+
+
+def configure_search(index):
+    """Apply query-time parameters (nprobe / efSearch) set in config; 0 keeps the tuned ones."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and INDEX_NPROBE:
+        ivf.nprobe = int(min(INDEX_NPROBE, ivf.nlist))
+    if isinstance(index, faiss.IndexHNSW) and INDEX_EF_SEARCH:
+        index.hnsw.efSearch = INDEX_EF_SEARCH
+    return index
+
+
+def _noisy_queries(vectors, n_queries, seed=0):
+    """Gallery vectors with small noise added, like a new photo of an enrolled person."""
+    rng = np.random.default_rng(seed)
+    pick = rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    queries = vectors[pick] + rng.normal(0, 0.02, (len(pick), vectors.shape[1])).astype('float32')
+    return np.ascontiguousarray(queries / np.linalg.norm(queries, axis=1, keepdims=True), dtype='float32')
+
+
+def _recall(found, truth):
+    return float(np.mean([len(set(f) & set(t)) / float(truth.shape[1]) for f, t in zip(found, truth)]))
+
+
+def tune_search(index, vectors, k=GALLERY_RERANK_PERSONS, target=INDEX_TARGET_RECALL, n_queries=200):
+    """
+    Set nprobe (IVF) or efSearch (HNSW) of `index`, built over `vectors`, to
+    the smallest value reaching `target` recall@k against an exact search.
+    Starts at nlist/64 (IVF) and doubles; stops early once recall no longer
+    improves (IVF-PQ codes cap it). The value is saved with the index.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    hnsw = isinstance(index, faiss.IndexHNSW)
+    if ivf is None and not hnsw or not index.ntotal:
+        return index
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    queries = _noisy_queries(vectors, n_queries)
+    k = max(1, min(k, len(vectors)))
+    exact = faiss.IndexFlat(index.d, index.metric_type)
+    exact.add(vectors)
+    truth = exact.search(queries, k)[1]
+
+    if ivf is not None:
+        value, limit = max(1, ivf.nlist // 64), ivf.nlist
     else:
-        index = faiss.IndexFlatL2(embedding.shape[1])
+        value, limit = max(16, k), _MAX_EF_SEARCH
+    previous = -1.0
+    while True:
+        if ivf is not None:
+            ivf.nprobe = value
+        else:
+            index.hnsw.efSearch = value
+        recall = _recall(index.search(queries, k)[1], truth)
+        if recall >= target or value >= limit or recall < previous + 0.005:
+            return index
+        previous, value = recall, min(limit, value * 2)
+
 
-    # Load labels
-    if os.path.exists(LABELS_PATH):
-        labels = np.load(LABELS_PATH)
+def build_index(vectors, index_type=None, metric=INDEX_METRIC):
+    """
+    Build a trained FAISS index of the requested type (default: chosen from
+    the size of `vectors`) and add `vectors` to it. Falls back to a simpler
+    type when there are too few vectors to train the requested one.
+    metric is 'ip' (search returns cosine similarity) or 'l2'.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    n, d = vectors.shape
+    index_type = index_type or choose_index_type(n)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}")
+    if metric not in INDEX_METRICS:
+        raise ValueError(f"Unknown index metric: {metric}")
+    faiss_metric = INDEX_METRICS[metric]
+
+    if index_type == 'ivfpq' and n < 256 * 39:
+        index_type = 'ivf'
+    if index_type == 'ivf' and n < 2 * 39:
+        index_type = 'flat'
+
+    if index_type == 'flat':
+        index = faiss.IndexFlat(d, faiss_metric)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(d, INDEX_HNSW_M, faiss_metric)
+        index.hnsw.efConstruction = INDEX_EF_CONSTRUCTION
     else:
-        labels = np.array([])
+        nlist = _ivf_nlist(n)
+        quantizer = faiss.IndexFlat(d, faiss_metric)
+        if index_type == 'ivf':
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss_metric)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, _pq_subquantizers(d), 8, faiss_metric)
+        # Train on a sample; k-means needs far fewer points than the full gallery
+        rng = np.random.default_rng(0)
+        sample = vectors if n <= nlist * 256 else vectors[rng.choice(n, nlist * 256, replace=False)]
+        index.train(sample)
+
+    if n:
+        index.add(vectors)
+        tune_search(index, vectors)
+    return configure_search(index)
+
+
+def reconstruct_all(index):
+    """Return all vectors stored in `index` (approximate for ivfpq)."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype='float32')
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def index_params(index):
+    """Parameters persisted with the snapshot for inspection/debugging."""
+    params = {'type': index_type_of(index), 'metric': metric_of(index), 'd': int(index.d), 'ntotal': int(index.ntotal)}
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        params.update(nlist=int(ivf.nlist), nprobe=int(ivf.nprobe))
+        if isinstance(ivf, faiss.IndexIVFPQ):
+            params.update(pq_m=int(ivf.pq.M), pq_nbits=int(ivf.pq.nbits))
+    if isinstance(index, faiss.IndexHNSW):
+        params.update(hnsw_m=INDEX_HNSW_M, ef_search=int(index.hnsw.efSearch))
+    return params
+
+
+def index_recall_report(vectors, queries=None, k=10, index_types=INDEX_TYPES, n_queries=200):
+    """
+    Compare each index type against the exact flat baseline on `vectors`.
+    Queries default to gallery vectors with small noise added (like a new
+    photo of an enrolled person). Returns one dict per type with
+    recall@k, mean/p95 query latency (ms) and build time (s).
+    """
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    if queries is None:
+        queries = _noisy_queries(vectors, n_queries)
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    k = max(1, min(k, len(vectors)))
+
+    report = []
+    truth = None
+    for index_type in index_types:
+        t0 = time.perf_counter()
+        index = build_index(vectors, index_type)
+        build_s = time.perf_counter() - t0
+
+        latencies = []
+        found = np.empty((len(queries), k), dtype=np.int64)
+        for i, q in enumerate(queries):
+            t0 = time.perf_counter()
+            _, I = index.search(q[np.newaxis, :], k)
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            found[i] = I[0]
+        if truth is None:
+            truth = found if index_type == 'flat' else build_index(vectors, 'flat').search(queries, k)[1]
+        report.append({
+            'type': index_type,
+            'built_as': index_type_of(index),
+            'recall_at_k': round(_recall(found, truth), 4),
+            'k': k,
+            'mean_ms': round(float(np.mean(latencies)), 4),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 4),
+            'build_seconds': round(build_s, 3),
+            'params': index_params(index),
+        })
+    return report
+
+
+class IndexCache:
+    """
+    Process-wide holder for the gallery (see gallery.py): the first-stage
+    centroid index (one row per person) and each person's exemplars.
+
+    On disk the gallery is a snapshot (snapshot.py: centroid index, exemplar
+    vectors and labels, per-person centroid sums and counts, and the journal
+    position it covers, one file replaced atomically) plus an append-only
+    journal of registrations made since. The pair is loaded once and served
+    from memory; new journal records are replayed incrementally and the
+    snapshot is reloaded only when it changes on disk (e.g. another process
+    compacted or rebuilt). Registration appends to the journal in O(1) and
+    updates the person's centroid in a small in-memory overlay index that is
+    searched alongside the snapshot's (the stale snapshot row is skipped);
+    once JOURNAL_COMPACT_RECORDS records have accumulated the journal is
+    folded into a fresh snapshot in the background, keeping at most
+    GALLERY_EXEMPLARS diverse exemplars per person.
+
+    With mmap=True (INDEX_MMAP, for multi-process serving) every process
+    maps the snapshot's index read-only (faiss IO_FLAG_MMAP), so the gallery
+    is in RAM once (page cache) however many workers serve it, and loading
+    costs no copy at any size. Writers (compaction/rebuild, under the journal
+    lock) rename a complete new snapshot over the old one; readers notice on
+    their next call and map the new file (existing mappings stay valid).
+    Without mmap the snapshot is read into memory and closed.
+    """
 
-    # Normalize embedding to unit length (recommended for ArcFace / cosine similarity)
-    try:
-        norm = np.linalg.norm(embedding, axis=1, keepdims=True)
-        norm[norm == 0] = 1.0
-        embedding = embedding / norm
-    except Exception:
-        pass
-
-    # Add new data
-    index.add(embedding)
-    faiss.write_index(index, INDEX_PATH)
-
-    labels = np.append(labels, person_id)
-    # Ensure integer dtype for labels
+    def __init__(self, snapshot_path=SNAPSHOT_PATH, journal_path=JOURNAL_PATH, legacy_index_path=INDEX_PATH,
+                 legacy_labels_path=LABELS_PATH, compact_records=JOURNAL_COMPACT_RECORDS, mmap=INDEX_MMAP):
+        self.snapshot_path = snapshot_path
+        # Windows cannot rename a new snapshot over a file mapped by any process
+        self.mmap = mmap and os.name != 'nt'
+        self.legacy_index_path = legacy_index_path
+        self.legacy_labels_path = legacy_labels_path
+        self.compact_records = compact_records
+        self.journal = EmbeddingJournal(journal_path)
+        self._lock = threading.RLock()
+        self._compacting = threading.Lock()
+        self._index = None
+        self._gallery = None
+        self._overlay = None
+        self._overlay_persons = None
+        self._migrate = False
+        self._snapshot_stamp = None
+        self._journal_stamp = None
+        self._journal_id = None
+        self._journal_offset = 0
+        self._journal_records = 0
+
+    # -- snapshot I/O -----------------------------------------------------
+
+    def _read_snapshot(self):
+        """Return (index, GalleryState, journal_id, journal_offset, migrate) from disk or Nones."""
+        if os.path.exists(self.snapshot_path):
+            snap = read_snapshot(self.snapshot_path, mmap=self.mmap)
+            if snap.model_id != pipeline_fingerprint():
+                print(f"⚠️ Gallery snapshot was built with '{snap.model_id}', current pipeline is "
+                      f"'{pipeline_fingerprint()}'; rebuild the index (POST /api/face/rebuild?force=1)")
+            journal_id = bytes.fromhex(snap.metadata.get('journal_id') or '') or None
+            journal_offset = int(snap.metadata.get('journal_offset', 0))
+            gallery = GalleryState(snap.vectors, snap.labels, snap.arrays['persons'],
+                                   snap.arrays['centroids'], snap.arrays['counts'])
+            configure_search(snap.index)
+            if snap.index.ntotal != len(gallery.persons):
+                raise ValueError(f"index/persons size mismatch ({snap.index.ntotal} != {len(gallery.persons)})")
+            return snap.index, gallery, journal_id, journal_offset, False
+        if os.path.exists(self.legacy_index_path) and os.path.exists(self.legacy_labels_path):
+            # Gallery written before the journal existed; it covers no journal records
+            index = faiss.read_index(self.legacy_index_path)
+            labels = np.load(self.legacy_labels_path).astype(np.int64)
+            journal_id, journal_offset = None, 0
+            vectors = reconstruct_all(index)
+        else:
+            return None, None, None, 0, False
+        if len(vectors) != len(labels):
+            raise ValueError(f"vectors/labels size mismatch ({len(vectors)} != {len(labels)})")
+        # Every row is an exemplar; centroids are derived here and the gallery
+        # is rewritten as a snapshot at the next compaction
+        gallery = GalleryState(vectors, labels)
+        return _build_centroid_index(gallery.centroids), gallery, journal_id, journal_offset, True
+
+    def _write_snapshot(self, index, gallery_arrays, journal_id, journal_offset):
+        """Write the snapshot and return it re-opened; call while holding the journal lock."""
+        write_snapshot(self.snapshot_path, index, gallery_arrays, {
+            'journal_id': (journal_id or b'').hex(),
+            'journal_offset': int(journal_offset),
+            'index_params': index_params(index),
+            'gallery_exemplars': GALLERY_EXEMPLARS,
+        }, model_id=pipeline_fingerprint())
+        return read_snapshot(self.snapshot_path, mmap=self.mmap)
+
+    def _install(self, index, snap):
+        """Serve a snapshot just written by this process."""
+        if self.mmap:
+            index = snap.index
+        configure_search(index)
+        self._index = index
+        self._gallery = GalleryState(snap.vectors, snap.labels, snap.arrays['persons'],
+                                     snap.arrays['centroids'], snap.arrays['counts'])
+        self._overlay = self._overlay_persons = None
+        self._migrate = False
+        self._snapshot_stamp = _file_stamp(self.snapshot_path)
+        self._journal_records = 0
+
+    # -- in-memory state --------------------------------------------------
+
+    def _apply(self, vectors, labels, tombstones=None):
+        if vectors is None or not len(labels):
+            return
+        vectors = np.ascontiguousarray(vectors, dtype='float32')
+        if self._gallery is None:
+            if not vectors.shape[1]:
+                return  # only deletions, nothing to delete from
+            self._gallery = GalleryState(np.zeros((0, vectors.shape[1]), dtype='float32'),
+                                         np.array([], dtype=np.int64))
+        # The snapshot index is never modified: updated centroids go to the
+        # overlay, deleted persons are skipped until the next compaction
+        self._gallery.add(vectors, labels, tombstones)
+        self._overlay = None
+        self._journal_records += len(labels)
+
+    def _overlay_index(self):
+        """Flat index of the centroids changed since the snapshot (built lazily)."""
+        if self._overlay is None and self._gallery is not None and self._gallery.updated:
+            persons = list(self._gallery.updated)
+            self._overlay = faiss.IndexFlatIP(self._gallery.vectors.shape[1])
+            self._overlay.add(normalize(np.vstack([self._gallery.updated[p][0] for p in persons])))
+            self._overlay_persons = np.array(persons, dtype=np.int64)
+        return self._overlay
+
+    def _replay_journal(self, offset):
+        journal_id, vectors, labels, _, tombstones, end = self.journal.read(offset)
+        self._apply(vectors, labels, tombstones)
+        self._journal_id = journal_id
+        self._journal_offset = end
+        self._journal_stamp = _file_stamp(self.journal.path)
+
+    def stamp(self):
+        """(snapshot, journal) file stamps; they change on every write by any process."""
+        snapshot_stamp = _file_stamp(self.snapshot_path) or _file_stamp(self.legacy_index_path)
+        return snapshot_stamp, _file_stamp(self.journal.path)
+
+    def _reload_if_changed(self):
+        snapshot_stamp, journal_stamp = self.stamp()
+        if snapshot_stamp == self._snapshot_stamp and journal_stamp == self._journal_stamp:
+            return
+
+        same_journal = (journal_stamp is not None and self._journal_stamp is not None
+                        and journal_stamp[0] == self._journal_stamp[0])
+        if snapshot_stamp == self._snapshot_stamp and same_journal:
+            # Only new journal records (appended by us or another process)
+            self._replay_journal(self._journal_offset)
+            return
+
+        try:
+            index, gallery, snap_journal_id, snap_offset, migrate = self._read_snapshot()
+        except Exception as e:
+            # Another process may be halfway through writing; keep serving the
+            # previous copy and retry on the next call.
+            print(f"⚠️ Failed to reload FAISS index, keeping cached copy: {e}")
+            return
+        self._index, self._gallery, self._migrate = index, gallery, migrate
+        self._overlay = self._overlay_persons = None
+        self._snapshot_stamp = snapshot_stamp
+        self._journal_records = 0
+        # Replay the records the snapshot does not cover yet
+        if snap_journal_id is not None and snap_journal_id == self.journal.journal_id():
+            self._replay_journal(snap_offset)
+        else:
+            self._replay_journal(0)
+        if self._gallery is not None:
+            print(f"📁 Loaded gallery with {len(self._gallery.all_persons()[0])} persons, "
+                  f"{self._gallery.exemplar_count()} exemplars ({self._journal_records} from journal"
+                  f"{', memory-mapped' if self.mmap else ''})")
+
+    def _candidates(self, queries, p):
+        """Per query, up to p (similarity, person) pairs from the centroid indexes, best first."""
+        gallery = self._gallery
+        found = [[] for _ in range(len(queries))]
+        if self._index is not None and self._index.ntotal:
+            # Snapshot rows of updated or deleted persons are stale: over-fetch and skip them
+            n = min(int(self._index.ntotal), p + len(gallery.updated) + len(gallery.dropped))
+            D, I = self._index.search(queries, n)
+            S = similarity_from_search(D, self._index.metric_type)
+            persons = gallery.persons
+            for row, (s_row, i_row) in enumerate(zip(S, I)):
+                found[row] += [(float(s), int(persons[i])) for s, i in zip(s_row, i_row)
+                               if i >= 0 and not gallery.stale(int(persons[i]))]
+        overlay = self._overlay_index()
+        if overlay is not None:
+            D, I = overlay.search(queries, min(int(overlay.ntotal), p))
+            for row, (s_row, i_row) in enumerate(zip(D, I)):
+                found[row] += [(float(s), int(self._overlay_persons[i])) for s, i in zip(s_row, i_row) if i >= 0]
+        return [sorted(row, reverse=True)[:p] for row in found]
+
+    # -- public API -------------------------------------------------------
+
+    def get(self):
+        """
+        Return the first-stage (centroid index, person ids), or (None, None)
+        if no gallery exists yet. With registrations pending this is a merged
+        in-memory copy (for reports/debugging); searches use search().
+        """
+        with self._lock:
+            self._reload_if_changed()
+            if self._gallery is None:
+                return None, None
+            if not self._gallery.updated:
+                return self._index, self._gallery.persons
+            persons, means, _ = self._gallery.all_persons()
+            return _build_centroid_index(means, 'flat'), persons
+
+    def get_vectors(self):
+        """Return (exemplar vectors, labels) of the gallery, or (None, None)."""
+        with self._lock:
+            self._reload_if_changed()
+            if self._gallery is None:
+                return None, None
+            vectors, labels = self._gallery.compacted(None)
+            return (vectors, labels) if len(labels) else (None, None)
+
+    def info(self):
+        """Cheap summary of the served gallery, or None if there is none."""
+        with self._lock:
+            self._reload_if_changed()
+            if self._gallery is None:
+                return None
+            index = self._index if self._index is not None and self._index.ntotal else self._overlay_index()
+            if index is None:
+                return None
+            return {
+                'entries': self._gallery.exemplar_count(),
+                'persons': len(self._gallery.all_persons()[0]),
+                'snapshot_entries': int(len(self._gallery.labels)),
+                'journal_entries': int(self._journal_records),
+                'deleted_persons': len(self._gallery.dropped),
+                'mmap': bool(self.mmap),
+                'params': index_params(index),
+                'gallery': {'exemplars': GALLERY_EXEMPLARS, 'rerank_persons': GALLERY_RERANK_PERSONS,
+                            'aggregation': GALLERY_AGGREGATION, 'top_m': GALLERY_TOP_M},
+            }
+
+    def search(self, queries, k=1, rerank_persons=GALLERY_RERANK_PERSONS):
+        """
+        Two-stage search: the `rerank_persons` (at least k) best persons by
+        centroid, reranked by their exemplars (see gallery.aggregate).
+        Returns (S, I, labels) or None if no gallery: S[q, j] is the cosine
+        similarity of the j-th best person and labels[I[q, j]] its person id
+        (-1 where fewer than k persons exist). One hit per person.
+        """
+        with self._lock:
+            self._reload_if_changed()
+            if self._gallery is None:
+                return None
+            queries = np.ascontiguousarray(queries, dtype='float32')
+            candidates = self._candidates(queries, max(int(k), int(rerank_persons)))
+            if not any(candidates):
+                return None
+            k = max(1, min(int(k), max(len(row) for row in candidates)))
+
+            exemplars = {}
+            S = np.full((len(queries), k), -1.0, dtype='float32')
+            I = np.full((len(queries), k), -1, dtype=np.int64)
+            labels, column = [], {}
+            for q, (query, row) in enumerate(zip(queries, candidates)):
+                scored = []
+                for centroid_sim, person in row:
+                    if person not in exemplars:
+                        exemplars[person] = self._gallery.exemplars(person)
+                    ex = exemplars[person]
+                    sim = aggregate(np.clip(ex @ query, -1.0, 1.0)) if ex is not None else centroid_sim
+                    scored.append((sim, person))
+                scored.sort(reverse=True)
+                for j, (sim, person) in enumerate(scored[:k]):
+                    if person not in column:
+                        column[person] = len(labels)
+                        labels.append(person)
+                    S[q, j], I[q, j] = sim, column[person]
+            return S, I, np.array(labels, dtype=np.int64)
+
+    def add(self, embeddings, person_ids, deleted=()):
+        """
+        Append exemplars: one O(1) journal append, then an in-memory centroid
+        update. Persons in `deleted` are removed first (in the same append),
+        so add(new, [pid], deleted=[pid]) replaces a person's samples.
+        """
+        if embeddings is None:
+            embeddings = np.zeros((0, 0), dtype='float32')
+        embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+        person_ids = np.asarray(person_ids, dtype=np.int64).reshape(-1)
+        deleted = [int(p) for p in deleted]
+        with self.journal.locked(), self._lock:
+            # Catch up first so a torn tail is cut at the true end of valid records
+            self._reload_if_changed()
+            valid_end = self._journal_offset if self._journal_id is not None else None
+            journal_id, end = self.journal.append(embeddings, person_ids, valid_end=valid_end, deleted=deleted)
+            if deleted:
+                d = embeddings.shape[1] if len(person_ids) else (
+                    self._gallery.vectors.shape[1] if self._gallery is not None else 0)
+                self._apply(np.zeros((len(deleted), d), dtype='float32'), deleted, np.ones(len(deleted), dtype=bool))
+            self._apply(embeddings, person_ids)
+            self._journal_id = journal_id
+            self._journal_offset = end
+            self._journal_stamp = _file_stamp(self.journal.path)
+            pending = self._journal_records
+            # Tombstoned rows still cost search time (over-fetch); drop them once there are many
+            snapshot_persons = len(self._gallery.persons) if self._gallery is not None else 0
+            many_deleted = self._gallery is not None and \
+                len(self._gallery.dropped) > INDEX_DELETED_COMPACT_RATIO * snapshot_persons
+        if (self.compact_records and pending >= self.compact_records) or many_deleted:
+            self.compact_async()
+
+    def remove(self, person_ids):
+        """Delete every sample of the given persons (tombstones, no rebuild)."""
+        self.add(None, [], deleted=person_ids)
+
+    def compact(self):
+        """Fold the journal into a new snapshot and start a fresh journal."""
+        if self.rebuild_running():
+            return  # the rebuild keeps the journal records after its start position
+        if not self._compacting.acquire(blocking=False):
+            return
+        try:
+            # Appends (ours and other processes') wait on the journal lock, so
+            # the copy below stays exactly in sync with (journal_id, offset).
+            with self.journal.locked():
+                if self.rebuild_running():
+                    return  # a rebuild started while we waited for the lock
+                with self._lock:
+                    self._reload_if_changed()
+                    if self._gallery is None or not (self._journal_records or self._migrate):
+                        return
+                    gallery = self._gallery
+                    journal_id, offset = self._journal_id, self._journal_offset
+                # Slow part runs outside the cache lock; searches keep going.
+                # The centroid index is rebuilt with the type for its size and
+                # the configured metric (older L2 galleries are migrated here).
+                arrays = gallery_arrays(gallery)
+                index = _build_centroid_index(arrays['centroids'])
+                snap = self._write_snapshot(index, arrays, journal_id, offset)
+                new_id, new_end = self.journal.rewrite(offset)
+                with self._lock:
+                    self._install(index, snap)
+                    self._journal_id, self._journal_offset = new_id, new_end
+                    self._journal_stamp = _file_stamp(self.journal.path)
+            print(f"🗜️ Compacted embedding journal into snapshot ({len(arrays['persons'])} persons, "
+                  f"{len(arrays['labels'])} exemplars, {index_type_of(index)} centroid index)")
+        except Exception as e:
+            print(f"⚠️ Journal compaction failed: {e}")
+        finally:
+            self._compacting.release()
+
+    def compact_async(self):
+        threading.Thread(target=self.compact, name='journal-compaction', daemon=True).start()
+
+    # -- rebuild --------------------------------------------------------
+
+    @property
+    def _rebuild_marker(self):
+        return self.snapshot_path + '.rebuilding'
+
+    @contextmanager
+    def rebuilding(self):
+        """
+        Mark a rebuild in progress (in any process): compaction is skipped
+        while the marker is fresh, so the journal records after the
+        rebuild's start position stay in the journal. Call touch_rebuild()
+        now and then to keep the marker fresh.
+        """
+        self.touch_rebuild()
+        try:
+            yield
+        finally:
+            try:
+                os.remove(self._rebuild_marker)
+            except OSError:
+                pass
+
+    def touch_rebuild(self):
+        with open(self._rebuild_marker, 'a'):
+            pass
+        os.utime(self._rebuild_marker)
+
+    def rebuild_running(self):
+        stamp = _file_stamp(self._rebuild_marker)
+        # A marker left behind by a crashed rebuild expires
+        return stamp is not None and time.time() - stamp[1] / 1e9 < REBUILD_MARKER_TTL_SECONDS
+
+    def journal_position(self):
+        """(journal_id, offset) of the last journal record applied; a rebuild starts from here."""
+        # Under the journal lock: a compaction already running finishes first
+        with self.journal.locked(), self._lock:
+            self._reload_if_changed()
+            return self._journal_id, self._journal_offset
+
+    def replace(self, arrays, position=None):
+        """
+        Swap in a freshly built gallery (see gallery_arrays, e.g. after a
+        rebuild) and persist it. The new snapshot covers the journal up to
+        `position` (from journal_position() before the rebuild read the
+        dataset; None: everything so far). Records after it (registrations,
+        deletes and photo replacements made during the rebuild) stay in the
+        journal and are replayed on top of the new gallery.
+        """
+        index = _build_centroid_index(arrays['centroids'])
+        with self.journal.locked(), self._lock:
+            self._reload_if_changed()
+            journal_id, offset = position if position is not None else (self._journal_id, self._journal_offset)
+            if journal_id is None:
+                offset = 0  # no journal when the rebuild started: every record is newer
+            elif journal_id != self._journal_id:
+                raise RuntimeError("Embedding journal was compacted during the rebuild; "
+                                   "records since its start would be lost, rebuild again")
+            snap = self._write_snapshot(index, arrays, self._journal_id, offset)
+            self.journal.rewrite(offset)
+            self._install(index, snap)
+            self._replay_journal(0)
+            if self._journal_records:
+                print(f"📁 Replayed {self._journal_records} journal record(s) written during the rebuild")
+        return index
+
+
+def _build_centroid_index(centroids, index_type=None):
+    """First-stage index over normalized per-person centroids (row i = person i)."""
+    return build_index(normalize(centroids), index_type)
+
+
+def gallery_arrays(gallery, n=GALLERY_EXEMPLARS):
+    """Snapshot arrays of a GalleryState: up to n exemplars per person plus the centroid table."""
+    vectors, labels = gallery.compacted(n)
+    persons, centroids, counts = gallery.all_persons()
+    return {'vectors': vectors, 'labels': labels, 'persons': persons, 'centroids': centroids, 'counts': counts}
+
+
+_index_cache = IndexCache()
+
+def add_embedding(img, person_id):
+    """
+    Compute the embedding for `img` (file path, encoded bytes or BGR array)
+    and append it to the index under person_id. Works fully in memory.
+    """
     try:
-        labels = np.array(labels, dtype=np.int64)
-    except Exception:
-        pass
-    np.save(LABELS_PATH, labels)
+        faces = extract_embeddings(img)
+    except Exception as e:
+        print(f"⚠️ Embedding extraction error during add_embedding: {e}")
+        return False
+
+    if not faces:
+        print("Warning: no face found in image")
+        return False
+
+    # Add new data to the cached index (persisted to disk by the cache)
+    _index_cache.add(faces[0]['embedding'][np.newaxis, :], [person_id])
 
     print(f"Added embedding for person {person_id}")
     return True
 
 
+def add_embeddings(vectors, person_ids):
+    """Append precomputed embeddings (row i belongs to person_ids[i]) in one journal append."""
+    person_ids = [int(p) for p in person_ids]
+    if not person_ids:
+        return
+    _index_cache.add(np.asarray(vectors, dtype='float32').reshape(len(person_ids), -1), person_ids)
+    print(f"Added {len(person_ids)} embedding(s) for {len(set(person_ids))} person(s)")
+
+
+def gallery_stamp():
+    """Changes whenever the gallery on disk changes (register, delete, rebuild), in any worker."""
+    return _index_cache.stamp()
+
+
 def load_index():
-    if os.path.exists(INDEX_PATH) and os.path.exists(LABELS_PATH):
-        index = faiss.read_index(INDEX_PATH)
-        labels = np.load(LABELS_PATH)
-        return index, labels
-    return None, None
+    """Return the cached (index, labels); reloads from disk only if the files changed."""
+    return _index_cache.get()
+
+
+def remove_person(person_id):
+    """Remove a person from the gallery; their rows stop matching immediately."""
+    _index_cache.remove([person_id])
+
 
+def replace_embedding(img, person_id):
+    """Replace all of a person's samples with the embedding of `img` (new photo)."""
+    try:
+        faces = extract_embeddings(img)
+    except Exception as e:
+        print(f"⚠️ Embedding extraction error during replace_embedding: {e}")
+        return False
+    if not faces:
+        print("Warning: no face found in image")
+        return False
+    _index_cache.add(faces[0]['embedding'][np.newaxis, :], [person_id], deleted=[person_id])
+    print(f"Replaced embeddings for person {person_id}")
+    return True
+
+
+def load_vectors():
+    """Return (exact vectors, labels) of the gallery, e.g. for reports; (None, None) if empty."""
+    return _index_cache.get_vectors()
+
+
+def index_info():
+    """Summary of the served gallery (entries, journal backlog, mmap, index params) or None."""
+    return _index_cache.info()
+
+
+def search_index(queries, k=1, rerank_persons=GALLERY_RERANK_PERSONS):
+    """
+    Search the gallery (centroids, then exemplar rerank of the best
+    `rerank_persons`; see gallery.py). Returns (S, I, labels) or None if no
+    index exists: S holds cosine similarities (see scoring.py), I indices
+    into labels, one hit per person.
+    """
+    return _index_cache.search(queries, k, rerank_persons)
+
+
+def _rebuild_worker_init():
+    """Pool initializer: build the model once per worker process."""
+    from face_pipeline import get_model, use_local_worker
+    use_local_worker()
+    get_model()
+
+
+NO_FACE = "no face found"
 
-def rebuild_index_from_dataset(dataset_dir=None):
+
+def _embed_dataset_file(fpath):
+    """Rebuild task: return (embedding or None, error message or None) for one file."""
+    try:
+        faces = extract_embeddings(fpath)
+    except Exception as e:
+        return None, str(e)
+    if not faces:
+        return None, NO_FACE
+    return faces[0]['embedding'], None
+
+
+def _iter_dataset_embeddings(files, workers, cancel_event=None):
+    """
+    Yield (fpath, embedding, error) for each file as results finish.
+    With workers > 1 the files are fanned out to a process pool; at most a few
+    tasks per worker are in flight so cancellation takes effect quickly.
+    """
+    cancelled = lambda: cancel_event is not None and cancel_event.is_set()
+
+    if workers <= 1:
+        for fpath in files:
+            if cancelled():
+                return
+            yield (fpath,) + _embed_dataset_file(fpath)
+        return
+
+    # spawn: TensorFlow state in this process must not be forked into workers
+    ctx = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_rebuild_worker_init)
+    try:
+        pending = {}
+        file_iter = iter(files)
+        while True:
+            while len(pending) < workers * 4 and not cancelled():
+                fpath = next(file_iter, None)
+                if fpath is None:
+                    break
+                pending[pool.submit(_embed_dataset_file, fpath)] = fpath
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                fpath = pending.pop(future)
+                try:
+                    embedding, error = future.result()
+                except Exception as e:
+                    embedding, error = None, str(e)
+                yield fpath, embedding, error
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def rebuild_index_from_dataset(dataset_dir=None, workers=REBUILD_WORKERS, progress=None, cancel_event=None,
+                               use_cache=True):
     """
     Rebuild FAISS index from all images in dataset_dir.
     Filenames must start with '<person_id>_' so we can extract labels.
     This rebuild will overwrite existing index and labels file.
+    Images are embedded by `workers` processes and folded into per-person
+    running sums (centroids) and bounded exemplar pools as they finish; each
+    person ends up with a centroid and up to GALLERY_EXEMPLARS exemplars. `progress(processed, total, failed)` is
+    called after each image; setting `cancel_event` stops the rebuild and
+    leaves the current index untouched. Registrations, deletes and photo
+    replacements made while the rebuild runs are kept (replayed on top).
+    With use_cache, embeddings of unchanged images (same content hash, model
+    and detector) are taken from the embedding cache instead of recomputed.
     """
     dataset_dir = dataset_dir or os.path.join(os.path.dirname(INDEX_PATH), '..', 'dataset')
     dataset_dir = os.path.abspath(dataset_dir)
-    print(f"Rebuilding FAISS index from dataset: {dataset_dir}")
-
+    print(f"Rebuilding FAISS index from dataset: {dataset_dir} ({workers} worker(s))")
+
+    # Compaction pauses while the rebuild runs; journal records written from
+    # here on (registrations during the rebuild) are replayed on top of the
+    # rebuilt gallery instead of being dropped
+    with _index_cache.rebuilding():
+        position = _index_cache.journal_position()
+        files, labels_by_file = _list_dataset(dataset_dir)
+        if not files:
+            print("No dataset files found to rebuild index")
+            return 0
+        return _rebuild_from_files(files, labels_by_file, position, workers, progress, cancel_event, use_cache)
+
+
+def _list_dataset(dataset_dir):
+    """([image paths], {path: person id}) of the dataset images named '<person_id>_...'."""
     files = []
+    labels_by_file = {}
     try:
         for fname in os.listdir(dataset_dir):
             if fname.lower().endswith(('.jpg', '.jpeg', '.png')) and '_' in fname:
-                files.append(os.path.join(dataset_dir, fname))
+                try:
+                    person_id = int(fname.split('_', 1)[0])
+                except ValueError:
+                    print(f"Skipping file with invalid prefix (no person id): {fname}")
+                    continue
+                fpath = os.path.join(dataset_dir, fname)
+                files.append(fpath)
+                labels_by_file[fpath] = person_id
     except Exception as e:
         print(f"Failed to list dataset dir: {e}")
-        return 0
-
-    if not files:
-        print("No dataset files found to rebuild index")
-        return 0
-
-    embeddings_list = []
-    labels_list = []
-
-    for fpath in files:
-        try:
-            fname = os.path.basename(fpath)
-            pid_str = fname.split('_', 1)[0]
-            person_id = int(pid_str)
-        except Exception:
-            print(f"Skipping file with invalid prefix (no person id): {fname}")
-            continue
-
-        # Try to compute embedding similarly to add_embedding (crop if possible)
-        try:
-            reps = DeepFace.represent(
-                img_path=fpath,
-                model_name=FACE_MODEL,
-                detector_backend=FACE_DETECTOR,
-                enforce_detection=False
-            )
-            if not reps:
-                print(f"No face found in {fname}, skipping")
+    return files, labels_by_file
+
+
+def _rebuild_from_files(files, labels_by_file, position, workers, progress, cancel_event, use_cache):
+    """Embed `files` and replace the gallery, covering the journal up to `position`."""
+    # Running per-person sums and exemplar pools: embeddings are streamed in,
+    # never all held at once (a pool is thinned to the most diverse
+    # GALLERY_EXEMPLARS whenever it reaches four times that)
+    person_sums = {}
+    person_counts = {}
+    person_pools = {}
+    produced = 0
+    processed = 0
+    failed = 0
+
+    cache = EmbeddingCache() if use_cache else None
+    hashes = {}
+    touched = time.monotonic()
+
+    def cached_results():
+        """Yield cached results and collect the files that still need embedding."""
+        for fpath in files:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            try:
+                sha = cache.file_hash(fpath)
+            except OSError as e:
+                yield fpath, None, str(e)
                 continue
+            found, embedding, error = cache.get(sha)
+            if found:
+                yield fpath, embedding, error
+            else:
+                hashes[fpath] = sha
+
+    def results():
+        if cache is None:
+            yield from _iter_dataset_embeddings(files, workers, cancel_event)
+            return
+        yield from cached_results()
+        print(f"Embedding cache: {cache.hits} hit(s), {len(hashes)} image(s) to embed")
+        for n, (fpath, embedding, error) in enumerate(_iter_dataset_embeddings(list(hashes), workers, cancel_event), 1):
+            # Only cache real outcomes, not transient failures
+            if embedding is not None or error == NO_FACE:
+                cache.put(hashes[fpath], embedding, error)
+                if n % 100 == 0:
+                    cache.commit()
+            yield fpath, embedding, error
 
-            # If facial_area present, crop then represent on crop
-            facial_area = reps[0].get('facial_area') if isinstance(reps[0], dict) else None
-            embedding = None
-            if facial_area:
-                try:
-                    from PIL import Image
-                    orig = Image.open(fpath).convert('RGB')
-                    if isinstance(facial_area, (list, tuple)) and len(facial_area) == 4:
-                        x, y, w, h = facial_area
-                    elif isinstance(facial_area, dict) and {'x','y','w','h'}.issubset(facial_area.keys()):
-                        x = facial_area['x']; y = facial_area['y']; w = facial_area['w']; h = facial_area['h']
-                    else:
-                        x = y = w = h = None
-
-                    if x is not None:
-                        left = int(max(0, x))
-                        top = int(max(0, y))
-                        right = int(min(orig.width, x + w))
-                        bottom = int(min(orig.height, y + h))
-                        pad_w = int((right - left) * 0.15)
-                        pad_h = int((bottom - top) * 0.15)
-                        left = max(0, left - pad_w)
-                        top = max(0, top - pad_h)
-                        right = min(orig.width, right + pad_w)
-                        bottom = min(orig.height, bottom + pad_h)
-
-                        crop = orig.crop((left, top, right, bottom))
-                        import uuid
-                        tmp_crop = os.path.join(os.path.dirname(fpath), f"tmp_rebuild_{uuid.uuid4().hex}.jpg")
-                        crop.save(tmp_crop)
-                        reps_crop = DeepFace.represent(
-                            img_path=tmp_crop,
-                            model_name=FACE_MODEL,
-                            detector_backend=FACE_DETECTOR,
-                            enforce_detection=False
-                        )
-                        if reps_crop and isinstance(reps_crop, list) and 'embedding' in reps_crop[0]:
-                            embedding = np.array([reps_crop[0]['embedding']]).astype('float32')
-                        try:
-                            if os.path.exists(tmp_crop): os.remove(tmp_crop)
-                        except Exception:
-                            pass
-                except Exception as e:
-                    print(f"Failed to crop {fname}: {e}")
-
+    try:
+        for fpath, embedding, error in results():
+            processed += 1
+            fname = os.path.basename(fpath)
             if embedding is None:
-                try:
-                    embedding = np.array([reps[0]['embedding']]).astype('float32')
-                except Exception:
-                    print(f"No embedding for {fname}, skipping")
-                    continue
-
-            # Normalize
-            try:
-                e_norm = np.linalg.norm(embedding, axis=1, keepdims=True)
-                e_norm[e_norm == 0] = 1.0
-                embedding = embedding / e_norm
-            except Exception:
-                pass
-
-            embeddings_list.append(embedding[0])
-            labels_list.append(person_id)
-            print(f"Added embedding from {fname} (person {person_id})")
-        except Exception as e:
-            print(f"❌ Error processing {fpath}: {e}")
-            continue
+                failed += 1
+                print(f"❌ Skipping {fname}: {error}")
+            else:
+                person_id = labels_by_file[fpath]
+                if person_id in person_sums:
+                    person_sums[person_id] += embedding
+                    person_counts[person_id] += 1
+                else:
+                    person_sums[person_id] = np.array(embedding, dtype='float64')
+                    person_counts[person_id] = 1
+                pool = person_pools.setdefault(person_id, [])
+                pool.append(np.asarray(embedding, dtype='float32'))
+                if len(pool) >= 4 * GALLERY_EXEMPLARS:
+                    pool_arr = np.vstack(pool)
+                    person_pools[person_id] = list(pool_arr[select_exemplars(pool_arr)])
+                produced += 1
+                print(f"Added embedding from {fname} (person {person_id})")
+            if progress is not None:
+                progress(processed, len(files), failed)
+            if time.monotonic() - touched > 10:
+                _index_cache.touch_rebuild()
+                touched = time.monotonic()
+    finally:
+        if cache is not None:
+            cache.prune(live_paths=files)
+            cache.close()
+
+    if cancel_event is not None and cancel_event.is_set():
+        print(f"Rebuild cancelled after {processed}/{len(files)} images; index left unchanged")
+        return 0
 
-    if not embeddings_list:
+    if not person_sums:
         print("No embeddings were produced from dataset")
         return 0
 
-    # Convert to arrays
-    all_embeddings = np.vstack(embeddings_list).astype('float32')
-    labels_arr = np.array(labels_list, dtype=np.int64)
-
-    # Collapse multiple embeddings per person into a single centroid to avoid
-    # duplicate/identical vectors causing ambiguous matches. This also reduces
-    # the index size and gives more stable per-person representatives.
-    person_map = {}
-    for emb, pid in zip(all_embeddings, labels_arr):
-        if pid not in person_map:
-            person_map[pid] = [emb]
-        else:
-            person_map[pid].append(emb)
-
-    final_embeddings = []
-    final_labels = []
+    # One centroid per person for the first-stage index, plus the person's
+    # most diverse exemplars for reranking. Persons whose centroid is
+    # (near-)identical to another's are skipped to avoid ambiguous matches.
+    persons, centroids, counts = [], [], []
+    exemplar_vectors, exemplar_labels = [], []
     seen_keys = set()
-    for pid, emb_list in person_map.items():
-        try:
-            centroid = np.mean(np.vstack(emb_list), axis=0)
-        except Exception:
-            centroid = emb_list[0]
-
-        # Normalize centroid
-        try:
-            cnorm = np.linalg.norm(centroid)
-            if cnorm == 0: cnorm = 1.0
-            centroid = (centroid / cnorm).astype('float32')
-        except Exception:
-            centroid = centroid.astype('float32')
+    for pid, emb_sum in person_sums.items():
+        centroid = emb_sum / person_counts[pid]
 
         # Create a stable key by rounding to 6 decimals to catch near-identical vectors
-        key = tuple(np.round(centroid, 6).tolist())
+        key = tuple(np.round(normalize(centroid), 6).tolist())
         if key in seen_keys:
             print(f"Skipping duplicate centroid for person {pid}")
             continue
         seen_keys.add(key)
-        final_embeddings.append(centroid)
-        final_labels.append(pid)
-
-    if not final_embeddings:
+        persons.append(pid)
+        centroids.append(centroid.astype('float32'))
+        counts.append(person_counts[pid])
+        pool = np.vstack(person_pools[pid])
+        keep = pool[select_exemplars(pool)]
+        exemplar_vectors.append(keep)
+        exemplar_labels.append(np.full(len(keep), pid, dtype=np.int64))
+
+    if not persons:
         print("No final embeddings after deduplication")
         return 0
 
-    final_embeddings_arr = np.vstack(final_embeddings).astype('float32')
-    final_labels_arr = np.array(final_labels, dtype=np.int64)
-
-    # Build FAISS index
-    dim = final_embeddings_arr.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(final_embeddings_arr)
-    faiss.write_index(index, INDEX_PATH)
-    np.save(LABELS_PATH, final_labels_arr)
-
-    print(f"Rebuilt index with {len(final_labels_arr)} entries (collapsed from {len(labels_arr)})")
-    return len(final_labels_arr)
+    arrays = {
+        'vectors': np.vstack(exemplar_vectors).astype('float32'),
+        'labels': np.concatenate(exemplar_labels),
+        'persons': np.array(persons, dtype=np.int64),
+        'centroids': np.vstack(centroids),
+        'counts': np.array(counts, dtype=np.int64),
+    }
+    # Centroid index type chosen by INDEX_TYPE / number of persons
+    index = _index_cache.replace(arrays, position)
+
+    print(f"Rebuilt {index_type_of(index)} index with {len(persons)} persons and "
+          f"{len(arrays['labels'])} exemplars (from {produced} embeddings)")
+    return len(persons)
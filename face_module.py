@@ -4,84 +4,176 @@ Export functions để Golang có thể gọi trực tiếp
 """
 
 import os
+import shutil
 import uuid
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
-import tensorflow as tf
-tf.get_logger().setLevel("ERROR")
+
+import cv2
+import numpy as np
 
 # Import các module cần thiết
 from database import SessionLocal
 from models import Person
-from embeddings import add_embedding
-from recognition import recognize_face
+from embeddings import add_embeddings
+from face_pipeline import find_faces, embed_many
+from imaging import load_image, image_extension
+from recognition import recognize_batch
+from person_directory import directory
+import face_service
 
 UPLOAD_FOLDER = "dataset"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-def register_face(name: str, image_path: str) -> dict:
+# Images may be given as a file path, raw encoded bytes (JPEG/PNG) or a
+# decoded BGR uint8 array; nothing is copied or written to disk except the
+# photo kept in the dataset when a face is registered.
+
+_STATUS_MESSAGES = {
+    "NoFace": "No face detected",
+    "NoIndex": "Index or labels missing",
+    "Invalid": "Invalid image",
+}
+
+
+def _save_photo(person_id, image):
+    """Keep the registered photo in the dataset (needed by rebuilds); returns the file name."""
+    if isinstance(image, np.ndarray):
+        ok, encoded = cv2.imencode('.jpg', image)
+        if not ok:
+            raise ValueError("Cannot encode image")
+        data, ext = encoded.tobytes(), '.jpg'
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        data = bytes(image)
+        ext = image_extension(data)
+    else:
+        data, ext = None, os.path.splitext(str(image))[1].lower() or '.jpg'
+    filename = f"{person_id}_{uuid.uuid4().hex}{ext}"
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    if data is None:
+        shutil.copy2(str(image), filepath)
+    else:
+        with open(filepath, 'wb') as f:
+            f.write(data)
+    return filename
+
+
+def register_faces(items) -> dict:
     """
-    Register a new face
+    Register several faces at once
     Args:
-        name: Person name
-        image_path: Path to image file
+        items: list of (name, image) pairs or {"name", "image"} dicts
     Returns:
-        dict: Registration result
+        dict: {"status": "success", "results": [one register_face result per item]}
+    All faces are embedded in one model batch and added to the index in one append.
     """
-    if not name or not image_path:
-        return {"status": "error", "message": "Name and image path required"}
-
-    if not os.path.exists(image_path):
-        return {"status": "error", "message": "Image file not found"}
-
+    items = [(it.get("name"), it.get("image")) if isinstance(it, dict) else tuple(it) for it in items]
+    results = [None] * len(items)
+    decoded = []
+    for n, (name, image) in enumerate(items):
+        if not name or image is None or (isinstance(image, (str, bytes)) and not len(image)):
+            results[n] = {"status": "error", "message": "Name and image required"}
+        elif isinstance(image, str) and not os.path.exists(image):
+            results[n] = {"status": "error", "message": "Image file not found"}
+        else:
+            try:
+                decoded.append((n, load_image(image)))
+            except ValueError:
+                results[n] = {"status": "error", "message": "Invalid image"}
+
+    faces = embed_many([(img, find_faces(img, max_faces=1)) for _, img in decoded]) if decoded else []
     session = SessionLocal()
-
     try:
-        person = session.query(Person).filter_by(name=name).first()
-        if not person:
-            person = Person(name=name)
-            session.add(person)
-            session.commit()
+        persons = {}
+        vectors, person_ids, samples = [], [], []
+        for (n, _), found in zip(decoded, faces):
+            if not found:
+                results[n] = {"status": "error", "message": "Failed to add embedding"}
+                continue
+            name, image = items[n]
+            person = persons.get(name) or session.query(Person).filter_by(name=name).first()
+            if not person:
+                person = Person(name=name)
+                session.add(person)
+                session.commit()
+            persons[name] = person
+            filename = _save_photo(person.id, image)
+            vectors.append(found[0]['embedding'])
+            person_ids.append(person.id)
+            samples.append((n, person.id, person.name, filename))
+
+        add_embeddings(np.vstack(vectors) if vectors else None, person_ids)
+        for n, person_id, name, filename in samples:
+            directory.add_sample(person_id, name, filename)
+            results[n] = {
+                "status": "success",
+                "message": "Face registered successfully",
+                "person_id": person_id,
+                "name": name
+            }
+    finally:
+        session.close()
+    return {"status": "success", "results": results}
 
-        filename = f"{person.id}_{uuid.uuid4().hex}.jpg"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
 
-        # Copy file to dataset
-        import shutil
-        shutil.copy2(image_path, filepath)
+def register_face(name: str, image) -> dict:
+    """
+    Register a new face
+    Args:
+        name: Person name
+        image: Image file path, encoded bytes or BGR array
+    Returns:
+        dict: Registration result
+    """
+    return register_faces([(name, image)])["results"][0]
 
-        if not add_embedding(filepath, person.id):
-            return {"status": "error", "message": "Failed to add embedding"}
 
-        return {
+def recognize_faces(images, k: int = 1, fast: bool = False) -> dict:
+    """
+    Recognize every face in several images at once
+    Args:
+        images: list of image file paths, encoded bytes or BGR arrays
+        k: matches per face
+        fast: fast recognition mode (see recognition.recognize_faces)
+    Returns:
+        dict: {"status": "success", "results": [per image: status, name and
+        distance of the largest face, and every face with its matches]}
+    One embedding batch, one index search and one name lookup for the whole list.
+    """
+    results = []
+    for status, faces in recognize_batch(list(images), k=max(1, int(k)), fast=fast):
+        if status != "OK":
+            results.append({"status": "error", "message": _STATUS_MESSAGES.get(status, status), "faces": []})
+            continue
+        best = faces[0]
+        results.append({
             "status": "success",
-            "message": "Face registered successfully",
-            "person_id": person.id,
-            "name": person.name
-        }
-    finally:
-        session.close()
+            "name": best["name"],
+            "distance": best["distance"],
+            "faces": faces
+        })
+    return {"status": "success", "results": results}
+
 
-def recognize_face_func(image_path: str) -> dict:
+def recognize_face_func(image) -> dict:
     """
     Recognize face from image
     Args:
-        image_path: Path to image file
+        image: Image file path, encoded bytes or BGR array
     Returns:
         dict: Recognition result
     """
-    if not image_path or not os.path.exists(image_path):
+    if image is None or (isinstance(image, str) and not os.path.exists(image)):
         return {"status": "error", "message": "Image path required"}
 
-    filename = f"temp_{uuid.uuid4().hex}.jpg"
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-
     try:
-        # Copy file to dataset
-        import shutil
-        shutil.copy2(image_path, filepath)
-
-        name, distance = recognize_face(filepath)
+        status, faces = recognize_batch([image], max_faces=1)[0]
+        if status == "Invalid":
+            return {"status": "error", "message": "Invalid image"}
+        if status == "OK":
+            name, distance = faces[0]["name"], faces[0]["distance"]
+        else:
+            name, distance = status, None
 
         return {
             "status": "success",
@@ -98,19 +190,14 @@ def get_all_persons() -> dict:
     Returns:
         dict: List of all persons
     """
-    session = SessionLocal()
-
-    try:
-        persons = session.query(Person).all()
-        result = []
-        for person in persons:
-            result.append({
-                "id": person.id,
-                "name": person.name
-            })
-        return {"status": "success", "persons": result}
-    finally:
-        session.close()
+    result = []
+    for person in directory.all():
+        result.append({
+            "id": person["id"],
+            "name": person["name"],
+            "samples": person["samples"]
+        })
+    return {"status": "success", "persons": result}
 
 def delete_person(person_id: int) -> dict:
     """
@@ -120,16 +207,6 @@ def delete_person(person_id: int) -> dict:
     Returns:
         dict: Deletion result
     """
-    session = SessionLocal()
-
-    try:
-        person = session.query(Person).filter_by(id=person_id).first()
-        if not person:
-            return {"status": "error", "message": "Person not found"}
-
-        session.delete(person)
-        session.commit()
-
-        return {"status": "success", "message": "Person deleted successfully"}
-    finally:
-        session.close()
+    # Also removes the person's vectors from the index and their dataset photos
+    body, _ = face_service.delete_person(person_id)
+    return body
@@ -0,0 +1,305 @@
+"""
+Embedding extraction stage shared by registration, recognition, compare and
+rebuild. Each image goes through:
+  1. one detector pass (FACE_DETECTOR; RECOGNITION_DETECTOR for recognition,
+     see detectors.py) to find face boxes and eye landmarks,
+  2. an in-memory crop (with FACE_CROP_PADDING) and optional eye alignment,
+  3. exactly one recognition model pass (FACE_MODEL) per face crop.
+All model work runs on the shared InferenceWorker thread, which batches face
+crops from concurrent requests into one forward pass. With INFERENCE_ADDRESS
+set, that worker lives in the central inference process instead and this
+process never loads the model.
+DeepFace (and with it TensorFlow) is imported on the first model call, not
+at import, so processes that never run the model start quickly.
+"""
+
+import os
+import numpy as np
+import cv2
+from config import FACE_MODEL, FACE_DETECTOR, FACE_CROP_PADDING, FACE_ALIGN, INFERENCE_ADDRESS, \
+    CASCADE_HEAVY_DETECTOR, CASCADE_SCREEN_WIDTH
+import detectors
+from imaging import load_image, crop_face, parse_facial_area
+from inference import InferenceWorker, RemoteInferenceWorker
+from metrics import stage
+
+
+_deepface = None
+
+
+def deepface():
+    """The DeepFace module, imported (with quiet TensorFlow logging) on first use."""
+    global _deepface
+    if _deepface is None:
+        os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+        from deepface import DeepFace
+        try:
+            import tensorflow as tf
+            tf.get_logger().setLevel("ERROR")
+        except Exception:
+            pass
+        _deepface = DeepFace
+    return _deepface
+
+
+def pipeline_fingerprint():
+    """Identify the settings that determine an embedding (used to invalidate caches)."""
+    return f"{FACE_MODEL}|{FACE_DETECTOR}|pad={FACE_CROP_PADDING}|align={int(FACE_ALIGN)}"
+
+
+def l2_normalize(embeddings):
+    """Normalize rows to unit length (recommended for ArcFace / cosine similarity)."""
+    embeddings = np.asarray(embeddings, dtype='float32')
+    if embeddings.ndim == 1:
+        embeddings = embeddings[np.newaxis, :]
+    norm = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norm[norm == 0] = 1.0
+    return (embeddings / norm).astype('float32')
+
+
+def detect_faces(img, detector_backend=FACE_DETECTOR, detect_size=None):
+    """
+    Run the face detector once on `img` (BGR array).
+    If detect_size=(w, h) is given, detection runs on a downscaled copy and the
+    boxes/eyes are mapped back to `img` coordinates.
+    Returns a list of dicts {box: (x, y, w, h), left_eye, right_eye, confidence},
+    largest face first. Empty list if no face was found.
+    """
+    detect_img = img
+    sx = sy = 1.0
+    if detect_size:
+        img_h, img_w = img.shape[:2]
+        small_w, small_h = int(detect_size[0]), int(detect_size[1])
+        if small_w < img_w or small_h < img_h:
+            detect_img = cv2.resize(img, (small_w, small_h), interpolation=cv2.INTER_AREA)
+            sx, sy = img_w / float(small_w), img_h / float(small_h)
+
+    if detectors.is_local(detector_backend):
+        detections = [dict(d, box=(int(d['box'][0] * sx), int(d['box'][1] * sy),
+                                   int(d['box'][2] * sx), int(d['box'][3] * sy)),
+                           left_eye=_scale_point(d['left_eye'], sx, sy),
+                           right_eye=_scale_point(d['right_eye'], sx, sy))
+                      for d in detectors.detect(detector_backend, detect_img)]
+    else:
+        detections = _deepface_detections(detect_img, detector_backend, sx, sy)
+
+    detections.sort(key=lambda d: d['box'][2] * d['box'][3], reverse=True)
+    return detections
+
+
+def _deepface_detections(detect_img, detector_backend, sx, sy):
+    """DeepFace detector pass; boxes/eyes scaled by (sx, sy)."""
+    # align=False keeps facial_area in source coordinates; alignment is done on our own crop
+    faces = deepface().extract_faces(
+        img_path=detect_img,
+        detector_backend=detector_backend,
+        enforce_detection=False,
+        align=False
+    )
+
+    detections = []
+    for face in faces or []:
+        area = face.get('facial_area') if isinstance(face, dict) else None
+        box = parse_facial_area(area)
+        if box is None:
+            continue
+        confidence = float(face.get('confidence') or 0.0)
+        # With enforce_detection=False DeepFace returns the whole frame with
+        # confidence 0 when nothing was found; that is not a face.
+        if confidence <= 0 and detector_backend != 'skip':
+            continue
+        x, y, w, h = box
+        landmarks = area if isinstance(area, dict) else {}
+        detections.append({
+            'box': (int(x * sx), int(y * sy), int(w * sx), int(h * sy)),
+            'left_eye': _scale_point(landmarks.get('left_eye'), sx, sy),
+            'right_eye': _scale_point(landmarks.get('right_eye'), sx, sy),
+            'confidence': confidence,
+        })
+    return detections
+
+
+def detect_size_for(img, width):
+    """(w, h) of `img` scaled down to `width` px wide (aspect kept), or None if it is not wider."""
+    img_h, img_w = img.shape[:2]
+    if not width or img_w <= width:
+        return None
+    return int(width), max(1, int(round(img_h * width / float(img_w))))
+
+
+def _scale_point(point, sx, sy):
+    if point is None:
+        return None
+    try:
+        return float(point[0]) * sx, float(point[1]) * sy
+    except (TypeError, IndexError):
+        return None
+
+
+def align_face(img, detection, padding=FACE_CROP_PADDING, align=FACE_ALIGN):
+    """
+    Crop a detected face from `img` with `padding` and, if eye landmarks are
+    available and align=True, rotate the crop so the eyes are horizontal.
+    Returns the BGR crop or None.
+    """
+    box = detection['box']
+    crop = crop_face(img, box, padding=padding)
+    if crop is None or not align:
+        return crop
+
+    left_eye, right_eye = detection.get('left_eye'), detection.get('right_eye')
+    if left_eye is None or right_eye is None:
+        return crop
+
+    # Same convention as DeepFace: left_eye is the person's left eye (image right)
+    angle = float(np.degrees(np.arctan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0])))
+    if abs(angle) < 1.0:
+        return crop
+
+    # Eye midpoint in crop coordinates (crop origin = padded box top-left)
+    x, y, w, h = box
+    left = max(0, x - int(w * padding))
+    top = max(0, y - int(h * padding))
+    center = ((left_eye[0] + right_eye[0]) / 2.0 - left, (left_eye[1] + right_eye[1]) / 2.0 - top)
+    matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+    crop_h, crop_w = crop.shape[:2]
+    return cv2.warpAffine(crop, matrix, (crop_w, crop_h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def get_model():
+    """Return the recognition model (DeepFace caches it after the first build)."""
+    return deepface().build_model(FACE_MODEL)
+
+
+def _preprocess_crop(crop, target_size):
+    """BGR crop -> (1, h, w, 3) float input, exactly as DeepFace.represent prepares it."""
+    from deepface.modules import preprocessing
+    rgb = crop[:, :, ::-1]
+    return preprocessing.resize_image(img=rgb, target_size=(target_size[1], target_size[0]))
+
+
+def _embed_batch(crops):
+    """One batched forward pass of the recognition model over all crops."""
+    model = get_model()
+    batch = np.concatenate([_preprocess_crop(crop, model.input_shape) for crop in crops], axis=0)
+    vectors = model.model(batch, training=False)
+    return l2_normalize(np.asarray(vectors))
+
+
+_local_worker = InferenceWorker(_embed_batch)
+_worker = RemoteInferenceWorker(INFERENCE_ADDRESS) if INFERENCE_ADDRESS else _local_worker
+
+
+def get_worker():
+    return _worker
+
+
+def get_local_worker():
+    """The in-process worker (what the inference server runs), whatever INFERENCE_ADDRESS says."""
+    return _local_worker
+
+
+def use_local_worker():
+    """Run model work in this process from now on (e.g. rebuild pool processes)."""
+    global _worker
+    _worker = _local_worker
+
+
+def warm_up():
+    """Build the model on the worker; returns the embedding input shape."""
+    return tuple(get_model().input_shape)
+
+
+def embed_faces(crops):
+    """
+    Run the recognition model once per face crop (no detection). Crops are
+    batched on the inference worker together with other requests' crops.
+    Returns an (n, d) array of unit-length float32 embeddings.
+    """
+    if not crops:
+        return np.zeros((0, 0), dtype='float32')
+    return _worker.embed(crops)
+
+
+def detect_crops(crops, detector_backend=CASCADE_HEAVY_DETECTOR):
+    """detect_faces on each crop (cascade confirmation); one detection list per crop."""
+    return [detect_faces(crop, detector_backend=detector_backend) for crop in crops]
+
+
+def _cascade_faces(img, detect_size=None):
+    """Cascade detection (detectors.cascade): first stage here, heavy detector on the worker."""
+    screen_width = min(CASCADE_SCREEN_WIDTH, int(detect_size[0])) if detect_size else CASCADE_SCREEN_WIDTH
+    found = detectors.cascade(img, lambda crops: _worker.call(detect_crops, crops), screen_width=screen_width)
+    if found is None:
+        return _worker.call(detect_faces, img, detector_backend=CASCADE_HEAVY_DETECTOR, detect_size=detect_size)
+    return found
+
+
+def find_faces(img, max_faces=1, detector_backend=FACE_DETECTOR, detect_size=None):
+    """
+    Stage 1 only: run the detector. `img` is a BGR array. DeepFace backends
+    run on the inference worker; OpenCV detectors and the first stage of
+    "cascade" run in the calling thread (see detectors.py). Returns up to
+    max_faces detections (see detect_faces), largest first.
+    """
+    with stage('detect'):
+        if detector_backend == 'cascade':
+            detections = _cascade_faces(img, detect_size)
+        elif detectors.is_local(detector_backend):
+            detections = detect_faces(img, detector_backend=detector_backend, detect_size=detect_size)
+        else:
+            detections = _worker.call(detect_faces, img, detector_backend=detector_backend,
+                                      detect_size=detect_size)
+    return detections[:max_faces] if max_faces else detections
+
+
+def embed_detections(img, detections, padding=FACE_CROP_PADDING, align=FACE_ALIGN):
+    """
+    Stages 2-3 for detections from find_faces: crop/align each face and embed
+    all crops in one batch. Returns a list of dicts {embedding, facial_area,
+    confidence, detection}; faces whose crop is empty are skipped.
+    """
+    return embed_many([(img, detections)], padding=padding, align=align)[0]
+
+
+def embed_many(items, padding=FACE_CROP_PADDING, align=FACE_ALIGN):
+    """
+    embed_detections for several images at once: the crops of every
+    (img, detections) pair go to the model in one batch. Returns one list
+    per pair.
+    """
+    owners, faces, crops = [], [], []
+    with stage('align'):
+        for n, (img, detections) in enumerate(items):
+            for det in detections:
+                crop = align_face(img, det, padding=padding, align=align)
+                if crop is None:
+                    continue
+                owners.append(n)
+                faces.append(det)
+                crops.append(crop)
+    results = [[] for _ in items]
+    if not crops:
+        return results
+
+    with stage('embed'):
+        vectors = embed_faces(crops)
+    for n, det, vec in zip(owners, faces, vectors):
+        results[n].append({'embedding': vec, 'facial_area': det['box'], 'confidence': det['confidence'],
+                           'detection': det})
+    return results
+
+
+def extract_embeddings(img, max_faces=1, padding=FACE_CROP_PADDING, align=FACE_ALIGN,
+                       detector_backend=FACE_DETECTOR, detect_size=None):
+    """
+    Detect faces in `img` (path, encoded bytes or BGR array) and embed each one.
+    Detection runs once on the image and the model runs once per face crop.
+    Returns a list of dicts {embedding, facial_area, confidence}, largest face
+    first, with embedding a unit-length float32 vector and facial_area an
+    (x, y, w, h) box in source image coordinates.
+    """
+    with stage('decode'):
+        img = load_image(img)
+    detections = find_faces(img, max_faces=max_faces, detector_backend=detector_backend, detect_size=detect_size)
+    return embed_detections(img, detections, padding=padding, align=align)
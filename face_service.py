@@ -0,0 +1,415 @@
+"""
+Framework-independent handlers for the /api/face/* endpoints.
+Both the Flask app (app_realtime.py) and the ASGI app (app_asgi.py) call
+these with already-read request data; each returns (body, http_status) so
+the two frontends stay behaviourally identical.
+All functions are blocking (model, FAISS, SQLite) and safe to call from
+several threads; model work is serialized by the inference worker.
+"""
+
+import os
+import re
+import uuid
+
+import numpy as np
+
+from config import UPLOAD_FOLDER, SIM_THRESHOLD, REBUILD_WORKERS, RECOGNITION_MODE, CAMERA_MODES
+from database import SessionLocal
+from models import Person
+from embeddings import add_embedding, remove_person, replace_embedding, index_info, search_index
+from face_pipeline import extract_embeddings, get_worker
+from imaging import load_image, image_extension
+import metrics
+from metrics import stage, request_trace
+from person_directory import directory
+from recognition import recognize_faces
+from rebuild import start_rebuild, current_rebuild
+from scoring import is_match, score_fields
+from startup import startup
+from tracking import trackers
+
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+CAMERA_ID_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+def valid_camera_id(camera_id):
+    return bool(camera_id) and bool(CAMERA_ID_RE.match(camera_id))
+
+
+def parse_flag(value):
+    """Query/form flag ("1", "true", "0", ...) -> True/False, or None if absent."""
+    if value is None or value == '':
+        return None
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def recognition_mode(camera_id=None, fast=None):
+    """
+    Recognition mode, "fast" or "accurate": the camera's CAMERA_MODES entry
+    (operator config wins over what the client asks), else the request's
+    fast flag, else RECOGNITION_MODE.
+    """
+    if camera_id and camera_id in CAMERA_MODES:
+        return CAMERA_MODES[camera_id]
+    if fast is not None:
+        return 'fast' if fast else 'accurate'
+    return RECOGNITION_MODE
+
+
+def _index_size():
+    info = index_info()
+    if info is None:
+        return None
+    return {'entries': info['entries'], 'persons': info['persons'], 'journal_entries': info['journal_entries']}
+
+
+metrics.registry.gauge('face_inference_queue_depth', 'Jobs waiting for the inference worker',
+                       lambda: get_worker().queue_depth())
+metrics.registry.gauge('face_index_size', 'Served gallery size', _index_size, label='kind')
+
+
+def _traced(endpoint, fn, *args, **kwargs):
+    """Run an endpoint handler under metrics.request_trace and add its stage timings to the body."""
+    with request_trace(endpoint) as timings:
+        body, status = fn(*args, **kwargs)
+    if timings:
+        body['timings_ms'] = timings
+    return body, status
+
+
+def recognition_payload(faces, host):
+    """Response body for recognized faces (see recognition.recognize_faces)."""
+    with stage('db'):
+        people = directory.resolve(face['person_id'] for face in faces)
+    with stage('response'):
+        return _payload(faces, people, host)
+
+
+def _payload(faces, people, host):
+    for face in faces:
+        entry = people.get(face['person_id'])
+        face['photo'] = f"{host}/dataset/{entry['photo']}" if entry and entry['photo'] else None
+
+    # Top-level fields describe the largest face (single-face clients);
+    # `faces` has every detected face with its box and top-k matches
+    best = faces[0]
+    return {
+        'status': 'success',
+        'person_id': best['person_id'],
+        'name': best['name'],
+        'cosine': best['cosine'],
+        'distance': best['distance'],
+        'l2': best['l2'],
+        'confidence': best['confidence'],
+        'photo': best['photo'],
+        'faces': faces
+    }
+
+
+def register_person(name, img_bytes, host):
+    """Save the upload as {person_id}_{uuid}{ext} in the dataset and add its embedding."""
+    return _traced('register', _register_person, name, img_bytes, host)
+
+
+def _register_person(name, img_bytes, host):
+    try:
+        with stage('decode'):
+            img = load_image(img_bytes)
+    except Exception as e:
+        print("❌ Failed to open uploaded image:", e)
+        return {"status": "error", "message": "Invalid image uploaded"}, 400
+
+    session = SessionLocal()
+    try:
+        # Get or create person so we can name the file with person id
+        person = session.query(Person).filter_by(name=name).first()
+        if not person:
+            person = Person(name=name)
+            session.add(person)
+            session.commit()
+            session.refresh(person)
+
+        # Keep the original upload (no re-encode) with person id prefix for easy lookup
+        filename = f"{person.id}_{uuid.uuid4().hex}{image_extension(img_bytes)}"
+        filepath = os.path.join(UPLOAD_FOLDER, filename)
+        try:
+            with open(filepath, 'wb') as f:
+                f.write(img_bytes)
+        except Exception as e:
+            import traceback
+            print("❌ Failed to save uploaded image:", e)
+            print(traceback.format_exc())
+            return {"status": "error", "message": "Failed to save image"}, 500
+
+        # Add embedding (may raise) and return meaningful errors
+        try:
+            # Model work runs on the inference worker; the index cache serializes the FAISS update
+            success = add_embedding(img, person.id)
+        except Exception as e:
+            import traceback
+            print(f"❌ Error adding embedding for person {person.id}: {e}")
+            print(traceback.format_exc())
+            return {"status": "error", "message": "Failed to add embedding"}, 500
+
+        if not success:
+            return {"status": "error", "message": "Failed to add embedding"}, 500
+
+        directory.add_sample(person.id, person.name, filename)
+        return {
+            "status": "success",
+            "message": "Face registered successfully",
+            "person_id": person.id,
+            "name": person.name,
+            "photo": f"{host}/dataset/{filename}"
+        }, 200
+    finally:
+        session.close()
+
+
+def _remove_photos(person_id, keep=None):
+    """Delete a person's dataset photos (so rebuilds do not bring them back); returns the count."""
+    removed = 0
+    for fname in directory.photo_files(person_id):
+        if fname == keep:
+            continue
+        try:
+            os.remove(os.path.join(UPLOAD_FOLDER, fname))
+            removed += 1
+        except OSError as e:
+            print(f"⚠️ Could not remove {fname}: {e}")
+    return removed
+
+
+def delete_person(person_id):
+    """Delete a person: DB row, gallery samples (tombstoned, no index rebuild) and dataset photos."""
+    session = SessionLocal()
+    try:
+        person = session.query(Person).filter_by(id=person_id).first()
+        if not person:
+            return {"status": "error", "message": "Person not found"}, 404
+        session.delete(person)
+        session.commit()
+    finally:
+        session.close()
+
+    remove_person(person_id)
+    removed = _remove_photos(person_id)
+    directory.remove(person_id)
+    return {"status": "success", "message": "Person deleted successfully", "person_id": person_id,
+            "photos_removed": removed}, 200
+
+
+def replace_photo(person_id, img_bytes, host):
+    """Replace every photo and gallery sample of a person with one new photo."""
+    try:
+        img = load_image(img_bytes)
+    except Exception as e:
+        print("❌ Failed to open uploaded image:", e)
+        return {"status": "error", "message": "Invalid image uploaded"}, 400
+
+    session = SessionLocal()
+    try:
+        person = session.query(Person).filter_by(id=person_id).first()
+        if not person:
+            return {"status": "error", "message": "Person not found"}, 404
+        name = person.name
+    finally:
+        session.close()
+
+    filename = f"{person_id}_{uuid.uuid4().hex}{image_extension(img_bytes)}"
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    try:
+        with open(filepath, 'wb') as f:
+            f.write(img_bytes)
+    except Exception as e:
+        print("❌ Failed to save uploaded image:", e)
+        return {"status": "error", "message": "Failed to save image"}, 500
+
+    try:
+        success = replace_embedding(img, person_id)
+    except Exception as e:
+        print(f"❌ Error replacing embedding for person {person_id}: {e}")
+        success = False
+    if not success:
+        os.remove(filepath)
+        return {"status": "error", "message": "Failed to add embedding"}, 500
+
+    _remove_photos(person_id, keep=filename)
+    directory.remove(person_id)
+    directory.add_sample(person_id, name, filename)
+    return {
+        "status": "success",
+        "message": "Photo replaced successfully",
+        "person_id": person_id,
+        "name": name,
+        "photo": f"{host}/dataset/{filename}"
+    }, 200
+
+
+def recognize_image(img_bytes, host, k=1, camera_id=None, fast=None):
+    """
+    Recognize every face in an uploaded image. With a camera_id, faces
+    tracked from that camera's previous frames reuse their identity instead
+    of being re-embedded. `fast` (or the camera's configured mode, see
+    recognition_mode) selects the fast path of recognition.recognize_faces.
+    The body has the `mode` used and per-stage `timings_ms` (see metrics.py).
+    """
+    return _traced('recognize', _recognize_image, img_bytes, host, k, camera_id, recognition_mode(camera_id, fast))
+
+
+def _recognize_image(img_bytes, host, k, camera_id, mode):
+    try:
+        with stage('decode'):
+            img = load_image(img_bytes)
+    except Exception:
+        return {'status': 'error', 'message': 'Invalid image'}, 400
+
+    tracker = trackers.get(camera_id) if valid_camera_id(camera_id) else None
+    try:
+        status, faces = recognize_faces(img, k=max(1, int(k)), tracker=tracker, fast=mode == 'fast')
+    except Exception as e:
+        print('Recognition embedding error:', e)
+        return {'status': 'error', 'message': 'Failed to compute embedding'}, 500
+
+    if status == 'NoFace':
+        return {'status': 'error', 'message': 'No face detected'}, 200
+    if status == 'NoIndex':
+        return {'status': 'error', 'message': 'Index or labels missing'}, 500
+    return dict(recognition_payload(faces, host), mode=mode), 200
+
+
+def process_stream_frame(frame, context):
+    """Frame handler for streaming.StreamRegistry (runs on the camera's stream thread)."""
+    body, _ = recognize_image(frame, context['host'], k=context.get('k', 1), camera_id=context['camera_id'],
+                              fast=context.get('fast'))
+    return body
+
+
+def compare_image(img_bytes, k=5):
+    """Top-K matches (label, cosine, distance, L2, confidence) for debugging/tuning."""
+    return _traced('compare', _compare_image, img_bytes, k)
+
+
+def _compare_image(img_bytes, k):
+    try:
+        with stage('decode'):
+            img = load_image(img_bytes)
+    except Exception:
+        return {'status': 'error', 'message': 'Invalid image'}, 400
+
+    # Compute embedding with the same extraction stage as registration/recognition
+    try:
+        faces = extract_embeddings(img)
+    except Exception as e:
+        return {'status': 'error', 'message': f'Embedding error: {str(e)}'}, 500
+
+    if not faces:
+        return {'status': 'error', 'message': 'No face detected'}, 200
+
+    qvec = faces[0]['embedding']
+
+    # Use the in-memory index (k is capped to the index size by search_index)
+    with stage('search'):
+        found = search_index(np.array([qvec]), int(k))
+    if found is None:
+        return {'status': 'error', 'message': 'Index or labels missing'}, 500
+    S, I, labels = found
+
+    # Resolve all names at once (at most one DB query)
+    hits = [(float(sim), int(idx)) for sim, idx in zip(S[0], I[0]) if 0 <= int(idx) < len(labels)]
+    with stage('db'):
+        names = directory.names(int(labels[idx]) for _, idx in hits)
+
+    results = []
+    for sim, idx in hits:
+        person_id = int(labels[idx])
+        results.append({
+            'label_index': idx,
+            'person_id': person_id,
+            'name': names.get(person_id),
+            'match': is_match(sim),
+            **score_fields(sim)
+        })
+
+    return {'status': 'success', 'results': results, 'threshold': SIM_THRESHOLD}, 200
+
+
+def list_persons(host):
+    """All registered persons, served from the in-memory person directory (no dataset scan per person)."""
+    result = []
+    for person in directory.all():
+        result.append({
+            "id": person['id'],
+            "name": person['name'],
+            "photo": f"{host}/dataset/{person['photo']}" if person['photo'] else None,
+            "samples": person['samples']
+        })
+    return {"status": "success", "persons": result}, 200
+
+
+def metrics_summary():
+    """JSON view of /metrics: latency percentiles (ms), counters, gauges and cache hit rates."""
+    summary = metrics.registry.summary()
+    hit_rates = {}
+    for entry in summary.get('face_cache_requests_total', []):
+        counts = hit_rates.setdefault(entry['labels']['cache'], {'hit': 0, 'miss': 0})
+        counts[entry['labels']['result']] = entry['value']
+    for counts in hit_rates.values():
+        total = counts['hit'] + counts['miss']
+        counts['hit_rate'] = round(counts['hit'] / total, 4) if total else None
+    return {'status': 'success', 'metrics': summary, 'cache_hit_rates': hit_rates}, 200
+
+
+def debug_info():
+    """System status: index, database and dataset."""
+    # Check FAISS index (snapshot + journal, as served from memory)
+    info = index_info()
+
+    # Check database
+    session = SessionLocal()
+    persons = session.query(Person).all()
+    session.close()
+
+    # Check dataset
+    dataset_files = os.listdir(UPLOAD_FOLDER) if os.path.exists(UPLOAD_FOLDER) else []
+
+    return {
+        "status": "debug",
+        "faiss_index": "exists" if info else "missing",
+        "labels": "exists" if info else "missing",
+        "index_entries": info['entries'] if info else 0,
+        "index_persons": info['persons'] if info else 0,
+        "gallery": info['gallery'] if info else None,
+        "index_params": info['params'] if info else None,
+        "index_journal_entries": info['journal_entries'] if info else 0,
+        "index_mmap": info['mmap'] if info else False,
+        "registered_persons": len(persons),
+        "dataset_files": len(dataset_files),
+        "persons": [{"id": p.id, "name": p.name} for p in persons],
+        "recent_dataset": dataset_files[-5:] if dataset_files else [],
+        "startup": startup.status()
+    }, 200
+
+
+def rebuild(workers=None, use_cache=True, wait=False):
+    """Start (or report) the background rebuild; with wait=True block until it finishes."""
+    job, started = start_rebuild(UPLOAD_FOLDER, workers=workers or REBUILD_WORKERS, use_cache=use_cache)
+    if wait:
+        job.join()
+        return {"status": "success", "message": "Rebuilt index", "entries": job.entries, "job": job.to_dict()}, 200
+    message = "Rebuild started" if started else "Rebuild already running"
+    return {"status": "success", "message": message, "job": job.to_dict()}, 202
+
+
+def rebuild_status():
+    job = current_rebuild()
+    return {"status": "success", "job": job.to_dict() if job is not None else None}, 200
+
+
+def rebuild_cancel():
+    job = current_rebuild()
+    if job is None or not job.is_running():
+        return {"status": "error", "message": "No rebuild running"}, 404
+    job.cancel()
+    return {"status": "success", "message": "Cancelling rebuild", "job": job.to_dict()}, 200
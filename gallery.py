@@ -0,0 +1,174 @@
+"""
+Multi-template gallery model.
+Each person has a centroid (normalized mean of all their embeddings, one
+row in the first-stage FAISS index) and up to GALLERY_EXEMPLARS exemplar
+templates (individual embeddings, chosen for diversity). A query first
+finds the GALLERY_RERANK_PERSONS best persons by centroid, then scores each
+of them against their exemplars:
+  "max"   best exemplar similarity (robust to pose/lighting outliers)
+  "mean"  mean of the GALLERY_TOP_M best exemplar similarities
+Scores are cosine similarities either way (see scoring.py).
+Deleting a person tombstones their snapshot rows (skipped by searches)
+until the next compaction drops them; adding samples after a delete
+starts the person afresh (photo replacement, re-enrolment).
+"""
+
+import numpy as np
+
+from config import GALLERY_EXEMPLARS, GALLERY_AGGREGATION, GALLERY_TOP_M
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype='float32')
+    norm = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norm[norm == 0] = 1.0
+    return (vectors / norm).astype('float32')
+
+
+def select_exemplars(vectors, n=GALLERY_EXEMPLARS):
+    """
+    Pick up to n diverse rows of `vectors` (unit length): start with the one
+    closest to the centroid, then repeatedly add the row least similar to
+    those already chosen. Returns row indices.
+    """
+    count = len(vectors)
+    if count <= n:
+        return np.arange(count)
+    sims_to_centroid = vectors @ normalize(vectors.mean(axis=0))
+    chosen = [int(np.argmax(sims_to_centroid))]
+    closest = vectors @ vectors[chosen[0]]
+    while len(chosen) < n:
+        closest[chosen] = np.inf
+        nxt = int(np.argmin(closest))
+        chosen.append(nxt)
+        closest = np.maximum(closest, vectors @ vectors[nxt])
+    return np.array(sorted(chosen))
+
+
+def aggregate(sims, method=GALLERY_AGGREGATION, top_m=GALLERY_TOP_M):
+    """Person score from its exemplar similarities."""
+    if method == 'mean':
+        m = min(max(1, top_m), len(sims))
+        return float(np.mean(np.partition(sims, len(sims) - m)[-m:]))
+    return float(np.max(sims))
+
+
+class GalleryState:
+    """
+    Per-person centroid sums/counts and exemplar rows of a gallery, built
+    from exemplar vectors + labels and updated as samples are added or
+    persons deleted.
+    """
+
+    def __init__(self, vectors, labels, persons=None, centroids=None, counts=None):
+        self.vectors = vectors
+        self.labels = labels
+        # Exemplar rows grouped by person: rows of person p are order[start[p]:end[p]]
+        self._order = np.argsort(labels, kind='stable')
+        sorted_labels = np.asarray(labels)[self._order]
+        self._keys, self._starts, self._ends = np.unique(sorted_labels, return_index=True,
+                                                         return_counts=True)
+        self._ends = self._starts + self._ends
+        self._extra = {}  # person -> list of vectors added since
+        if persons is None:
+            # Derive centroids from the exemplars (galleries without a centroid table)
+            persons = self._keys
+            centroids = np.vstack([np.asarray(vectors[self._order[s:e]]).mean(axis=0)
+                                   for s, e in zip(self._starts, self._ends)]) if len(persons) else \
+                np.zeros((0, vectors.shape[1]), dtype='float32')
+            counts = self._ends - self._starts
+        self.persons = np.asarray(persons, dtype=np.int64)
+        self.centroids = centroids
+        self.counts = counts
+        self._row_of = {int(p): i for i, p in enumerate(self.persons)}
+        self.updated = {}  # person -> (mean, count) changed since the snapshot
+        self.dropped = set()  # persons whose snapshot rows are tombstoned
+
+    def has(self, person):
+        person = int(person)
+        return person in self.updated or (person in self._row_of and person not in self.dropped)
+
+    def stale(self, person):
+        """True if the snapshot centroid row of `person` must not be served."""
+        return person in self.updated or person in self.dropped
+
+    def exemplars(self, person):
+        """All exemplar vectors of `person` (snapshot rows + added samples)."""
+        blocks = []
+        i = np.searchsorted(self._keys, person)
+        if i < len(self._keys) and self._keys[i] == person and int(person) not in self.dropped:
+            blocks.append(np.asarray(self.vectors[np.sort(self._order[self._starts[i]:self._ends[i]])]))
+        blocks += self._extra.get(int(person), [])
+        return np.vstack(blocks) if blocks else None
+
+    def centroid(self, person):
+        """(mean, count) of `person`, or (None, 0)."""
+        person = int(person)
+        if person in self.updated:
+            return self.updated[person]
+        row = self._row_of.get(person)
+        if row is None or person in self.dropped:
+            return None, 0
+        return np.asarray(self.centroids[row], dtype='float32'), int(self.counts[row])
+
+    def delete(self, person):
+        person = int(person)
+        self.dropped.add(person)
+        self.updated.pop(person, None)
+        self._extra.pop(person, None)
+
+    def add(self, vectors, labels, tombstones=None):
+        """Apply samples in order; rows flagged in `tombstones` delete their person instead."""
+        for i, (vector, person) in enumerate(zip(vectors, labels)):
+            person = int(person)
+            if tombstones is not None and tombstones[i]:
+                self.delete(person)
+                continue
+            mean, count = self.centroid(person)
+            mean = vector.astype('float32') if mean is None else (mean * count + vector) / (count + 1)
+            self.updated[person] = (mean.astype('float32'), count + 1)
+            self._extra.setdefault(person, []).append(vector[np.newaxis, :])
+
+    def all_persons(self):
+        """(persons, means, counts) of every person, updates applied."""
+        d = self.vectors.shape[1]
+        persons = np.asarray(self.persons, dtype=np.int64).copy()
+        means = np.array(self.centroids, dtype='float32').reshape(len(persons), d)
+        counts = np.asarray(self.counts, dtype=np.int64).copy()
+        keep = ~np.isin(persons, np.array(list(self.dropped - set(self.updated)), dtype=np.int64))
+        new = []
+        for person, (mean, count) in self.updated.items():
+            row = self._row_of.get(person)
+            if row is None:
+                new.append((person, mean, count))
+            else:
+                means[row], counts[row] = mean, count
+        if new:
+            persons = np.append(persons, [p for p, _, _ in new])
+            means = np.vstack([means] + [m[np.newaxis, :] for _, m, _ in new])
+            counts = np.append(counts, [c for _, _, c in new])
+            keep = np.append(keep, np.ones(len(new), dtype=bool))
+        return persons[keep], means[keep].astype('float32'), counts[keep]
+
+    def exemplar_count(self):
+        dropped = 0
+        for person in self.dropped:
+            i = np.searchsorted(self._keys, person)
+            if i < len(self._keys) and self._keys[i] == person:
+                dropped += int(self._ends[i] - self._starts[i])
+        return int(len(self.labels)) - dropped + sum(len(v) for v in self._extra.values())
+
+    def compacted(self, n=GALLERY_EXEMPLARS):
+        """(vectors, labels) with at most n exemplars per person (None: all), updates applied."""
+        persons = sorted(set(int(p) for p in self._keys) | set(self._extra))
+        out_vectors, out_labels = [], []
+        for person in persons:
+            exemplars = self.exemplars(person)
+            if exemplars is None:
+                continue
+            keep = exemplars if n is None else exemplars[select_exemplars(exemplars, n)]
+            out_vectors.append(keep)
+            out_labels.append(np.full(len(keep), person, dtype=np.int64))
+        if not out_vectors:
+            return np.zeros((0, self.vectors.shape[1]), dtype='float32'), np.array([], dtype=np.int64)
+        return np.vstack(out_vectors).astype('float32'), np.concatenate(out_labels)
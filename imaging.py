@@ -0,0 +1,79 @@
+"""
+In-memory image helpers.
+Images are kept as NumPy arrays (BGR, uint8 - the layout DeepFace expects for
+array input) from upload to embedding, so no temp files are written and no
+JPEG is re-encoded on the request path.
+"""
+
+import numpy as np
+import cv2
+
+
+def load_image(source):
+    """
+    Return a BGR uint8 array from a file path, encoded image bytes or an array.
+    Raises ValueError if the input cannot be decoded.
+    """
+    if isinstance(source, np.ndarray):
+        img = source
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        img = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        # np.fromfile + imdecode also handles non-ASCII paths on Windows,
+        # which cv2.imread does not
+        try:
+            data = np.fromfile(str(source), dtype=np.uint8)
+        except OSError as e:
+            raise ValueError(f"Cannot read image {source}: {e}")
+        img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+    if img is None or img.size == 0:
+        raise ValueError("Invalid image")
+
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    elif img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+    return img
+
+
+def image_extension(img_bytes):
+    """Pick a file extension for encoded bytes so they can be stored as-is."""
+    if bytes(img_bytes[:8]) == b'\x89PNG\r\n\x1a\n':
+        return '.png'
+    return '.jpg'
+
+
+def parse_facial_area(facial_area):
+    """Return (x, y, w, h) from a DeepFace facial_area (tuple or dict), or None."""
+    if isinstance(facial_area, (list, tuple)) and len(facial_area) == 4:
+        return tuple(int(v) for v in facial_area)
+    if isinstance(facial_area, dict) and {'x', 'y', 'w', 'h'}.issubset(facial_area.keys()):
+        return int(facial_area['x']), int(facial_area['y']), int(facial_area['w']), int(facial_area['h'])
+    return None
+
+
+def crop_face(img, box, padding=0.15, scale=(1.0, 1.0)):
+    """
+    Crop a face box (x, y, w, h) from img, expanded by `padding` on each side.
+    `scale` maps a box detected on a resized copy back to img coordinates.
+    Returns a contiguous copy of the crop, or None if the box is empty.
+    """
+    if box is None:
+        return None
+    img_h, img_w = img.shape[:2]
+    x, y, w, h = box
+    sx, sy = scale
+    left = int(max(0, x * sx))
+    top = int(max(0, y * sy))
+    right = int(min(img_w, (x + w) * sx))
+    bottom = int(min(img_h, (y + h) * sy))
+    pad_w = int((right - left) * padding)
+    pad_h = int((bottom - top) * padding)
+    left = max(0, left - pad_w)
+    top = max(0, top - pad_h)
+    right = min(img_w, right + pad_w)
+    bottom = min(img_h, bottom + pad_h)
+    if right <= left or bottom <= top:
+        return None
+    return np.ascontiguousarray(img[top:bottom, left:right])
@@ -0,0 +1,233 @@
+"""
+Micro-batching inference worker.
+A single background thread owns every TensorFlow/DeepFace call. Request
+threads submit work and wait on a Future:
+  - embed jobs (one face crop each) are collected into batches of up to
+    max_batch_size, waiting at most max_wait_ms for more to arrive, and run
+    as one batched forward pass;
+  - call jobs (e.g. face detection) run one at a time on the same thread.
+Because only this thread touches the model, request handling can be
+multithreaded without the "Retval[0] has already been set" TF crashes.
+
+RemoteInferenceWorker has the same embed/call interface but forwards the
+work over a local socket to the central inference process
+(inference_server.py), so several HTTP worker processes share one model.
+Remote calls name a function from the server's whitelist (REMOTE_CALLS in
+inference_server.py) instead of shipping a callable.
+"""
+
+import io
+import os
+import pickle
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client
+
+import numpy as np
+
+from metrics import inference_seconds, inference_batch_size
+from config import INFERENCE_MAX_BATCH_SIZE, INFERENCE_MAX_WAIT_MS, INFERENCE_AUTHKEY, INFERENCE_TIMEOUT_SECONDS
+
+_EMBED = 'embed'
+_CALL = 'call'
+
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+def parse_address(address):
+    """INFERENCE_ADDRESS -> multiprocessing.connection address: ("host", port) for "host:port", else the path."""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and host and not address.startswith('\\\\') and os.sep not in host:
+        return host.strip('[]'), int(port)
+    return address
+
+
+def is_local_address(address):
+    """True for Unix sockets, named pipes and loopback TCP addresses."""
+    parsed = parse_address(address)
+    return not isinstance(parsed, tuple) or parsed[0] in LOOPBACK_HOSTS
+
+
+# Classes a request payload may contain besides plain Python containers:
+# NumPy arrays (face crops) and their dtypes
+_SAFE_GLOBALS = {
+    ('numpy', 'ndarray'), ('numpy', 'dtype'),
+    ('numpy.core.multiarray', '_reconstruct'), ('numpy._core.multiarray', '_reconstruct'),
+    ('numpy.core.multiarray', 'scalar'), ('numpy._core.multiarray', 'scalar'),
+    ('numpy.core.numeric', '_frombuffer'), ('numpy._core.numeric', '_frombuffer'),
+}
+
+
+class _PayloadUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) not in _SAFE_GLOBALS:
+            raise pickle.UnpicklingError(f"Refusing to unpickle {module}.{name}")
+        return super().find_class(module, name)
+
+
+def load_payload(data):
+    """Unpickle a request that may only hold containers, scalars and NumPy arrays."""
+    return _PayloadUnpickler(io.BytesIO(data)).load()
+
+
+class InferenceWorker:
+    def __init__(self, embed_batch_fn, max_batch_size=INFERENCE_MAX_BATCH_SIZE, max_wait_ms=INFERENCE_MAX_WAIT_MS):
+        """
+        embed_batch_fn: callable taking a list of face crops and returning an
+        (n, d) array of embeddings, one row per crop.
+        """
+        self.embed_batch_fn = embed_batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='inference-worker', daemon=True)
+                self._thread.start()
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _submit(self, kind, payload):
+        self.start()
+        future = Future()
+        self._queue.put((kind, payload, future))
+        return future
+
+    def submit_embed(self, crop):
+        """Queue one face crop for batched embedding. Returns a Future of a 1-D vector."""
+        return self._submit(_EMBED, crop)
+
+    def submit_call(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the worker thread. Returns a Future of its result."""
+        return self._submit(_CALL, (fn, args, kwargs))
+
+    def embed(self, crops):
+        """Embed crops (batched together with other callers' crops) and wait for the result."""
+        futures = [self.submit_embed(crop) for crop in crops]
+        return np.vstack([f.result() for f in futures]) if futures else np.zeros((0, 0), dtype='float32')
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn on the worker thread and wait for the result."""
+        return self.submit_call(fn, *args, **kwargs).result()
+
+    def _run(self):
+        while True:
+            kind, payload, future = self._queue.get()
+            if kind == _CALL:
+                self._run_call(payload, future)
+                continue
+
+            # Collect more embed jobs until the batch is full or max_wait elapses.
+            # Calls that arrive meanwhile run right after the batch.
+            batch = [(payload, future)]
+            calls = []
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout <= 0:
+                        item = self._queue.get_nowait()
+                    else:
+                        item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item[0] == _EMBED:
+                    batch.append((item[1], item[2]))
+                else:
+                    calls.append((item[1], item[2]))
+
+            self._run_batch(batch)
+            for payload, future in calls:
+                self._run_call(payload, future)
+
+    def _run_call(self, payload, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        fn, args, kwargs = payload
+        start = time.perf_counter()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        inference_seconds.observe(time.perf_counter() - start, op=getattr(fn, '__name__', 'call'))
+
+    def _run_batch(self, batch):
+        batch = [(crop, f) for crop, f in batch if f.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        inference_batch_size.observe(len(batch))
+        start = time.perf_counter()
+        try:
+            vectors = self.embed_batch_fn([crop for crop, _ in batch])
+        except Exception as e:
+            for _, f in batch:
+                f.set_exception(e)
+            return
+        finally:
+            inference_seconds.observe(time.perf_counter() - start, op='embed')
+        for (_, f), vec in zip(batch, vectors):
+            f.set_result(vec)
+
+
+class RemoteInferenceWorker:
+    def __init__(self, address, authkey=INFERENCE_AUTHKEY, timeout=INFERENCE_TIMEOUT_SECONDS):
+        """
+        address: the inference process's socket (Unix socket path, or a
+        named pipe on Windows). Connections are pooled, one per concurrent
+        caller, so requests from many threads reach the server's batcher
+        together.
+        """
+        self.address = address
+        self.authkey = authkey.encode() if isinstance(authkey, str) else authkey
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+
+    def start(self):
+        pass
+
+    def _connect(self):
+        return Client(parse_address(self.address), authkey=self.authkey)
+
+    def _request(self, op, payload):
+        try:
+            conn, reused = self._idle.get_nowait(), True
+        except queue.Empty:
+            conn, reused = self._connect(), False
+        try:
+            conn.send((op, payload))
+        except (EOFError, OSError):
+            conn.close()
+            if not reused:
+                raise
+            # Pooled connection went stale (e.g. the server restarted): retry once
+            conn = self._connect()
+            conn.send((op, payload))
+
+        try:
+            if not conn.poll(self.timeout):
+                raise TimeoutError(f"Inference server did not answer within {self.timeout}s")
+            status, result = conn.recv()
+        except BaseException:
+            conn.close()
+            raise
+        self._idle.put(conn)
+        if status == 'error':
+            raise result
+        return result
+
+    def queue_depth(self):
+        return self._request('depth', None)
+
+    def embed(self, crops):
+        return self._request('embed', list(crops))
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the inference process; fn must be in its REMOTE_CALLS."""
+        return self._request('call', (fn.__name__, args, kwargs))
@@ -0,0 +1,102 @@
+"""
+Central inference process.
+Owns the only copy of the detector/recognition models and serves model work
+to the HTTP worker processes over a socket (multiprocessing.connection,
+authenticated with INFERENCE_AUTHKEY; serve.py generates a secret per launch). Each client connection gets a thread;
+all of them feed the same micro-batching InferenceWorker, so embedding
+requests from different processes are batched together.
+
+    INFERENCE_ADDRESS=embeddings/inference.sock python inference_server.py
+
+Clients set the same INFERENCE_ADDRESS (see face_pipeline.get_worker); serve.py
+starts this process and the HTTP workers together.
+
+Protocol (pickled tuples): request (op, payload) with op 'embed' (list of
+crops), 'call' ((name, args, kwargs), name one of REMOTE_CALLS) or 'depth';
+reply ('ok', result) or ('error', exception). Requests are unpickled with
+an allowlist (containers, scalars and NumPy arrays only), so a client can
+neither run arbitrary functions nor smuggle objects in the payload.
+The server refuses to start with the built-in default key on an address
+reachable from other hosts.
+"""
+
+import os
+import sys
+import threading
+from multiprocessing.connection import Listener
+
+from config import INFERENCE_ADDRESS, INFERENCE_AUTHKEY, DEFAULT_INFERENCE_AUTHKEY
+from face_pipeline import get_local_worker, warm_up, detect_faces, detect_crops
+from inference import parse_address, is_local_address, load_payload
+
+# The only functions clients may run here (RemoteInferenceWorker.call)
+REMOTE_CALLS = {fn.__name__: fn for fn in (warm_up, detect_faces, detect_crops)}
+
+
+def _serve_connection(conn, worker):
+    try:
+        while True:
+            try:
+                data = conn.recv_bytes()
+            except (EOFError, OSError):
+                break
+            try:
+                op, payload = load_payload(data)
+                if op == 'embed':
+                    result = worker.embed(payload)
+                elif op == 'call':
+                    name, args, kwargs = payload
+                    if name not in REMOTE_CALLS:
+                        raise ValueError(f"Inference call not allowed: {name}")
+                    result = worker.call(REMOTE_CALLS[name], *args, **kwargs)
+                elif op == 'depth':
+                    result = worker.queue_depth()
+                else:
+                    raise ValueError(f"Unknown inference op: {op}")
+                reply = ('ok', result)
+            except Exception as e:
+                reply = ('error', e)
+            try:
+                conn.send(reply)
+            except (EOFError, OSError):
+                break
+    finally:
+        conn.close()
+
+
+def serve(address=INFERENCE_ADDRESS, authkey=INFERENCE_AUTHKEY, ready=None):
+    """Load the model and serve clients forever. `ready` (an Event) is set once listening."""
+    if not address:
+        raise ValueError("INFERENCE_ADDRESS is not set")
+    if not authkey:
+        raise ValueError("INFERENCE_AUTHKEY is empty")
+    if authkey == DEFAULT_INFERENCE_AUTHKEY and not is_local_address(address):
+        raise ValueError(f"Refusing to serve {address} with the default INFERENCE_AUTHKEY; set a secret key")
+    worker = get_local_worker()
+    print(f"🧠 Inference server loading model (input shape {worker.call(warm_up)})")
+
+    listen_address = parse_address(address)
+    is_unix_socket = isinstance(listen_address, str) and not address.startswith('\\\\')
+    if is_unix_socket and os.path.exists(address):
+        os.remove(address)  # stale socket from a previous run
+    listener = Listener(listen_address, authkey=authkey.encode() if isinstance(authkey, str) else authkey)
+    if is_unix_socket:
+        os.chmod(address, 0o600)  # only this user may connect
+    print(f"🧠 Inference server listening on {address}")
+    if ready is not None:
+        ready.set()
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # Failed handshake (wrong authkey, client gone): keep serving
+                print(f"⚠️ Inference connection rejected: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, worker), daemon=True).start()
+    finally:
+        listener.close()
+
+
+if __name__ == '__main__':
+    serve(sys.argv[1] if len(sys.argv) > 1 else INFERENCE_ADDRESS)
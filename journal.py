@@ -0,0 +1,180 @@
+"""
+Append-only embedding journal.
+Registration appends one record per vector instead of rewriting the whole
+index; the journal is folded into a snapshot by compaction (see
+embeddings.IndexCache) and replayed on startup.
+
+File layout:
+  header: magic b'FJNL', version (uint16), journal id (16 random bytes)
+  record: label (int64), timestamp (float64), dim (uint32),
+          dim x float32 vector, crc32 of the preceding record bytes (uint32)
+A record with dim 0 is a tombstone: it deletes every vector of its label
+written before it (person deleted or photos replaced).
+A record that is truncated or fails its CRC (torn write after a crash) ends
+the readable journal; it is cut off on the next append.
+"""
+
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, single writer assumed
+    fcntl = None
+
+_MAGIC = b'FJNL'
+_VERSION = 1
+_HEADER = struct.Struct('<4sH16s')
+_RECORD = struct.Struct('<qdI')
+_CRC = struct.Struct('<I')
+
+
+class EmbeddingJournal:
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def locked(self):
+        """Exclusive lock (threads and, where fcntl exists, processes) for appends and rewrites."""
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _create(self):
+        journal_id = uuid.uuid4().bytes
+        with open(self.path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, journal_id))
+            f.flush()
+            os.fsync(f.fileno())
+        return journal_id
+
+    def journal_id(self):
+        """Return the id of the current journal file, or None if it does not exist."""
+        try:
+            with open(self.path, 'rb') as f:
+                head = f.read(_HEADER.size)
+        except OSError:
+            return None
+        if len(head) < _HEADER.size:
+            return None
+        magic, version, journal_id = _HEADER.unpack(head)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"Unsupported journal file: {self.path}")
+        return journal_id
+
+    def read(self, offset=0):
+        """
+        Read valid records starting at byte `offset` (0 = from the first record).
+        Returns (journal_id, vectors (n, d) float32, labels (n,) int64,
+        timestamps (n,) float64, tombstones (n,) bool, end_offset).
+        Tombstone rows have a zero vector. end_offset is the byte offset
+        after the last valid record.
+        """
+        journal_id = self.journal_id()
+        if journal_id is None:
+            return (None, None, np.array([], dtype=np.int64), np.array([], dtype=np.float64),
+                    np.array([], dtype=bool), 0)
+        offset = max(offset, _HEADER.size)
+
+        vectors, labels, stamps = [], [], []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+
+        pos = 0
+        while pos + _RECORD.size <= len(data):
+            label, stamp, dim = _RECORD.unpack_from(data, pos)
+            end = pos + _RECORD.size + dim * 4
+            if end + _CRC.size > len(data):
+                break
+            (crc,) = _CRC.unpack_from(data, end)
+            if crc != zlib.crc32(data[pos:end]):
+                break
+            vectors.append(np.frombuffer(data, dtype='<f4', count=dim, offset=pos + _RECORD.size))
+            labels.append(label)
+            stamps.append(stamp)
+            pos = end + _CRC.size
+
+        tombstones = np.array([len(v) == 0 for v in vectors], dtype=bool)
+        dim = max((len(v) for v in vectors), default=0)
+        vectors = np.vstack([v if len(v) else np.zeros(dim, dtype='<f4') for v in vectors]).astype('float32') \
+            if vectors else None
+        return (journal_id, vectors, np.array(labels, dtype=np.int64),
+                np.array(stamps, dtype=np.float64), tombstones, offset + pos)
+
+    def append(self, vectors, labels, valid_end=None, deleted=()):
+        """
+        Append a tombstone per label in `deleted`, then one record per row of
+        `vectors` (may be None), in one write. Call while holding locked().
+        `valid_end` is the end of the last valid record as seen by read(); a
+        torn tail beyond it is cut off first. Returns (journal_id, end_offset).
+        """
+        if vectors is None:
+            vectors = np.zeros((0, 0), dtype='<f4')
+        vectors = np.ascontiguousarray(vectors, dtype='<f4')
+        if vectors.ndim == 1:
+            vectors = vectors[np.newaxis, :]
+        labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+
+        journal_id = self.journal_id()
+        if journal_id is None:
+            journal_id = self._create()
+
+        now = time.time()
+        buf = bytearray()
+        for label in deleted:
+            body = _RECORD.pack(int(label), now, 0)
+            buf += body + _CRC.pack(zlib.crc32(body))
+        for vec, label in zip(vectors, labels):
+            body = _RECORD.pack(int(label), now, vec.shape[0]) + vec.tobytes()
+            buf += body + _CRC.pack(zlib.crc32(body))
+
+        with open(self.path, 'r+b') as f:
+            if valid_end is not None and valid_end >= _HEADER.size:
+                f.truncate(valid_end)
+            f.seek(0, os.SEEK_END)
+            f.write(buf)
+            f.flush()
+            os.fsync(f.fileno())
+            end = f.tell()
+        return journal_id, end
+
+    def rewrite(self, from_offset):
+        """
+        Replace the journal with a new one (new id) holding only the records
+        after `from_offset`. Used after a snapshot has absorbed the earlier
+        records. Call while holding locked(). Returns (journal_id, end_offset).
+        """
+        from_offset = max(from_offset, _HEADER.size)
+        valid_end = self.read(from_offset)[-1]
+        tail = b''
+        if valid_end > from_offset:
+            with open(self.path, 'rb') as f:
+                f.seek(from_offset)
+                tail = f.read(valid_end - from_offset)
+
+        tmp_path = self.path + '.tmp'
+        journal_id = uuid.uuid4().bytes
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, journal_id))
+            f.write(tail)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return journal_id, _HEADER.size + len(tail)
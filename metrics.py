@@ -0,0 +1,283 @@
+"""
+In-process latency and throughput metrics (no external dependency).
+Every request is split into stages, timed with `stage(name)`:
+  decode    image bytes -> BGR array
+  detect    face detector pass (incl. waiting for the inference worker)
+  align     crop + eye alignment of each face
+  embed     recognition model pass (incl. batching wait)
+  search    FAISS index query
+  db        person name/photo lookup
+  response  building the response body
+Durations go into histograms that keep both Prometheus buckets (sum/count
+since start) and the last METRICS_WINDOW samples for p50/p95/p99.
+
+    GET /metrics          Prometheus text format (version 0.0.4)
+    GET /api/face/metrics same data as JSON with percentiles
+
+Inside `request_trace()` the stage durations of the current request are
+also collected (context variable, so concurrent requests do not mix) and
+returned in responses as `timings_ms`.
+Metrics are per process: with serve.py each HTTP worker reports its own,
+and inference batch metrics live in the inference process.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from config import METRICS_WINDOW
+
+# Seconds; covers 1 ms lookups up to multi-second detector cold starts
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_trace = contextvars.ContextVar('face_request_trace', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Series:
+    """One labelled histogram series: cumulative buckets plus a rolling sample window."""
+
+    def __init__(self, buckets, window):
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, window=METRICS_WINDOW):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.window = max(1, int(window))
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _Series(self.buckets, self.window)
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series.bucket_counts[i] += 1
+            series.count += 1
+            series.sum += value
+            series.recent.append(value)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def _snapshot(self):
+        with self._lock:
+            return [(key, list(s.bucket_counts), s.count, s.sum, sorted(s.recent))
+                    for key, s in sorted(self._series.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, bucket_counts, count, total, _ in self._snapshot():
+            cumulative = 0
+            for bound, n in zip(self.buckets, bucket_counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _format_value(float(bound)))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def summary(self, scale=1.0):
+        """[{labels, count, mean, p50, p95, p99}]; percentiles over the last `window` samples."""
+        out = []
+        for key, _, count, total, recent in self._snapshot():
+            entry = {'labels': dict(key), 'count': count,
+                     'mean': round(total / count * scale, 3) if count else None}
+            for q in QUANTILES:
+                value = recent[min(len(recent) - 1, int(q * len(recent)))] if recent else None
+                entry[f"p{int(q * 100)}"] = round(value * scale, 3) if value is not None else None
+            out.append(entry)
+        return out
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(key)} {_format_value(v)}" for key, v in self.values()]
+        return lines
+
+    def summary(self):
+        return [{'labels': dict(key), 'value': v} for key, v in self.values()]
+
+
+class Gauge:
+    """
+    Value read at scrape time from `fn`: a number, or with `label` set a
+    dict {label value: number}.
+    """
+
+    def __init__(self, name, help_text, fn, label=None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.label = label
+
+    def values(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"⚠️ Metric {self.name} unavailable: {e}")
+            return []
+        if value is None:
+            return []
+        if self.label:
+            return sorted((((self.label, str(k)),), v) for k, v in value.items())
+        return [((), value)]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        lines += [f"{self.name}{_format_labels(key)} {_format_value(v)}" for key, v in self.values()]
+        return lines
+
+    def summary(self):
+        return [{'labels': dict(key), 'value': v} for key, v in self.values()]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def counter(self, name, help_text):
+        return self._register(Counter(name, help_text))
+
+    def gauge(self, name, help_text, fn, label=None):
+        """Register (or replace) a scrape-time gauge."""
+        with self._lock:
+            self._metrics[name] = Gauge(name, help_text, fn, label)
+            return self._metrics[name]
+
+    def _all(self):
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        for metric in self._all():
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """JSON-friendly view; latencies in milliseconds."""
+        out = {}
+        for metric in self._all():
+            if isinstance(metric, Histogram):
+                scale = 1000.0 if metric.buckets is LATENCY_BUCKETS else 1.0
+                out[metric.name] = metric.summary(scale)
+            else:
+                out[metric.name] = metric.summary()
+        return out
+
+
+registry = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+stage_seconds = registry.histogram('face_stage_seconds', 'Time spent in each request stage')
+request_seconds = registry.histogram('face_request_seconds', 'End-to-end request latency by endpoint')
+inference_seconds = registry.histogram('face_inference_seconds', 'Model time on the inference worker by op')
+inference_batch_size = registry.histogram('face_inference_batch_size', 'Face crops per embedding batch',
+                                          buckets=SIZE_BUCKETS)
+cache_requests = registry.counter('face_cache_requests_total',
+                                  'Cache lookups by cache and result (hit/miss)')
+stream_frames = registry.counter('face_stream_frames_total', 'Streamed frames by camera and outcome')
+stream_latency_seconds = registry.histogram('face_stream_latency_seconds',
+                                            'Streamed frame latency from push to published result')
+cascade_frames = registry.counter('face_cascade_frames_total',
+                                  'Frames screened by the detector cascade by outcome (empty/faces)')
+cascade_proposals = registry.counter('face_cascade_proposals_total',
+                                     'First-stage face proposals by outcome (accepted/confirmed/rejected)')
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=name)
+        timings = _trace.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def request_trace(endpoint):
+    """
+    Time a whole request and collect its stage timings. Yields a dict that,
+    after the block, maps stage -> milliseconds (plus "total").
+    Nested traces report into the outermost one (and yield an empty dict).
+    """
+    if _trace.get() is not None:
+        yield {}
+        return
+    timings = {}
+    token = _trace.set(timings)
+    start = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        elapsed = time.perf_counter() - start
+        _trace.reset(token)
+        request_seconds.observe(elapsed, endpoint=endpoint)
+        for name in list(timings):
+            timings[name] = round(timings[name] * 1000.0, 2)
+        timings['total'] = round(elapsed * 1000.0, 2)
+
@@ -0,0 +1,168 @@
+"""
+In-memory person directory: id -> name, primary photo, sample count.
+Loaded with one DB query plus one scan of the dataset folder and kept
+current by register/delete, so recognition and listing endpoints resolve any
+batch of person ids without touching the filesystem and with at most one DB
+round trip (only for ids this process has not seen).
+Every register/delete also writes the gallery journal, so when the gallery
+stamp changes (another serve.py worker or process wrote it) the directory
+is reloaded before it answers; after this process's own writes it just
+takes the new stamp.
+Dataset photos are named "{person_id}_{...}"; the primary photo is the
+first such file in name order.
+"""
+
+import os
+import threading
+
+from config import UPLOAD_FOLDER
+from database import SessionLocal
+from models import Person
+from metrics import cache_requests
+from embeddings import gallery_stamp
+
+# Files in the dataset folder that are not registration photos
+_SKIP_PREFIXES = ('temp_', 'tmp_')
+
+
+def _person_id_of(fname):
+    if fname.startswith(_SKIP_PREFIXES):
+        return None
+    head, sep, _ = fname.partition('_')
+    if not sep or not head.isdigit():
+        return None
+    return int(head)
+
+
+class PersonDirectory:
+    def __init__(self, dataset_dir=UPLOAD_FOLDER, stamp=gallery_stamp):
+        self.dataset_dir = dataset_dir
+        self.stamp = stamp
+        self._stamp = None
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._missing = set()
+        self._loaded = False
+
+    def _scan_dataset(self):
+        """One pass over the dataset folder. Returns {person_id: [primary_photo, samples]}."""
+        photos = {}
+        try:
+            with os.scandir(self.dataset_dir) as it:
+                for entry in it:
+                    person_id = _person_id_of(entry.name)
+                    if person_id is None or not entry.is_file():
+                        continue
+                    item = photos.setdefault(person_id, [entry.name, 0])
+                    item[0] = min(item[0], entry.name)
+                    item[1] += 1
+        except OSError:
+            pass
+        return photos
+
+    def load(self):
+        """(Re)load every person from the DB and the dataset folder."""
+        # Taken first: a change made while loading triggers another reload
+        stamp = self.stamp()
+        session = SessionLocal()
+        try:
+            rows = session.query(Person.id, Person.name).all()
+        finally:
+            session.close()
+        photos = self._scan_dataset()
+
+        entries = {}
+        for person_id, name in rows:
+            photo, samples = photos.get(int(person_id), (None, 0))
+            entries[int(person_id)] = {'id': int(person_id), 'name': name, 'photo': photo, 'samples': samples}
+        with self._lock:
+            self._entries = entries
+            self._missing = set()
+            self._stamp = stamp
+            reload, self._loaded = self._loaded, True
+        if not reload:
+            print(f"📇 Person directory loaded: {len(entries)} persons")
+        return len(entries)
+
+    def _ensure_loaded(self):
+        if not self._loaded or self.stamp() != self._stamp:
+            self.load()
+
+    def _adopt_stamp(self):
+        """
+        After this process's own gallery write (call with the lock held): the
+        maps are already current, so take the new stamp instead of reloading.
+        Ids cached as missing are looked up again, in case another worker
+        registered them meanwhile.
+        """
+        if self._loaded:
+            self._stamp = self.stamp()
+            self._missing = set()
+
+    def resolve(self, person_ids):
+        """
+        Return {person_id: entry} for the given ids. Ids unknown to this
+        process are fetched with one DB query; ids not in the DB are omitted.
+        """
+        self._ensure_loaded()
+        ids = {int(pid) for pid in person_ids if pid is not None}
+        with self._lock:
+            unknown = [pid for pid in ids if pid not in self._entries and pid not in self._missing]
+        cache_requests.inc(len(ids) - len(unknown), cache='person_directory', result='hit')
+
+        if unknown:
+            cache_requests.inc(len(unknown), cache='person_directory', result='miss')
+            session = SessionLocal()
+            try:
+                rows = session.query(Person.id, Person.name).filter(Person.id.in_(unknown)).all()
+            finally:
+                session.close()
+            with self._lock:
+                for person_id, name in rows:
+                    self._entries.setdefault(int(person_id), {
+                        'id': int(person_id), 'name': name, 'photo': None, 'samples': 0
+                    })
+                self._missing.update(set(unknown) - {int(pid) for pid, _ in rows})
+
+        with self._lock:
+            return {pid: dict(self._entries[pid]) for pid in ids if pid in self._entries}
+
+    def names(self, person_ids):
+        """Return {person_id: name} for the given ids."""
+        return {pid: entry['name'] for pid, entry in self.resolve(person_ids).items()}
+
+    def all(self):
+        """Every known person, ordered by id."""
+        self._ensure_loaded()
+        with self._lock:
+            return [dict(self._entries[pid]) for pid in sorted(self._entries)]
+
+    def photo_files(self, person_id):
+        """Dataset photo file names of a person (scans the folder; for deletes/replacements)."""
+        person_id = int(person_id)
+        try:
+            with os.scandir(self.dataset_dir) as it:
+                return sorted(e.name for e in it if _person_id_of(e.name) == person_id and e.is_file())
+        except OSError:
+            return []
+
+    def add_sample(self, person_id, name, photo=None):
+        """Record a registered sample (photo file name in the dataset folder) for a person."""
+        person_id = int(person_id)
+        with self._lock:
+            entry = self._entries.setdefault(person_id, {'id': person_id, 'name': name, 'photo': None, 'samples': 0})
+            entry['name'] = name
+            if photo:
+                entry['samples'] += 1
+                if entry['photo'] is None or photo < entry['photo']:
+                    entry['photo'] = photo
+            self._adopt_stamp()
+
+    def remove(self, person_id):
+        with self._lock:
+            self._entries.pop(int(person_id), None)
+            self._adopt_stamp()
+            self._missing.add(int(person_id))
+
+
+directory = PersonDirectory()
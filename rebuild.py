@@ -0,0 +1,111 @@
+"""
+Background dataset rebuild job.
+Runs embeddings.rebuild_index_from_dataset in a thread so the HTTP request
+returns immediately, and exposes progress, ETA and cancellation. Only one
+rebuild runs at a time per process.
+"""
+
+import threading
+import time
+import uuid
+
+from config import REBUILD_WORKERS
+from embeddings import rebuild_index_from_dataset
+
+
+class RebuildJob:
+    def __init__(self, dataset_dir, workers=REBUILD_WORKERS, use_cache=True):
+        self.id = uuid.uuid4().hex[:12]
+        self.dataset_dir = dataset_dir
+        self.workers = workers
+        self.use_cache = use_cache
+        self.status = 'pending'
+        self.total = 0
+        self.processed = 0
+        self.failed = 0
+        self.entries = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.time()
+        self.status = 'running'
+        self._thread = threading.Thread(target=self._run, name=f'rebuild-{self.id}', daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_running(self):
+        return self.status in ('pending', 'running')
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _progress(self, processed, total, failed):
+        self.processed = processed
+        self.total = total
+        self.failed = failed
+
+    def _run(self):
+        try:
+            self.entries = rebuild_index_from_dataset(
+                self.dataset_dir,
+                workers=self.workers,
+                progress=self._progress,
+                cancel_event=self._cancel,
+                use_cache=self.use_cache
+            )
+            self.status = 'cancelled' if self._cancel.is_set() else 'done'
+        except Exception as e:
+            import traceback
+            print("❌ Rebuild error:", traceback.format_exc())
+            self.error = str(e)
+            self.status = 'failed'
+        finally:
+            self.finished_at = time.time()
+
+    def to_dict(self):
+        now = self.finished_at or time.time()
+        elapsed = (now - self.started_at) if self.started_at else 0.0
+        eta = None
+        if self.is_running() and self.processed and self.total:
+            eta = elapsed / self.processed * (self.total - self.processed)
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'failed': self.failed,
+            'percent': round(100.0 * self.processed / self.total, 1) if self.total else 0.0,
+            'elapsed_seconds': round(elapsed, 1),
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'entries': self.entries,
+            'error': self.error,
+            'workers': self.workers,
+            'use_cache': self.use_cache,
+        }
+
+
+_jobs_lock = threading.Lock()
+_current_job = None
+
+
+def start_rebuild(dataset_dir, workers=REBUILD_WORKERS, use_cache=True):
+    """Start a rebuild job. Returns (job, started); an already running job is returned as-is."""
+    global _current_job
+    with _jobs_lock:
+        if _current_job is not None and _current_job.is_running():
+            return _current_job, False
+        _current_job = RebuildJob(dataset_dir, workers=workers, use_cache=use_cache)
+        _current_job.start()
+        return _current_job, True
+
+
+def current_rebuild():
+    """Return the most recent rebuild job, or None."""
+    return _current_job
@@ -1,183 +1,239 @@
+import time
 import numpy as np
-from deepface import DeepFace
-from config import FACE_MODEL, FACE_DETECTOR, SIM_THRESHOLD
-from embeddings import load_index
-from database import SessionLocal
-from models import Person
+from config import (SIM_THRESHOLD, MAX_FACES_PER_FRAME, GALLERY_RERANK_PERSONS, RECOGNITION_DETECTOR,
+                    FAST_DETECTOR, FAST_DETECT_WIDTH, FAST_MAX_FACES, FAST_RERANK_PERSONS)
+from scoring import is_match, score_fields
+from embeddings import search_index
+from face_pipeline import find_faces, embed_many, detect_size_for
+from imaging import load_image
+from person_directory import directory
+from metrics import stage
 
-def recognize_face(img_path, k=1, resize_to=None):
+
+def _identify(img, detections, k, rerank_persons=GALLERY_RERANK_PERSONS):
     """
-    Fast + accurate recognition flow:
-    - If resize_to is provided, run face detection on a downscaled copy to save time.
-    - Map the detected bbox back to the original image coordinates.
-    - Crop the original image to that bbox and compute embedding on the crop for best accuracy.
-    - Search FAISS index and return (name, distance) or ("Unknown", distance).
+    Embed `detections` in one batch, search them in one index query and
+    resolve names. Returns (status, [(detection, face result), ...]).
     """
-    tmp_resized = None
-    face_crop_path = None
-    try:
-        print(f"🤖 Recognizing face from: {img_path}")
-
-        # Load original image to get size
-        from PIL import Image
-        import os, uuid
-
-        orig_img = Image.open(img_path).convert('RGB')
-        orig_w, orig_h = orig_img.size
-
-        detect_path = img_path
-
-        # If requested, create a small resized image for faster face detection only
-        if resize_to:
-            try:
-                small = orig_img.resize((int(resize_to[0]), int(resize_to[1])), Image.LANCZOS)
-                tmp_resized = os.path.join(os.path.dirname(img_path), f"tmp_resize_{uuid.uuid4().hex}.jpg")
-                small.save(tmp_resized)
-                detect_path = tmp_resized
-                print(f"🔧 Using resized image for detection: {tmp_resized}")
-            except Exception as e:
-                print(f"⚠️ Failed to create resized image for detection: {e}. Falling back to original for detection.")
-
-        # Use DeepFace (detector only) to detect faces on detect_path
-        reps = DeepFace.represent(
-            img_path=detect_path,
-            model_name=FACE_MODEL,
-            detector_backend=FACE_DETECTOR,
-            enforce_detection=False
-        )
-
-        print(f"📊 DeepFace detection returned {len(reps) if reps else 0} face representations")
-
-        if not reps:
-            print("⚠️ No faces detected by DeepFace")
-            return "NoFace", None
-
-        # DeepFace.represent returns embedding for the face detected on the image we passed (detect_path).
-        # If we used a resized image for detection, try to obtain the bounding box from the result
-        # and map it back to the original image, then crop the original and compute embedding on the crop.
-        detection = reps[0].get('facial_area') if isinstance(reps[0], dict) else None
-
-        if detection and tmp_resized:
-            # facial_area format: (x, y, w, h) or dict depending on backend; try tuple/list first
-            try:
-                if isinstance(detection, (list, tuple)) and len(detection) == 4:
-                    dx, dy, dw, dh = detection
-                elif isinstance(detection, dict) and {'x','y','w','h'}.issubset(detection.keys()):
-                    dx = detection['x']; dy = detection['y']; dw = detection['w']; dh = detection['h']
-                else:
-                    # Unknown format - fall back to using embedding from detect_path
-                    dx = dy = dw = dh = None
-            except Exception:
-                dx = dy = dw = dh = None
-
-            if dx is not None:
-                # Map coordinates from resized image space back to original
-                small_w, small_h = Image.open(detect_path).size
-                x_scale = orig_w / float(small_w)
-                y_scale = orig_h / float(small_h)
-
-                left = int(max(0, dx * x_scale))
-                top = int(max(0, dy * y_scale))
-                right = int(min(orig_w, (dx + dw) * x_scale))
-                bottom = int(min(orig_h, (dy + dh) * y_scale))
-
-                # Expand bbox slightly to include context
-                pad_w = int((right - left) * 0.15)
-                pad_h = int((bottom - top) * 0.15)
-                left = max(0, left - pad_w)
-                top = max(0, top - pad_h)
-                right = min(orig_w, right + pad_w)
-                bottom = min(orig_h, bottom + pad_h)
-
-                try:
-                    crop = orig_img.crop((left, top, right, bottom))
-                    face_crop_path = os.path.join(os.path.dirname(img_path), f"tmp_crop_{uuid.uuid4().hex}.jpg")
-                    crop.save(face_crop_path)
-                    print(f"✂️ Saved face crop for embedding: {face_crop_path}")
-                except Exception as e:
-                    print(f"⚠️ Failed to crop original image: {e}. Will use detected embedding from resized image.")
-
-        # If we produced a face crop, compute embedding on the crop for best accuracy; otherwise use reps[0]
-        if face_crop_path:
-            try:
-                reps_crop = DeepFace.represent(
-                    img_path=face_crop_path,
-                    model_name=FACE_MODEL,
-                    detector_backend=FACE_DETECTOR,
-                    enforce_detection=False
-                )
-                if reps_crop and isinstance(reps_crop, list) and 'embedding' in reps_crop[0]:
-                    query_embedding = np.array([reps_crop[0]['embedding']]).astype('float32')
-                else:
-                    # fallback to original reps
-                    query_embedding = np.array([reps[0]['embedding']]).astype('float32')
-            except Exception as e:
-                print(f"⚠️ Failed to compute embedding on crop: {e}. Falling back to detected embedding.")
-                query_embedding = np.array([reps[0]['embedding']]).astype('float32')
-        else:
-            # No crop available; use embedding from detection step
-            try:
-                query_embedding = np.array([reps[0]['embedding']]).astype('float32')
-            except Exception:
-                print("❌ No embedding available from detection result")
-                return "Error", None
+    status, per_image = _identify_many([(img, detections)], k, rerank_persons)
+    return status, per_image[0]
 
-        print(f"✅ Query embedding shape: {query_embedding.shape}")
 
-        # Normalize query embedding to unit length for consistent similarity
+def _identify_many(items, k, rerank_persons=GALLERY_RERANK_PERSONS):
+    """
+    _identify for several (img, detections) pairs with one embedding batch,
+    one index query and one name lookup in total. Returns (status, one
+    [(detection, face result), ...] list per pair); status is "NoFace" only
+    if no pair has a face.
+    """
+    per_image = embed_many(items)
+    embedded = [face for faces in per_image for face in faces]
+    if not embedded:
+        return "NoFace", [[] for _ in items]
+
+    queries = np.vstack([f['embedding'] for f in embedded])
+    with stage('search'):
+        found = search_index(queries, k, rerank_persons)
+    if found is None:
+        return "NoIndex", [[] for _ in items]
+    S, I, labels = found
+
+    hits = []
+    for sim_row, idx_row in zip(S, I):
+        seen, row = set(), []
+        for sim, idx in zip(sim_row, idx_row):
+            if idx < 0 or idx >= len(labels):
+                continue
+            person_id = int(labels[idx])
+            if person_id in seen:
+                continue
+            seen.add(person_id)
+            row.append((person_id, float(sim)))
+        hits.append(row)
+
+    with stage('db'):
+        names = directory.names(pid for row in hits for pid, _ in row)
+
+    results = {}
+    for face, row in zip(embedded, hits):
+        matches = [
+            {'person_id': pid, 'name': names.get(pid), 'match': is_match(sim), **score_fields(sim)}
+            for pid, sim in row
+        ]
+        best = matches[0] if matches else None
+        recognized = best is not None and best['match'] and best['name'] is not None
+        result = {
+            'facial_area': [int(v) for v in face['facial_area']],
+            'detection_confidence': float(face['confidence']),
+            'person_id': best['person_id'] if recognized else None,
+            'name': best['name'] if recognized else 'Unknown',
+            **score_fields(best['cosine'] if best else None),
+            'matches': matches,
+        }
+        results[id(face)] = (face['detection'], result)
+    return "OK", [[results[id(face)] for face in faces] for faces in per_image]
+
+
+def _mode_limits(fast, k, max_faces):
+    """(k, max_faces, rerank_persons) of a request in fast or accurate mode."""
+    if fast:
+        return 1, min(max_faces, FAST_MAX_FACES), FAST_RERANK_PERSONS
+    return k, max_faces, GALLERY_RERANK_PERSONS
+
+
+def _detect(img, fast, max_faces, resize_to=None):
+    if fast:
+        return find_faces(img, max_faces=max_faces, detector_backend=FAST_DETECTOR,
+                          detect_size=resize_to or detect_size_for(img, FAST_DETECT_WIDTH))
+    return find_faces(img, max_faces=max_faces, detector_backend=RECOGNITION_DETECTOR, detect_size=resize_to)
+
+
+def recognize_faces(img, k=1, resize_to=None, max_faces=MAX_FACES_PER_FRAME, tracker=None, fast=False):
+    """
+    Recognize every face in `img` (path, encoded bytes or BGR array), largest first.
+    All face embeddings are searched in one batched index query and names
+    are resolved through the person directory (at most one DB query).
+    Returns (status, faces): status is "OK", "NoFace" or "NoIndex"; each face is
+    a dict with facial_area (x, y, w, h), detection_confidence, the best match
+    (person_id, name and the scoring.score_fields values) and `matches`, the
+    top-k distinct identities for that face.
+    With a tracking.FaceTracker (one per camera session), faces that continue
+    a confidently identified track reuse its identity without running the
+    model; those faces have `tracked` True. Every face then has a `track_id`.
+    Faces are found with RECOGNITION_DETECTOR (by default the detector
+    cascade, see detectors.py: empty frames end after the cheap first stage).
+    fast=True trades accuracy for latency: FAST_DETECTOR on a copy at most
+    FAST_DETECT_WIDTH px wide, at most FAST_MAX_FACES faces and a top-1
+    search over FAST_RERANK_PERSONS candidates (embedding is unchanged, one
+    batched model pass either way).
+    """
+    with stage('decode'):
+        img = load_image(img)
+    k, max_faces, rerank_persons = _mode_limits(fast, k, max_faces)
+    detections = _detect(img, fast, max_faces, resize_to)
+    print(f"📊 Face detection returned {len(detections)} face(s)")
+
+    if tracker is None:
+        if not detections:
+            return "NoFace", []
+        status, results = _identify(img, detections, k, rerank_persons)
+        return status, [result for _, result in results]
+
+    with tracker.lock:
+        now = time.monotonic()
+        tracks = tracker.assign([det['box'] for det in detections], now)
+        if not detections:
+            return "NoFace", []
+
+        todo = [det for det, track in zip(detections, tracks) if track.needs_verify(now)]
+        fresh = {}
+        if todo:
+            status, results = _identify(img, todo, k, rerank_persons)
+            if status == "NoIndex":
+                return status, []
+            fresh = {id(det): result for det, result in results}
+
+        faces = []
+        for det, track in zip(detections, tracks):
+            result = fresh.get(id(det))
+            if result is not None:
+                tracker.record(track, result, verified=True, now=now)
+                face = dict(result, tracked=False)
+            elif track.result is not None:
+                tracker.record(track, track.result, verified=False, now=now)
+                face = dict(track.result, tracked=True,
+                            facial_area=[int(v) for v in det['box']],
+                            detection_confidence=float(det['confidence']))
+            else:
+                continue
+            face['track_id'] = track.id
+            faces.append(face)
+
+    if not faces:
+        return "NoFace", []
+    return "OK", faces
+
+
+def recognize_batch(images, k=1, max_faces=MAX_FACES_PER_FRAME, fast=False):
+    """
+    recognize_faces for a list of images (paths, encoded bytes or BGR
+    arrays): one detector pass per image, then one embedding batch, one
+    index search and one name lookup for all faces of all images. Returns
+    one (status, faces) per image, in order; status is "Invalid" for an
+    image that cannot be decoded.
+    """
+    k, max_faces, rerank_persons = _mode_limits(fast, k, max_faces)
+    items, invalid = [], set()
+    for n, img in enumerate(images):
         try:
-            qnorm = np.linalg.norm(query_embedding, axis=1, keepdims=True)
-            qnorm[qnorm == 0] = 1.0
-            query_embedding = query_embedding / qnorm
-        except Exception:
-            pass
-
-        index, labels = load_index()
-        print(f"📁 FAISS index: {'exists' if index is not None else 'None'}")
-        print(f"🏷️ Labels: {'exists' if labels is not None else 'None'}")
-
-        if index is None or labels is None:
-            print("❌ FAISS index or labels missing")
-            return "NoIndex", None
-
-        print(f"🔍 Searching in index with {len(labels)} entries")
-        D, I = index.search(query_embedding, k)
-        distance = float(D[0][0])
-        person_id = int(labels[I[0][0]])
-
-        print(f"🎯 Closest match: ID={person_id}, distance={distance}")
-
-        if distance > SIM_THRESHOLD:
-            print(f"❌ Distance {distance} > threshold {SIM_THRESHOLD}, returning Unknown")
-            return "Unknown", float(distance)
-
-        session = SessionLocal()
-        person = session.query(Person).filter_by(id=person_id).first()
-        session.close()
-
-        if person:
-            print(f"✅ Found person: {person.name}")
-            return person.name, float(distance)
+            with stage('decode'):
+                img = load_image(img)
+        except ValueError:
+            invalid.add(n)
+            items.append((None, []))
+            continue
+        items.append((img, _detect(img, fast, max_faces)))
+    print(f"📊 Face detection returned {sum(len(d) for _, d in items)} face(s) in {len(items)} image(s)")
+
+    status, per_image = _identify_many(items, k, rerank_persons)
+    out = []
+    for n, results in enumerate(per_image):
+        if n in invalid:
+            out.append(("Invalid", []))
+        elif status == "NoIndex":
+            out.append(("NoIndex", []))
+        elif not results:
+            out.append(("NoFace", []))
         else:
-            print(f"❌ Person ID {person_id} not found in database")
-            return "Unknown", float(distance)
+            out.append(("OK", [result for _, result in results]))
+    return out
 
+
+def recognize_face(img, k=1, resize_to=None, fast=False):
+    """
+    Fast + accurate recognition flow:
+    - `img` may be a file path, encoded image bytes or a BGR array; it is kept in memory.
+    - If resize_to is provided, run face detection on a downscaled copy to save time.
+    - Map the detected bbox back to the original image coordinates.
+    - Crop the original image to that bbox and run the model once on the crop for best accuracy.
+    - Search FAISS index and return (name, distance) or ("Unknown", distance) for the largest face.
+      distance is the cosine distance (1 - cosine similarity), see scoring.py.
+    Use recognize_faces() to get every face in the image; fast=True uses its fast mode.
+    """
+    try:
+        return best_match(*recognize_faces(img, k=k, resize_to=resize_to, max_faces=1, fast=fast))
     except Exception as e:
         print(f"❌ Recognition error: {str(e)}")
         import traceback
         print("📋 Traceback:", traceback.format_exc())
         return "Error", None
-    finally:
-        # clean up temp images if created
-        try:
-            if tmp_resized and os.path.exists(tmp_resized):
-                os.remove(tmp_resized)
-                print(f"🧹 Removed temp resized image: {tmp_resized}")
-        except Exception:
-            pass
-        try:
-            if face_crop_path and os.path.exists(face_crop_path):
-                os.remove(face_crop_path)
-                print(f"🧹 Removed temp crop image: {face_crop_path}")
-        except Exception:
-            pass
+
+
+def best_match(status, faces):
+    """(name, distance) of the largest face of one recognize_faces / recognize_batch result."""
+    if status == "Invalid":
+        print("❌ Image could not be decoded")
+        return "Error", None
+    if status == "NoFace":
+        print("⚠️ No faces detected")
+        return "NoFace", None
+    if status == "NoIndex":
+        print("❌ FAISS index or labels missing")
+        return "NoIndex", None
+
+    face = faces[0]
+    if face['cosine'] is None:
+        return "Unknown", None
+    best = face['matches'][0]
+    print(f"🎯 Closest match: ID={best['person_id']}, cosine={best['cosine']:.4f}, distance={best['distance']:.4f}")
+
+    if not best['match']:
+        print(f"❌ Cosine {best['cosine']:.4f} < threshold {SIM_THRESHOLD}, returning Unknown")
+        return "Unknown", best['distance']
+
+    if best['name'] is None:
+        print(f"❌ Person ID {best['person_id']} not found in database")
+        return "Unknown", best['distance']
+
+    print(f"✅ Found person: {best['name']}")
+    return best['name'], best['distance']
@@ -2,10 +2,11 @@ import os
 import shutil
 from database import Base, engine, SessionLocal
 from models import Person
+from config import UPLOAD_FOLDER, SNAPSHOT_PATH, JOURNAL_PATH, INDEX_PATH, LABELS_PATH
 
-DATASET_FOLDER = "dataset"
-INDEX_FILE = "face_index.faiss"
-LABELS_FILE = "face_labels.npy"
+DATASET_FOLDER = UPLOAD_FOLDER
+# Gallery snapshot + journal, and the files of the older gallery format
+GALLERY_FILES = [SNAPSHOT_PATH, JOURNAL_PATH, JOURNAL_PATH + ".lock", INDEX_PATH, LABELS_PATH]
 
 def reset():
     # Xoá database cũ
@@ -17,13 +18,11 @@ def reset():
     session.close()
     print("✅ Database đã reset")
 
-    # Xoá embeddings FAISS
-    if os.path.exists(INDEX_FILE):
-        os.remove(INDEX_FILE)
-        print("✅ Xoá FAISS index")
-    if os.path.exists(LABELS_FILE):
-        os.remove(LABELS_FILE)
-        print("✅ Xoá labels file")
+    # Xoá embeddings FAISS (snapshot, journal và định dạng cũ)
+    for path in GALLERY_FILES:
+        if os.path.exists(path):
+            os.remove(path)
+            print(f"✅ Xoá {os.path.basename(path)}")
 
     # Xoá dataset (ảnh cũ)
     if os.path.exists(DATASET_FOLDER):
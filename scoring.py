@@ -0,0 +1,45 @@
+"""
+Single scoring model shared by every recognition path.
+Gallery vectors and queries are unit length, so any FAISS metric maps to
+cosine similarity without reconstructing the stored vectors:
+  inner product index: D = cos
+  squared L2 index:    D = 2 - 2 * cos
+Decisions use one threshold on cosine similarity (SIM_THRESHOLD); the other
+response fields are derived from the same number.
+"""
+
+import numpy as np
+import faiss
+
+from config import SIM_THRESHOLD
+
+
+def similarity_from_search(D, metric_type):
+    """Convert FAISS search scores to cosine similarity in [-1, 1]."""
+    D = np.asarray(D, dtype='float32')
+    if metric_type == faiss.METRIC_INNER_PRODUCT:
+        sim = D
+    else:
+        sim = 1.0 - D / 2.0
+    return np.clip(sim, -1.0, 1.0)
+
+
+def is_match(similarity, threshold=SIM_THRESHOLD):
+    return similarity is not None and float(similarity) >= threshold
+
+
+def score_fields(similarity):
+    """
+    Response fields for one match:
+    cosine (similarity), distance (cosine distance, 1 - cos),
+    l2 (Euclidean distance between unit vectors) and confidence (cos mapped to [0, 1]).
+    """
+    if similarity is None:
+        return {'cosine': None, 'distance': None, 'l2': None, 'confidence': 0.0}
+    sim = float(similarity)
+    return {
+        'cosine': sim,
+        'distance': 1.0 - sim,
+        'l2': float(np.sqrt(max(0.0, 2.0 - 2.0 * sim))),
+        'confidence': max(0.0, min(1.0, (sim + 1.0) / 2.0)),
+    }
@@ -0,0 +1,60 @@
+"""
+Multi-process serving: one inference process holding the model, N HTTP
+worker processes sharing it, and the FAISS gallery memory-mapped once.
+
+    python serve.py [workers]        # default SERVE_WORKERS
+
+Starts inference_server.py, waits until it listens, then runs app_asgi on
+uvicorn with INFERENCE_ADDRESS/INDEX_MMAP set for the workers, so each
+worker holds neither a model copy nor a private index copy.
+The inference socket key (INFERENCE_AUTHKEY) is a fresh random secret per
+launch, handed to the inference process and the workers only.
+"""
+
+import os
+import secrets
+import sys
+import time
+import multiprocessing as mp
+
+from config import INFERENCE_ADDRESS, SERVE_WORKERS, SERVE_HOST, SERVE_PORT
+
+DEFAULT_ADDRESS = os.path.join('embeddings', 'inference.sock')
+
+
+def _run_inference_server(address, authkey, ready):
+    from inference_server import serve
+    serve(address, authkey, ready=ready)
+
+
+def main(workers=SERVE_WORKERS):
+    import uvicorn
+
+    address = INFERENCE_ADDRESS or (r'\\.\pipe\face-recognition' if os.name == 'nt' else DEFAULT_ADDRESS)
+    ctx = mp.get_context('spawn')
+    ready = ctx.Event()
+    authkey = secrets.token_bytes(32).hex()
+    server = ctx.Process(target=_run_inference_server, args=(address, authkey, ready),
+                         name='inference-server', daemon=True)
+    started = time.time()
+    server.start()
+    # Model load can take a while on first start (weights download)
+    while not ready.wait(1):
+        if not server.is_alive():
+            print("❌ Inference server exited during startup")
+            sys.exit(1)
+    print(f"✅ Inference server ready in {time.time() - started:.1f}s")
+
+    # Inherited by the uvicorn worker processes (read by config at import)
+    os.environ['INFERENCE_ADDRESS'] = address
+    os.environ['INFERENCE_AUTHKEY'] = authkey
+    os.environ['INDEX_MMAP'] = '1'
+    try:
+        uvicorn.run('app_asgi:app', host=SERVE_HOST, port=SERVE_PORT, workers=workers)
+    finally:
+        server.terminate()
+        server.join(5)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else SERVE_WORKERS)
@@ -0,0 +1,184 @@
+"""
+Versioned gallery snapshot file.
+One file holds a FAISS index, named array blocks (vectors, labels, ...) and
+a metadata table; it is written to a temporary file, fsynced and renamed
+over the previous snapshot, so readers see either the old or the new
+gallery, never a half-written one.
+
+File layout (little-endian, blocks 64-byte aligned):
+  index block   faiss.write_index output at offset 0, so faiss can open the
+                file itself (and memory-map it with IO_FLAG_MMAP)
+  array blocks  raw C-order arrays, e.g. "vectors" (count x dim float32)
+                and "labels" (count int64); see embeddings.IndexCache
+  metadata      UTF-8 JSON object (index params, journal position, ...)
+  header        at the end of the file: magic b'FGAL', format version,
+                dim, count, model id, a table of (name, dtype, columns,
+                offset, length) per block, crc32 of all that, the header
+                length and the magic again
+The header is the trailer so that the index block can start at offset 0;
+being written last, a truncated file has no valid header and is rejected.
+With mmap=True array blocks are opened with np.memmap (no copy, pages are
+read only when used), otherwise they are read into memory and the file is
+closed, so it can be replaced even where open files cannot be renamed over
+(Windows).
+"""
+
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+import faiss
+
+MAGIC = b'FGAL'
+VERSION = 2
+_ALIGN = 64
+# magic, version, block count, dim, count, model id
+_FIELDS = struct.Struct('<4sHHIQ64s')
+# name, dtype ('f4', 'i8' or 'js'), columns, offset, length
+_BLOCK = struct.Struct('<16s2sHQQ')
+# crc32, header length, magic
+_TAIL = struct.Struct('<II4s')
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class GallerySnapshot:
+    def __init__(self, index, arrays, metadata, model_id, version):
+        self.index = index
+        self.arrays = arrays
+        self.metadata = metadata
+        self.model_id = model_id
+        self.version = version
+
+    @property
+    def vectors(self):
+        return self.arrays['vectors']
+
+    @property
+    def labels(self):
+        return self.arrays['labels']
+
+
+def _pad(f):
+    pos = f.tell()
+    if pos % _ALIGN:
+        f.write(b'\0' * (_ALIGN - pos % _ALIGN))
+    return f.tell()
+
+
+def write_snapshot(path, index, arrays, metadata=None, model_id=''):
+    """
+    Atomically write `index` and the named float32/int64 `arrays` (at least
+    "vectors", count x dim, and "labels", count) to `path`.
+    """
+    arrays = {name: np.ascontiguousarray(a, dtype='<f4' if np.asarray(a).dtype.kind == 'f' else '<i8')
+              for name, a in arrays.items()}
+    vectors, labels = arrays['vectors'].reshape(-1, index.d), arrays['labels']
+    arrays['vectors'] = vectors
+    if len(vectors) != len(labels):
+        raise SnapshotError(f"vectors/labels size mismatch ({len(vectors)} != {len(labels)})")
+    model_bytes = model_id.encode('utf-8')
+    if len(model_bytes) > 64:
+        raise SnapshotError(f"model id longer than 64 bytes: {model_id}")
+    metadata = dict(metadata or {}, created=time.time())
+
+    tmp_path = path + '.tmp'
+    faiss.write_index(index, tmp_path)
+    with open(tmp_path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        table = [_BLOCK.pack(b'index', b'fa', 0, 0, f.tell())]
+        for name, a in arrays.items():
+            if len(name) > 16:
+                raise SnapshotError(f"block name longer than 16 bytes: {name}")
+            offset = _pad(f)
+            f.write(a.tobytes())
+            cols = a.shape[1] if a.ndim == 2 else 1
+            table.append(_BLOCK.pack(name.encode('ascii'), a.dtype.str[1:].encode('ascii'), cols, offset, a.nbytes))
+        offset = _pad(f)
+        meta = json.dumps(metadata).encode('utf-8')
+        f.write(meta)
+        table.append(_BLOCK.pack(b'metadata', b'js', 0, offset, len(meta)))
+
+        header = _FIELDS.pack(MAGIC, VERSION, len(table), index.d, len(labels), model_bytes) + b''.join(table)
+        f.write(header + _TAIL.pack(zlib.crc32(header), len(header) + _TAIL.size, MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    """Return the decoded header dict of a snapshot file; raises SnapshotError if invalid."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size < _FIELDS.size + _TAIL.size:
+            raise SnapshotError(f"{path}: too short for a gallery snapshot")
+        f.seek(size - _TAIL.size)
+        crc, header_len, end_magic = _TAIL.unpack(f.read(_TAIL.size))
+        header = None
+        if end_magic == MAGIC and _FIELDS.size + _TAIL.size <= header_len <= size:
+            f.seek(size - header_len)
+            header = f.read(header_len - _TAIL.size)
+        if header is None or header[:4] != MAGIC:
+            raise SnapshotError(f"{path}: not a gallery snapshot")
+        if zlib.crc32(header) != crc:
+            raise SnapshotError(f"{path}: header checksum mismatch")
+        magic, version, nblocks, dim, count, model_bytes = _FIELDS.unpack_from(header)
+        if version != VERSION:
+            raise SnapshotError(f"{path}: unsupported snapshot version {version} (expected {VERSION})")
+        blocks = {}
+        for i in range(nblocks):
+            name, dtype, cols, offset, length = _BLOCK.unpack_from(header, _FIELDS.size + i * _BLOCK.size)
+            blocks[name.rstrip(b'\0').decode('ascii')] = (dtype.decode('ascii'), cols, offset, length)
+        data_end = size - header_len
+    if any(offset + length > data_end for _, _, offset, length in blocks.values()):
+        raise SnapshotError(f"{path}: block past end of file")
+    return {
+        'version': version,
+        'dim': dim,
+        'count': count,
+        'model_id': model_bytes.rstrip(b'\0').decode('utf-8'),
+        'blocks': blocks,
+    }
+
+
+def _read_array(f, path, dtype, cols, offset, length, mmap):
+    itemsize = np.dtype(dtype).itemsize
+    rows = length // (itemsize * max(cols, 1))
+    shape = (rows, cols) if cols > 1 else (rows,)
+    if not rows:
+        return np.zeros(shape, dtype=dtype)
+    if mmap:
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    f.seek(offset)
+    return np.fromfile(f, dtype=dtype, count=rows * max(cols, 1)).reshape(shape)
+
+
+def read_snapshot(path, mmap=False):
+    """
+    Open a snapshot. With mmap=True the FAISS index and the array blocks
+    are memory-mapped read-only (shared page cache, no per-process copy),
+    otherwise everything is loaded into memory and no handle stays open.
+    """
+    header = read_header(path)
+    blocks, dim, count = header['blocks'], header['dim'], header['count']
+
+    index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0)
+    if index.d != dim:
+        raise SnapshotError(f"{path}: index has dim {index.d}, header says {dim}")
+    arrays, metadata = {}, {}
+    with open(path, 'rb') as f:
+        for name, (dtype, cols, offset, length) in blocks.items():
+            if dtype == 'js':
+                f.seek(offset)
+                metadata = json.loads(f.read(length).decode('utf-8') or '{}')
+            elif dtype in ('f4', 'i8'):
+                arrays[name] = _read_array(f, path, '<' + dtype, cols, offset, length, mmap)
+    if len(arrays.get('vectors', ())) != count or len(arrays.get('labels', ())) != count:
+        raise SnapshotError(f"{path}: vector/label blocks do not match count {count}")
+    return GallerySnapshot(index, arrays, metadata, header['model_id'], header['version'])
@@ -0,0 +1,178 @@
+"""
+Cold start: model warm-up, index preload and readiness.
+TensorFlow/DeepFace are imported on first use (face_pipeline), so importing
+an app is quick and liveness is answered right away. `run()` then prepares
+everything the first request would otherwise pay for, one timed phase each:
+  imports    from importing this module to run() (app modules, OpenCV, FAISS)
+  model      build the recognition model on the inference worker
+  detect     one pass of each detector (FACE_DETECTOR, RECOGNITION_DETECTOR,
+             FAST_DETECTOR) on the warm-up image
+  embed      warm-up embedding batches (1 crop and INFERENCE_MAX_BATCH_SIZE crops)
+  index      load the gallery snapshot + journal and run one search
+  directory  person names/photos
+The service is ready once the model, detect and embed phases succeeded
+(an empty gallery is fine).
+
+    GET /health/live   200 while the process serves requests
+    GET /health/ready  503 until ready, then 200; both with phase timings
+
+While starting, model requests get 503 + Retry-After (STARTUP_REJECT_UNTIL_READY)
+instead of queueing behind the warm-up. If warm-up fails they are let
+through again and load the model lazily, as before.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from config import (FACE_DETECTOR, RECOGNITION_DETECTOR, FAST_DETECTOR, INFERENCE_MAX_BATCH_SIZE,
+                    STARTUP_WARMUP_IMAGE, STARTUP_REJECT_UNTIL_READY)
+import metrics
+
+# Phases that must succeed for the service to be ready
+REQUIRED = ('model', 'detect', 'embed')
+
+_imported_at = time.perf_counter()
+
+
+class Startup:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = 'starting'  # starting | ready | failed
+        self.phases = {}  # name -> {'ms', 'ok', 'error'?}
+        self.started_at = time.time()
+        self.ready_at = None
+        self._thread = None
+
+    def record(self, name, seconds, error=None):
+        entry = {'ms': round(seconds * 1000.0, 1), 'ok': error is None}
+        if error is not None:
+            entry['error'] = str(error) or type(error).__name__
+        with self._lock:
+            self.phases[name] = entry
+        mark = '✅' if error is None else '❌'
+        print(f"{mark} Startup {name}: {entry['ms']} ms" + (f" ({error})" if error is not None else ''))
+
+    def phase(self, name, fn, *args, **kwargs):
+        """Run one phase, timing it; returns fn's result, or None if it failed."""
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record(name, time.perf_counter() - start, e)
+            return None
+        self.record(name, time.perf_counter() - start)
+        return result
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def accepting(self):
+        """False while model requests should be turned away (still warming up)."""
+        return self.state != 'starting' or not STARTUP_REJECT_UNTIL_READY
+
+    def run(self):
+        """Run all phases (blocking). Returns True if the service is ready."""
+        self.record('imports', time.perf_counter() - _imported_at)
+        from face_pipeline import get_worker, warm_up
+
+        worker = get_worker()
+        self.phase('model', worker.call, warm_up)
+        img = self.phase('detect', _warm_detectors)
+        vector = self.phase('embed', _warm_embedding, img) if img is not None else None
+        self.phase('index', _warm_index, vector)
+        from person_directory import directory
+        self.phase('directory', directory.load)
+
+        with self._lock:
+            failed = [name for name in REQUIRED if not self.phases.get(name, {}).get('ok')]
+            self.state = 'failed' if failed else 'ready'
+            self.ready_at = time.time()
+        total = self.ready_at - self.started_at
+        if failed:
+            print(f"⚠️ Startup finished in {total:.1f}s, not ready (failed: {', '.join(failed)})")
+        else:
+            print(f"🚀 Ready in {total:.1f}s")
+        return not failed
+
+    def start(self):
+        """Run the phases on a background thread (once); the server keeps answering meanwhile."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run, name='startup', daemon=True)
+        self._thread.start()
+
+    def status(self):
+        with self._lock:
+            phases = dict(self.phases)
+            ready_at = self.ready_at
+        return {
+            'state': self.state,
+            'ready': self.ready,
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'startup_seconds': round(ready_at - self.started_at, 2) if ready_at else None,
+            'phases_ms': {name: p['ms'] for name, p in phases.items()},
+            'errors': {name: p['error'] for name, p in phases.items() if 'error' in p},
+        }
+
+
+def _warmup_image():
+    """The warm-up image (BGR): STARTUP_WARMUP_IMAGE, or a synthetic frame if it is missing."""
+    from imaging import load_image
+    if STARTUP_WARMUP_IMAGE and os.path.isfile(STARTUP_WARMUP_IMAGE):
+        try:
+            return load_image(STARTUP_WARMUP_IMAGE)
+        except Exception as e:
+            print(f"⚠️ Warm-up image unreadable, using a synthetic one: {e}")
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=(480, 640, 3), dtype=np.uint8)
+
+
+def _warm_detectors():
+    """One pass of each configured detector; returns (img, detections of FACE_DETECTOR)."""
+    from face_pipeline import find_faces
+    img = _warmup_image()
+    detections = find_faces(img, max_faces=1, detector_backend=FACE_DETECTOR)
+    for backend in sorted({RECOGNITION_DETECTOR, FAST_DETECTOR} - {FACE_DETECTOR, ''}):
+        find_faces(img, max_faces=1, detector_backend=backend)
+    return img, detections
+
+
+def _warm_embedding(found):
+    """Embed the warm-up face (or a centre crop) alone and as a full batch; returns its vector."""
+    from face_pipeline import embed_detections, embed_faces
+    img, detections = found
+    faces = embed_detections(img, detections) if detections else []
+    if faces:
+        crop_vector = faces[0]['embedding']
+    else:
+        h, w = img.shape[:2]
+        side = min(h, w) // 2
+        crop = img[(h - side) // 2:(h + side) // 2, (w - side) // 2:(w + side) // 2]
+        crop_vector = embed_faces([crop])[0]
+    if INFERENCE_MAX_BATCH_SIZE > 1:
+        h, w = img.shape[:2]
+        embed_faces([img[:h // 2, :w // 2]] * INFERENCE_MAX_BATCH_SIZE)
+    return crop_vector
+
+
+def _warm_index(vector):
+    """Load the served gallery and, with a warm-up vector, run one search through it."""
+    from embeddings import index_info, search_index
+    info = index_info()
+    if info is not None and vector is not None:
+        search_index(np.asarray(vector, dtype='float32')[np.newaxis, :], k=1)
+    return info
+
+
+startup = Startup()
+
+metrics.registry.gauge('face_ready', 'Whether startup warm-up finished (1 = ready)',
+                       lambda: int(startup.ready))
+metrics.registry.gauge('face_startup_phase_seconds', 'Duration of each startup phase',
+                       lambda: {name: ms / 1000.0 for name, ms in startup.status()['phases_ms'].items()},
+                       label='phase')
@@ -0,0 +1,199 @@
+"""
+Per-camera frame streams with newest-frame-only processing.
+Clients push frames for a camera as fast as they like; each camera keeps a
+single frame slot, so a frame that has not been picked up yet is replaced
+(and counted as dropped) when a newer one arrives. One worker thread per
+camera processes the newest frame and publishes the result to every
+subscriber (the server-sent events endpoint in app_realtime.py). Latency
+stays bounded by one processing time under load instead of growing with a
+request queue. A camera's worker exits after STREAM_IDLE_SECONDS without
+frames or subscribers; at most STREAM_MAX_CAMERAS cameras stream at once.
+Frames arrive one POST each or, persistently, over a WebSocket that also
+carries the results back (see app_asgi.py / app_realtime.py).
+"""
+
+import queue
+import threading
+import time
+
+from config import STREAM_IDLE_SECONDS, STREAM_MAX_CAMERAS
+from metrics import stream_frames, stream_latency_seconds
+
+
+class StreamLimitReached(RuntimeError):
+    """Raised for a new camera id while STREAM_MAX_CAMERAS cameras are streaming."""
+
+
+class CameraStream:
+    def __init__(self, camera_id, process_fn, idle_seconds=STREAM_IDLE_SECONDS, on_exit=None):
+        """
+        process_fn(frame, context) -> dict runs on the camera's worker thread
+        for the newest frame; `context` is whatever was passed to push().
+        """
+        self.camera_id = camera_id
+        self.process_fn = process_fn
+        self.idle_seconds = idle_seconds
+        self.on_exit = on_exit
+        self._cond = threading.Condition()
+        self._slot = None
+        self._subscribers = []
+        self._closed = False
+        self._last_activity = time.monotonic()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.last_latency_ms = None
+        self._thread = threading.Thread(target=self._run, name=f'stream-{camera_id}', daemon=True)
+        self._thread.start()
+
+    def push(self, frame, context=None):
+        """Offer a frame. Returns its sequence number, or None if the stream has shut down."""
+        with self._cond:
+            if self._closed:
+                return None
+            self.received += 1
+            if self._slot is not None:
+                self.dropped += 1
+                stream_frames.inc(camera=self.camera_id, outcome='dropped')
+            self._slot = (self.received, frame, context, time.monotonic())
+            self._last_activity = time.monotonic()
+            self._cond.notify()
+            return self.received
+
+    def subscribe(self, callback=None):
+        """
+        Return a queue receiving each published result (oldest dropped if the
+        reader lags), or None if the stream has shut down. With `callback`,
+        callback(result) is called on the stream thread instead and returned
+        as the subscription handle (used by the asyncio app).
+        """
+        subscriber = callback if callback is not None else queue.Queue(maxsize=2)
+        with self._cond:
+            if self._closed:
+                return None
+            self._subscribers.append(subscriber)
+            self._last_activity = time.monotonic()
+        return subscriber
+
+    def unsubscribe(self, q):
+        with self._cond:
+            if q in self._subscribers:
+                self._subscribers.remove(q)
+            self._last_activity = time.monotonic()
+
+    def is_closed(self):
+        return self._closed
+
+    def stats(self):
+        with self._cond:
+            return {
+                'camera_id': self.camera_id,
+                'received': self.received,
+                'processed': self.processed,
+                'dropped': self.dropped,
+                'pending': self._slot is not None,
+                'subscribers': len(self._subscribers),
+                'last_latency_ms': self.last_latency_ms,
+            }
+
+    def _publish(self, result):
+        with self._cond:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            if callable(q):
+                try:
+                    q(result)
+                except Exception as e:
+                    print(f"⚠️ Stream {self.camera_id} subscriber error: {e}")
+                continue
+            while True:
+                try:
+                    q.put_nowait(result)
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._slot is None:
+                    idle = time.monotonic() - self._last_activity
+                    if idle >= self.idle_seconds and not self._subscribers:
+                        self._closed = True
+                        break
+                    self._cond.wait(timeout=max(0.1, self.idle_seconds - idle))
+                if self._closed:
+                    break
+                seq, frame, context, received_at = self._slot
+                self._slot = None
+
+            try:
+                result = self.process_fn(frame, context)
+            except Exception as e:
+                print(f"❌ Stream {self.camera_id} frame error: {e}")
+                result = {'status': 'error', 'message': str(e)}
+
+            latency_ms = (time.monotonic() - received_at) * 1000.0
+            with self._cond:
+                self.processed += 1
+                self.last_latency_ms = round(latency_ms, 1)
+                dropped = self.dropped
+            stream_frames.inc(camera=self.camera_id, outcome='processed')
+            stream_latency_seconds.observe(latency_ms / 1000.0)
+            result = dict(result, camera_id=self.camera_id, seq=seq,
+                          latency_ms=round(latency_ms, 1), dropped=dropped)
+            self._publish(result)
+
+        if self.on_exit is not None:
+            self.on_exit(self)
+
+
+class StreamRegistry:
+    """Camera id -> CameraStream, creating streams on first use (up to max_streams)."""
+
+    def __init__(self, process_fn, idle_seconds=STREAM_IDLE_SECONDS, max_streams=STREAM_MAX_CAMERAS):
+        self.process_fn = process_fn
+        self.idle_seconds = idle_seconds
+        self.max_streams = max_streams
+        self._lock = threading.Lock()
+        self._streams = {}
+
+    def get(self, camera_id):
+        with self._lock:
+            stream = self._streams.get(camera_id)
+            if stream is None or stream.is_closed():
+                live = sum(1 for s in self._streams.values() if not s.is_closed())
+                if live >= self.max_streams:
+                    raise StreamLimitReached(f"Too many camera streams (max {self.max_streams})")
+                stream = CameraStream(camera_id, self.process_fn, self.idle_seconds, on_exit=self._remove)
+                self._streams[camera_id] = stream
+            return stream
+
+    def push(self, camera_id, frame, context=None):
+        """Push a frame to a camera's stream. Returns (stream, seq)."""
+        while True:
+            stream = self.get(camera_id)
+            seq = stream.push(frame, context)
+            if seq is not None:
+                return stream, seq
+
+    def subscribe(self, camera_id, callback=None):
+        """Subscribe to a camera's results. Returns (stream, queue or callback)."""
+        while True:
+            stream = self.get(camera_id)
+            q = stream.subscribe(callback)
+            if q is not None:
+                return stream, q
+
+    def _remove(self, stream):
+        with self._lock:
+            if self._streams.get(stream.camera_id) is stream:
+                del self._streams[stream.camera_id]
+
+    def stats(self):
+        with self._lock:
+            streams = list(self._streams.values())
+        return [s.stats() for s in streams]
@@ -0,0 +1,163 @@
+"""
+Per-camera face tracking across frames.
+Detections in a new frame are matched to the camera's existing tracks by
+box overlap (IoU), falling back to centroid distance for fast motion. A
+matched track keeps its identity, so the embedding model and index search
+run again only when
+  - the track is new,
+  - its last match was not confidently above SIM_THRESHOLD
+    (cosine < SIM_THRESHOLD + TRACK_VERIFY_MARGIN), or
+  - TRACK_REVERIFY_SECONDS have passed since it was last verified.
+Tracks not seen for TRACK_MAX_AGE_SECONDS are dropped; a camera's tracker
+is dropped after TRACK_SESSION_TTL_SECONDS without frames.
+"""
+
+import itertools
+import threading
+import time
+
+from config import (SIM_THRESHOLD, TRACK_IOU_MIN, TRACK_REVERIFY_SECONDS, TRACK_VERIFY_MARGIN,
+                    TRACK_MAX_AGE_SECONDS, TRACK_SESSION_TTL_SECONDS)
+from metrics import cache_requests
+
+_track_ids = itertools.count(1)
+
+
+def box_iou(a, b):
+    """IoU of two (x, y, w, h) boxes."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = min(ax + aw, bx + bw) - max(ax, bx)
+    ih = min(ay + ah, by + bh) - max(ay, by)
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    inter = float(iw * ih)
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def _centroid_close(a, b):
+    """Centers within half a face width and similar size (fast motion, IoU too low)."""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    dx = (ax + aw / 2.0) - (bx + bw / 2.0)
+    dy = (ay + ah / 2.0) - (by + bh / 2.0)
+    size = max(aw, ah, bw, bh, 1)
+    ratio = (aw * ah) / float(max(1, bw * bh))
+    return (dx * dx + dy * dy) ** 0.5 < 0.5 * size and 0.5 <= ratio <= 2.0
+
+
+class Track:
+    def __init__(self, box, now):
+        self.id = next(_track_ids)
+        self.box = tuple(box)
+        self.created = now
+        self.last_seen = now
+        self.last_verified = None
+        self.result = None
+        self.verifications = 0
+        self.frames = 0
+
+    def needs_verify(self, now):
+        if self.result is None or self.last_verified is None:
+            return True
+        cosine = self.result.get('cosine')
+        if self.result.get('person_id') is None or cosine is None or cosine < SIM_THRESHOLD + TRACK_VERIFY_MARGIN:
+            return True
+        return now - self.last_verified >= TRACK_REVERIFY_SECONDS
+
+
+class FaceTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tracks = []
+        self.last_used = time.monotonic()
+        self.frames = 0
+        self.embedded = 0
+        self.reused = 0
+
+    def assign(self, boxes, now=None):
+        """
+        Match this frame's boxes to tracks (greedy by IoU, then centroid).
+        Unmatched boxes start new tracks; tracks unseen for
+        TRACK_MAX_AGE_SECONDS are dropped. Returns one Track per box.
+        """
+        now = time.monotonic() if now is None else now
+        self.last_used = now
+        self.frames += 1
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= TRACK_MAX_AGE_SECONDS]
+
+        pairs = []
+        for i, box in enumerate(boxes):
+            for track in self.tracks:
+                iou = box_iou(box, track.box)
+                if iou >= TRACK_IOU_MIN:
+                    pairs.append((iou, i, track))
+                elif _centroid_close(box, track.box):
+                    pairs.append((0.0, i, track))
+        pairs.sort(key=lambda p: p[0], reverse=True)
+
+        assigned, used = {}, set()
+        for _, i, track in pairs:
+            if i in assigned or track.id in used:
+                continue
+            assigned[i] = track
+            used.add(track.id)
+
+        result = []
+        for i, box in enumerate(boxes):
+            track = assigned.get(i)
+            if track is None:
+                track = Track(box, now)
+                self.tracks.append(track)
+            track.box = tuple(box)
+            track.last_seen = now
+            track.frames += 1
+            result.append(track)
+        return result
+
+    def record(self, track, result, verified, now=None):
+        """Store a track's latest recognition result; `verified` if it came from the model."""
+        if verified:
+            track.result = dict(result)
+            track.last_verified = time.monotonic() if now is None else now
+            track.verifications += 1
+            self.embedded += 1
+            cache_requests.inc(cache='track_identity', result='miss')
+        else:
+            self.reused += 1
+            cache_requests.inc(cache='track_identity', result='hit')
+
+    def stats(self):
+        return {
+            'tracks': len(self.tracks),
+            'frames': self.frames,
+            'embedded': self.embedded,
+            'reused': self.reused,
+        }
+
+
+class TrackerRegistry:
+    """Camera id -> FaceTracker; trackers idle for TRACK_SESSION_TTL_SECONDS are dropped."""
+
+    def __init__(self, ttl_seconds=TRACK_SESSION_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._trackers = {}
+
+    def get(self, camera_id):
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, t in self._trackers.items() if now - t.last_used > self.ttl_seconds]:
+                del self._trackers[key]
+            tracker = self._trackers.get(camera_id)
+            if tracker is None:
+                tracker = self._trackers[camera_id] = FaceTracker()
+            tracker.last_used = now
+            return tracker
+
+    def stats(self):
+        with self._lock:
+            return {camera_id: t.stats() for camera_id, t in self._trackers.items()}
+
+
+trackers = TrackerRegistry()
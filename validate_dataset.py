@@ -1,34 +1,33 @@
 import os
-from deepface import DeepFace
-from config import DATASET_DIR, FACE_MODEL
+from config import UPLOAD_FOLDER as DATASET_DIR, FACE_DETECTOR
+from face_pipeline import extract_embeddings
 
 def validate_dataset():
     total, success, fail = 0, 0, 0
 
-    for person in os.listdir(DATASET_DIR):
-        person_dir = os.path.join(DATASET_DIR, person)
-        if not os.path.isdir(person_dir):
-            continue
+    # Ảnh nằm trực tiếp trong dataset/ hoặc trong thư mục con theo người
+    paths = []
+    for entry in sorted(os.listdir(DATASET_DIR)):
+        path = os.path.join(DATASET_DIR, entry)
+        if os.path.isdir(path):
+            paths += [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        elif entry.lower().endswith(('.jpg', '.jpeg', '.png')):
+            paths.append(path)
 
-        for img_name in os.listdir(person_dir):
-            img_path = os.path.join(person_dir, img_name)
-            total += 1
-            try:
-                reps = DeepFace.represent(
-                    img_path=img_path,
-                    model_name=FACE_MODEL,
-                    detector_backend="retinaface",  # thử backend tốt hơn
-                    enforce_detection=False
-                )
-                if isinstance(reps, list) and len(reps) > 0 and "embedding" in reps[0]:
-                    success += 1
-                    print(f"✅ OK: {img_path}")
-                else:
-                    fail += 1
-                    print(f"⚠️ Fail: {img_path}")
-            except Exception as e:
+    for img_path in paths:
+        total += 1
+        try:
+            # Cùng detector với lúc đăng ký (FACE_DETECTOR), không hard-code backend riêng
+            faces = extract_embeddings(img_path, detector_backend=FACE_DETECTOR)
+            if faces:
+                success += 1
+                print(f"✅ OK: {img_path}")
+            else:
                 fail += 1
-                print(f"❌ Error {img_path}: {e}")
+                print(f"⚠️ Fail: {img_path}")
+        except Exception as e:
+            fail += 1
+            print(f"❌ Error {img_path}: {e}")
 
     print("\n📊 Report")
     print(f"Tổng số ảnh: {total}")